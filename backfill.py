@@ -0,0 +1,41 @@
+#Backfill of readings missed during network outages, polls fetch only the newest entries after
+#reconnect, so gaps between stored readings are fetched later in small pages between polls.
+#Gaps are checked from the oldest one, backend returns the newest entries of the range first,
+#so full page leaves smaller gap below it and page with fewer entries completes the gap.
+#Everything up to the end of completed gap is checked, missing readings aren't requested again
+
+GAP = 450 #sec, readings further apart miss at least one 5 minute reading
+PAGE = 12 #entries per request
+BUDGET_BYTES = 8192 #response body bytes per backfill cycle
+BUDGET_MS = 5000 #time per backfill cycle
+MIN_IDLE = 60 #sec, backfill runs only if next poll is at least this far
+
+class Backfill:
+  def __init__(self, history, gap=GAP, page=PAGE):
+    self.history = history
+    self.gap = gap
+    self.page = page
+    #gaps ending at this time or earlier are checked
+    self.checked = 0
+    self.range = None
+    self.pages = 0
+    self.bytes = 0
+
+  #returns (start, end) local seconds of the oldest unchecked gap, readings strictly between them are missing
+  def next(self):
+    history = self.history
+    self.range = None
+    prev = None
+    for seconds, sgv, direction in history.items(start=self.checked):
+      if prev != None and seconds - prev > self.gap:
+        self.range = (prev, seconds)
+        break
+      prev = seconds
+    return self.range
+
+  #records page of gap returned by next() with count entries and size body bytes
+  def done(self, count, size):
+    self.pages += 1
+    self.bytes += size
+    if count < self.page: self.checked = self.range[1]
+    self.range = None
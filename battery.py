@@ -0,0 +1,55 @@
+import utime
+from array import array
+
+#Battery state sampled from AXP192 at low rate, voltage is smoothed with exponential moving average
+#so percentage and low battery emergency don't flap, consumers read cached snapshot without I2C access
+
+SAMPLE_INTERVAL = 30 #sec
+SMOOTHING = 0.1 #weight of new sample, averages about last 5 minutes
+
+#discharge curve, percentage between points is interpolated
+MILLIVOLTS = array('H', [3200, 3270, 3610, 3690, 3710, 3730, 3750, 3770, 3790, 3800, 3820, 3840, 3850, 3870, 3910, 3950, 3980, 4020, 4080, 4110, 4150])
+LEVELS = bytearray([0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100])
+EXTERNAL_POWER_MILLIVOLTS = 4200 #reported as 101%
+
+#-1 means battery level is unknown
+def getLevel(millivolts):
+  if millivolts < MILLIVOLTS[0]: return -1
+  if millivolts >= EXTERNAL_POWER_MILLIVOLTS: return 101
+  lo = 0
+  hi = len(MILLIVOLTS) - 1
+  if millivolts >= MILLIVOLTS[hi]: return LEVELS[hi]
+  while hi - lo > 1:
+    mid = (lo + hi) >> 1
+    if MILLIVOLTS[mid] <= millivolts: lo = mid
+    else: hi = mid
+  return LEVELS[lo] + (LEVELS[hi] - LEVELS[lo]) * (millivolts - MILLIVOLTS[lo]) // (MILLIVOLTS[hi] - MILLIVOLTS[lo])
+
+class BatteryMonitor:
+  def __init__(self, axp, interval=SAMPLE_INTERVAL, smoothing=SMOOTHING):
+    self.axp = axp
+    self.interval = interval
+    self.smoothing = smoothing
+    #snapshot
+    self.voltage = None
+    self.level = -1
+    self.charging = False
+    self.time = None
+    self.samples = 0
+
+  #reads AXP192 if snapshot is older than sampling interval, returns True if it was refreshed
+  def update(self, force=False):
+    now = utime.time()
+    if not force and self.time != None and 0 <= now - self.time < self.interval: return False
+    volt = self.axp.getBatVoltage()
+    charging = bool(self.axp.getChargeState())
+    if self.voltage == None or charging != self.charging:
+      #plugging or unplugging charger changes voltage in a step, average is restarted
+      self.voltage = volt
+    else:
+      self.voltage += self.smoothing * (volt - self.voltage)
+    self.charging = charging
+    self.level = getLevel((int)(self.voltage * 1000))
+    self.time = now
+    self.samples += 1
+    return True
@@ -0,0 +1,175 @@
+from array import array
+
+#Glucose level chart of last hours of history, x is projected directly from local epoch seconds
+#Every pixel column keeps first, last, min and max reading falling into it, so drawing is bounded
+#by screen width for any window. Columns are kept in ring indexed by absolute column number,
+#new readings are projected into it and older ones shift left without reprojection
+#Windows longer than raw history are drawn from rolled up buckets, min and max of bucket
+#are projected like readings and mean of buckets is connected with line
+
+WINDOWS = (1, 3, 4, 6, 24, 72, 168, 336) #hours
+RAW_HOURS = 24 #longer windows need rollups
+GAP = 900 #sec, readings further apart aren't connected
+DOT_STEP = 75 #sec, readings are drawn as dots if column covers at most this time
+
+class SgvChart:
+  def __init__(self, history, lcd, width=240, height=136, hours=4, rollups=()):
+    self.history = history
+    self.rollups = rollups
+    self.lcd = lcd
+    self.width = width
+    self.height = height
+    #absolute column number + 1 of projected readings stored in ring slot, 0 is empty slot
+    self.columns = array('I', [0] * width)
+    self.first = array('H', [0] * width)
+    self.last = array('H', [0] * width)
+    self.low = array('H', [0] * width)
+    self.high = array('H', [0] * width)
+    self.setWindow(hours)
+
+  def setHistory(self, history, rollups=()):
+    self.history = history
+    self.rollups = rollups
+    self.setWindow(self.hours)
+
+  #returns the finest rollup covering window or None if window is drawn from history
+  def getRollup(self, hours):
+    if hours <= RAW_HOURS: return None
+    for rollup in self.rollups:
+      if rollup.span() >= hours * 3600: return rollup
+    return None
+
+  def getWindows(self):
+    return [hours for hours in WINDOWS if hours <= RAW_HOURS or self.getRollup(hours) != None]
+
+  def setWindow(self, hours):
+    if not hours in self.getWindows(): hours = 4
+    self.hours = hours
+    self.step = hours * 3600 // self.width #sec per column
+    self.rollup = self.getRollup(hours)
+    self.gap = GAP
+    if self.rollup != None: self.gap = 2 * self.rollup.period
+    self.invalidate()
+
+  def nextWindow(self):
+    windows = self.getWindows()
+    self.setWindow(windows[(windows.index(self.hours) + 1) % len(windows)])
+    return self.hours
+
+  def invalidate(self):
+    for i in range(self.width): self.columns[i] = 0
+    self.newest = 0
+    self.changes = -1
+
+  def project(self, seconds, sgv):
+    column = seconds // self.step
+    i = column % self.width
+    if self.columns[i] != column + 1:
+      self.columns[i] = column + 1
+      self.first[i] = sgv
+      self.last[i] = sgv
+      self.low[i] = sgv
+      self.high[i] = sgv
+    else:
+      self.last[i] = sgv
+      if sgv < self.low[i]: self.low[i] = sgv
+      if sgv > self.high[i]: self.high[i] = sgv
+
+  def projectBucket(self, seconds, low, mean, high):
+    self.project(seconds, mean)
+    i = (seconds // self.step) % self.width
+    if low < self.low[i]: self.low[i] = low
+    if high > self.high[i]: self.high[i] = high
+
+  #buckets are few and may change in the past, so all visible ones are projected again on change
+  def syncRollup(self, now):
+    rollup = self.rollup
+    if self.changes == rollup.changes: return
+    self.invalidate()
+    for seconds, low, mean, high in rollup.items(start=now - self.hours * 3600):
+      self.projectBucket(seconds, low, mean, high)
+    self.changes = rollup.changes
+
+  #projects readings added to history since last sync, all visible readings are projected again
+  #only if history was changed in other way than by appending newer readings
+  def sync(self, now):
+    if self.rollup != None:
+      self.syncRollup(now)
+      return
+    history = self.history
+    appended = 0
+    if self.changes >= 0:
+      for reading in history.items(start=self.newest + 1): appended += 1
+    start = self.newest + 1
+    if self.changes < 0 or history.changes - self.changes != appended:
+      self.invalidate()
+      start = now - self.hours * 3600
+    for seconds, sgv, direction in history.items(start=start):
+      self.project(seconds, sgv)
+      self.newest = seconds
+    self.changes = history.changes
+
+  def getY(self, sgv, flipped):
+    if flipped: return (int)(sgv/2)
+    return (int)(self.height-sgv/2)
+
+  #now is local seconds since device epoch, low and high are glucose levels of range bands
+  #lcd can be replaced with other surface having the same drawing methods
+  def draw(self, now, low, high, flipped=False, lcd=None):
+    if lcd == None: lcd = self.lcd
+    width = self.width
+    height = self.height
+    self.sync(now)
+
+    #horizontal glucose level lines and fills
+    if flipped:
+      maxy = height-(int)(height-(high/2))
+      miny = height-(int)(height-(low/2))
+      lcd.fillRect(0, 0, width, miny, lcd.RED)
+      lcd.fillRect(0, miny, width, maxy, lcd.LIGHTGREY)
+      lcd.fillRect(0, maxy, width, height, lcd.ORANGE)
+    else:
+      maxy = (int)(height-(high/2))
+      miny = (int)(height-(low/2))
+      lcd.fillRect(0, 0, width, maxy, lcd.ORANGE)
+      lcd.fillRect(0, maxy, width, miny, lcd.LIGHTGREY)
+      lcd.fillRect(0, miny, width, height, lcd.RED)
+    lcd.line(0, maxy, width, maxy, color=lcd.BLACK)
+    lcd.line(0, miny, width, miny, color=lcd.BLACK)
+
+    #hours vertical lines, every 3 hours in 24 hours window and at midnight in longer ones
+    step = self.step
+    nowColumn = now // step
+    every = 3600
+    if self.hours > RAW_HOURS: every = 86400
+    elif self.hours > 6: every = 10800
+    t = now - now % every
+    while t > now - self.hours * 3600:
+      x = width-1-(nowColumn-t//step)
+      if flipped: x = width-1-x
+      lcd.line(x, 0, x, height, color=lcd.BLACK)
+      t -= every
+
+    #sgv values from the oldest column
+    dots = step <= DOT_STEP
+    gap = self.gap // step
+    if gap < 1: gap = 1
+    prevColumn = None
+    for x in range(width):
+      column = nowColumn-(width-1-x)
+      i = column % width
+      if self.columns[i] != column + 1: continue
+      if flipped: x = width-1-x
+      y = self.getY(self.last[i], flipped)
+      if prevColumn != None and column - prevColumn <= gap:
+        lcd.line(prevX, prevY, x, self.getY(self.first[i], flipped), color=lcd.BLACK)
+      if self.low[i] != self.high[i]:
+        lcd.line(x, self.getY(self.low[i], flipped), x, self.getY(self.high[i], flipped), color=lcd.BLACK)
+      if dots:
+        sgv = self.last[i]
+        fillcolor = lcd.BLACK
+        if sgv <= low or sgv >= high: fillcolor = lcd.LIGHTGREY
+        lcd.circle(x, y, 3, fillcolor=fillcolor, color=lcd.BLACK)
+      prevColumn = column
+      prevX = x
+      prevY = y
@@ -0,0 +1,168 @@
+import ubinascii as binascii
+import uhashlib as hashlib
+import ustruct as struct
+import usocket as socket
+import utime
+from history import DIRECTIONS
+from rules import MAX_SGV
+
+#Local fan-out of readings, hub device polls backend and sends newest readings to followers
+#on the same LAN with UDP multicast, so backend load doesn't grow with number of screens
+#Packet: header magic, version, count, channel, sequence, send time followed by count records
+#time uint32, sgv uint16, direction uint8 from the newest one, followed by truncated
+#HMAC-SHA256 keyed by backend token, so other hosts on the LAN can't inject readings. Times are
+#utc seconds since 1970. Packet older than the last accepted one or sent too long ago is replayed
+#and is ignored, sending time keeps growing after hub restart unlike its sequence.
+#Channel is derived from backend url, so devices of different Nightscout instances can share the group
+
+MAGIC = b'SG'
+VERSION = 3
+HEADER_FORMAT = '<2sBBIHI'
+HEADER_SIZE = 14
+RECORD_FORMAT = '<IHB'
+RECORD_SIZE = 7
+MAC_SIZE = 8
+MAX_READINGS = 12 #one hour of 5 minute readings
+
+GROUP = '239.255.77.77'
+PORT = 5577
+HEARTBEAT = 30 #sec, hub sends newest readings at least this often
+TIMEOUT = 90 #sec, hub is considered silent if nothing was received for this long
+MAX_SKEW = 300 #sec, packets sent longer ago or in future by hub clock are rejected
+
+#seconds between 1970-01-01 and device epoch
+EPOCH_OFFSET = 946684800 if utime.localtime(0)[0] == 2000 else 0
+
+def getChannel(url):
+  return binascii.crc32(url.encode()) & 0xFFFFFFFF
+
+#returns inner and outer padded HMAC keys of token
+def getMacKeys(token):
+  key = token.encode()
+  if len(key) > 64: key = hashlib.sha256(key).digest()
+  inner = bytearray(64)
+  outer = bytearray(64)
+  for i in range(64):
+    b = key[i] if i < len(key) else 0
+    inner[i] = b ^ 0x36
+    outer[i] = b ^ 0x5C
+  return inner, outer
+
+def getMac(keys, data):
+  inner = hashlib.sha256(keys[0])
+  inner.update(data)
+  outer = hashlib.sha256(keys[1])
+  outer.update(inner.digest())
+  return outer.digest()[:MAC_SIZE]
+
+def isMulticast(address):
+  first = int(address.split('.')[0])
+  return first >= 224 and first <= 239
+
+class HubSender:
+  def __init__(self, channel, token, group=GROUP, port=PORT):
+    self.channel = channel
+    self.keys = getMacKeys(token)
+    self.addr = socket.getaddrinfo(group, port)[0][-1]
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    ttl = getattr(socket, 'IP_MULTICAST_TTL', None)
+    if ttl != None and isMulticast(group): self.sock.setsockopt(socket.IPPROTO_IP, ttl, 1)
+    self.buf = bytearray(HEADER_SIZE + MAX_READINGS * RECORD_SIZE + MAC_SIZE)
+    self.sequence = 0
+    self.packets = 0
+
+  #sends up to MAX_READINGS newest readings of history, utcOffset is added to history times
+  def send(self, history, utcOffset):
+    count = len(history)
+    if count > MAX_READINGS: count = MAX_READINGS
+    self.sequence = (self.sequence + 1) & 0xFFFF
+    struct.pack_into(HEADER_FORMAT, self.buf, 0, MAGIC, VERSION, count, self.channel, self.sequence, utime.time() + EPOCH_OFFSET)
+    offset = HEADER_SIZE
+    i = len(history) - 1
+    while offset < HEADER_SIZE + count * RECORD_SIZE:
+      struct.pack_into(RECORD_FORMAT, self.buf, offset, history.time(i) + utcOffset, history.value(i), history.direction(i))
+      offset += RECORD_SIZE
+      i -= 1
+    mv = memoryview(self.buf)
+    mv[offset:offset+MAC_SIZE] = getMac(self.keys, mv[:offset])
+    self.sock.sendto(mv[:offset+MAC_SIZE], self.addr)
+    self.packets += 1
+
+  def close(self):
+    self.sock.close()
+
+class HubListener:
+  def __init__(self, channel, token, group=GROUP, port=PORT):
+    self.channel = channel
+    self.keys = getMacKeys(token)
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    #several followers may run on one host in simulator
+    reuse = getattr(socket, 'SO_REUSEADDR', None)
+    if reuse != None: self.sock.setsockopt(socket.SOL_SOCKET, reuse, 1)
+    self.sock.bind(socket.getaddrinfo('0.0.0.0', port)[0][-1])
+    if isMulticast(group):
+      membership = bytes([int(b) for b in group.split('.')]) + bytes(4)
+      self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    self.sock.setblocking(False)
+    self.lastHeard = None
+    #sending time and sequence of the last accepted packet
+    self.sent = None
+    self.sequence = None
+    self.packets = 0
+    self.invalid = 0
+    self.replayed = 0
+
+  def isSilent(self, timeout=TIMEOUT):
+    return self.lastHeard == None or utime.time() - self.lastHeard >= timeout
+
+  #reads all pending packets and calls onReading(seconds, sgv, direction) for their readings
+  #from the newest one, utcOffset is subtracted from packet times, returns number of accepted packets
+  def receive(self, onReading, utcOffset):
+    accepted = 0
+    while True:
+      try:
+        data = self.sock.recv(HEADER_SIZE + MAX_READINGS * RECORD_SIZE + MAC_SIZE)
+      except OSError:
+        break
+      size = len(data)
+      if size == 0: break
+      if size < HEADER_SIZE:
+        self.invalid += 1
+        continue
+      magic, version, count, channel, sequence, sent = struct.unpack_from(HEADER_FORMAT, data, 0)
+      end = HEADER_SIZE + count * RECORD_SIZE
+      if magic != MAGIC or version != VERSION or channel != self.channel or count > MAX_READINGS or size != end + MAC_SIZE:
+        self.invalid += 1
+        continue
+      mv = memoryview(data)
+      if getMac(self.keys, mv[:end]) != data[end:] or not self.isValid(data, end):
+        self.invalid += 1
+        continue
+      if not self.isNewer(sent, sequence):
+        #replayed packet mustn't keep dead hub alive
+        self.replayed += 1
+        continue
+      accepted += 1
+      self.packets += 1
+      self.sent = sent
+      self.sequence = sequence
+      self.lastHeard = utime.time()
+      for offset in range(HEADER_SIZE, end, RECORD_SIZE):
+        seconds, sgv, direction = struct.unpack_from(RECORD_FORMAT, data, offset)
+        onReading(seconds - utcOffset, sgv, direction)
+    return accepted
+
+  def isNewer(self, sent, sequence):
+    if abs(sent - (utime.time() + EPOCH_OFFSET)) > MAX_SKEW: return False
+    if self.sent == None: return True
+    return sent > self.sent or (sent == self.sent and sequence > self.sequence)
+
+  #packet is rejected as a whole if any of its readings is out of range
+  def isValid(self, data, end):
+    for offset in range(HEADER_SIZE, end, RECORD_SIZE):
+      seconds, sgv, direction = struct.unpack_from(RECORD_FORMAT, data, offset)
+      if sgv > MAX_SGV or direction >= len(DIRECTIONS): return False
+    return True
+
+  def close(self):
+    self.sock.close()
@@ -0,0 +1,182 @@
+import gc
+import ustruct as struct
+
+#Off-screen composition of screen frames
+#Geometry drawn with lcd-like methods is recorded and rasterized into RGB565 frame buffer,
+#which is sent to ST7789 panel memory in one transfer per band. Text can't be rendered with
+#lcd fonts into the buffer, so text calls are replayed on the lcd after the frame is pushed.
+#If there isn't enough heap for the whole frame, it is rasterized in horizontal bands
+
+WIDTH = 240
+HEIGHT = 135
+BAND_HEIGHT = 27 #rows of band buffer, 5 bands per frame
+MIN_FREE_HEAP = 24576 #bytes which have to be left after buffer allocation
+PANEL_X = 40 #offsets of 240x135 landscape window in ST7789 memory of M5StickC Plus
+PANEL_Y = 52
+CASET = 0x2A
+RASET = 0x2B
+RAMWR = 0x2C
+
+#returns (canvas or None, reason), None means frames have to be drawn directly to lcd
+def createCanvas(lcd, width=WIDTH, height=HEIGHT):
+  try:
+    import framebuf
+  except ImportError:
+    return None, 'framebuf module not available'
+  if getattr(lcd, 'tft_writecmddata', None) == None: return None, 'lcd has no raw panel access'
+  gc.collect()
+  for rows in (height, BAND_HEIGHT):
+    if gc.mem_free() - width * rows * 2 < MIN_FREE_HEAP: continue
+    try:
+      return FrameCanvas(lcd, framebuf, width, height, rows), None
+    except MemoryError:
+      gc.collect()
+  return None, 'not enough memory'
+
+class FrameCanvas:
+  def __init__(self, lcd, framebuf, width, height, rows):
+    self.lcd = lcd
+    self.width = width
+    self.height = height
+    self.rows = rows
+    self.buf = bytearray(width * rows * 2)
+    self.fb = framebuf.FrameBuffer(self.buf, width, rows, framebuf.RGB565)
+    self.ops = []
+    self.texts = []
+    self.colors = {}
+    self.pushes = 0
+
+  def begin(self):
+    self.ops = []
+    self.texts = []
+    return self
+
+  def __getattr__(self, name):
+    #colors, fonts and other lcd constants
+    return getattr(self.lcd, name)
+
+  def toRgb565(self, color):
+    #lcd colors are 0xRRGGBB, panel expects big endian RGB565
+    c = self.colors.get(color)
+    if c == None:
+      c = ((color >> 8) & 0xF800) | ((color >> 5) & 0x07E0) | ((color & 0xFF) >> 3)
+      c = ((c & 0xFF) << 8) | (c >> 8)
+      self.colors[color] = c
+    return c
+
+  #geometry is recorded
+  def clear(self, color=0):
+    self.ops.append((0, color))
+
+  def fillRect(self, x, y, w, h, color=0):
+    self.ops.append((1, color, x, y, w, h))
+
+  def line(self, x, y, x1, y1, color=0):
+    self.ops.append((2, color, x, y, x1, y1))
+
+  def circle(self, x, y, r, color=0, fillcolor=None):
+    self.ops.append((3, color, x, y, r, fillcolor))
+
+  def fillTriangle(self, x, y, x1, y1, x2, y2, color=0):
+    self.ops.append((4, color, x, y, x1, y1, x2, y2))
+
+  def textClear(self, x, y, text, color=0):
+    self.ops.append((1, color, x, y, self.lcd.textWidth(text), self.lcd.fontSize()[1]))
+
+  #text state is applied to lcd right away, so measuring works, and again when text is replayed
+  def font(self, *args, **kwargs):
+    self.lcd.font(*args, **kwargs)
+    self.texts.append((self.lcd.font, args, kwargs))
+
+  def setTextColor(self, *args, **kwargs):
+    self.texts.append((self.lcd.setTextColor, args, kwargs))
+
+  def print(self, *args, **kwargs):
+    self.texts.append((self.lcd.print, args, kwargs))
+
+  def textWidth(self, text):
+    return self.lcd.textWidth(text)
+
+  def fontSize(self):
+    return self.lcd.fontSize()
+
+  def fillCircle(self, x, y, r, c):
+    fb = self.fb
+    top = y - r
+    if top < 0: top = 0
+    bottom = y + r
+    if bottom >= self.rows: bottom = self.rows - 1
+    rr = r * r
+    for py in range(top, bottom + 1):
+      dy = py - y
+      dx = 0
+      while (dx + 1) * (dx + 1) + dy * dy <= rr: dx += 1
+      fb.hline(x - dx, py, 2 * dx + 1, c)
+
+  def fillTriangleRows(self, x0, y0, x1, y1, x2, y2, c):
+    #scanline fill between edges of vertices sorted by y
+    if y1 < y0: x0, y0, x1, y1 = x1, y1, x0, y0
+    if y2 < y0: x0, y0, x2, y2 = x2, y2, x0, y0
+    if y2 < y1: x1, y1, x2, y2 = x2, y2, x1, y1
+    top = y0
+    if top < 0: top = 0
+    bottom = y2
+    if bottom >= self.rows: bottom = self.rows - 1
+    for y in range(top, bottom + 1):
+      if y2 == y0: xa = x0
+      else: xa = x0 + (x2 - x0) * (y - y0) // (y2 - y0)
+      if y < y1 or (y == y1 and y1 == y0):
+        if y1 == y0: xb = x1
+        else: xb = x0 + (x1 - x0) * (y - y0) // (y1 - y0)
+      else:
+        if y2 == y1: xb = x1
+        else: xb = x1 + (x2 - x1) * (y - y1) // (y2 - y1)
+      if xb < xa: xa, xb = xb, xa
+      self.fb.hline(xa, y, xb - xa + 1, c)
+
+  def rasterize(self, top):
+    fb = self.fb
+    rows = self.rows
+    for op in self.ops:
+      kind = op[0]
+      c = self.toRgb565(op[1])
+      if kind == 0:
+        fb.fill(c)
+      elif kind == 1:
+        fb.fill_rect(op[2], op[3] - top, op[4], op[5], c)
+      elif kind == 2:
+        fb.line(op[2], op[3] - top, op[4], op[5] - top, c)
+      elif kind == 3:
+        x, y, r, fillcolor = op[2], op[3] - top, op[4], op[5]
+        if y + r < 0 or y - r >= rows: continue
+        self.fillCircle(x, y, r, c)
+        if fillcolor != op[1] and r > 1:
+          #outline only circle is drawn on black
+          if fillcolor == None: fillcolor = 0
+          self.fillCircle(x, y, r - 1, self.toRgb565(fillcolor))
+      elif kind == 4:
+        ys = (op[3] - top, op[5] - top, op[7] - top)
+        if max(ys) < 0 or min(ys) >= rows: continue
+        self.fillTriangleRows(op[2], ys[0], op[4], ys[1], op[6], ys[2], c)
+
+  def push(self, top, rows):
+    write = self.lcd.tft_writecmddata
+    write(CASET, struct.pack('>HH', PANEL_X, PANEL_X + self.width - 1))
+    write(RASET, struct.pack('>HH', PANEL_Y + top, PANEL_Y + top + rows - 1))
+    write(RAMWR, memoryview(self.buf)[:self.width * rows * 2])
+    self.pushes += 1
+
+  #rasterizes recorded geometry, sends it to the panel and draws text on top of it
+  def flush(self):
+    top = 0
+    while top < self.height:
+      rows = self.rows
+      if top + rows > self.height: rows = self.height - top
+      self.fb.fill(0)
+      self.rasterize(top)
+      self.push(top, rows)
+      top += rows
+    for call, args, kwargs in self.texts:
+      call(*args, **kwargs)
+    self.ops = []
+    self.texts = []
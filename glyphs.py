@@ -0,0 +1,58 @@
+import math
+
+#Geometry and text layout computed once instead of on every frame
+
+#vertices of arrow triangle pointing right, rotated by rotateAngle degrees around its center
+def getTriangle(centerX, centerY, rotateAngle, width=44, height=44):
+  angle = math.radians(rotateAngle)
+  cos = math.cos(angle)
+  sin = math.sin(angle)
+  vertices = ()
+  for dx, dy in ((width / 2, 0), (-width / 2, height / 2), (-width / 2, -height / 2)):
+    vertices += (int(dx * cos - dy * sin + centerX), int(dx * sin + dy * cos + centerY))
+  return vertices
+
+#returns {(layout, direction): triangles} for arrow shapes given as {layout: {direction: ((xshift, yshift, rotateAngle), ...)}}
+def buildArrows(centers, shapes):
+  arrows = {}
+  for layout in shapes:
+    x, y = centers[layout]
+    for direction in shapes[layout]:
+      arrows[(layout, direction)] = tuple([getTriangle(x + dx, y + dy, angle) for dx, dy, angle in shapes[layout][direction]])
+  return arrows
+
+#Bounded least recently used cache of text widths and font sizes measured by lcd
+#font passed to width() and size() has to be the current lcd font
+class TextMetrics:
+  def __init__(self, lcd, capacity=16):
+    self.lcd = lcd
+    self.capacity = capacity
+    self.widths = {}
+    self.keys = []
+    self.sizes = {}
+    self.hits = 0
+    self.misses = 0
+
+  def width(self, font, text):
+    key = (font, text)
+    w = self.widths.get(key)
+    if w != None:
+      self.hits += 1
+      if self.keys[-1] != key:
+        self.keys.remove(key)
+        self.keys.append(key)
+      return w
+    self.misses += 1
+    w = self.lcd.textWidth(text)
+    if len(self.keys) >= self.capacity:
+      del self.widths[self.keys.pop(0)]
+    self.widths[key] = w
+    self.keys.append(key)
+    return w
+
+  def size(self, font):
+    f = self.sizes.get(font)
+    if f == None:
+      f = self.lcd.fontSize()
+      self.sizes[font] = f
+    return f
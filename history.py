@@ -0,0 +1,259 @@
+from array import array
+import ustruct as struct
+import uos as os
+
+#Fixed capacity history of sgv readings stored in preallocated arrays
+#Readings are kept sorted by time, index 0 is the oldest one
+
+DIRECTIONS = ("NONE", "DoubleUp", "SingleUp", "FortyFiveUp", "Flat", "FortyFiveDown", "SingleDown", "DoubleDown", "NOT COMPUTABLE", "RATE OUT OF RANGE")
+
+def getDirectionCode(direction):
+  try:
+    return DIRECTIONS.index(direction)
+  except ValueError:
+    return 0
+
+#unknown code of corrupted or foreign record is shown as NONE
+def getDirection(code):
+  if code < len(DIRECTIONS): return DIRECTIONS[code]
+  return DIRECTIONS[0]
+
+class SgvHistory:
+  def __init__(self, capacity=288):
+    self.capacity = capacity
+    self.times = array('I', [0] * capacity) #seconds since device epoch in local time
+    self.values = array('H', [0] * capacity)
+    self.directions = bytearray(capacity)
+    self.start = 0
+    self.count = 0
+    #incremented on every modification, lets views of history detect changes
+    self.changes = 0
+
+  def __len__(self):
+    return self.count
+
+  def clear(self):
+    self.start = 0
+    self.count = 0
+    self.changes += 1
+
+  def time(self, i):
+    return self.times[(self.start + i) % self.capacity]
+
+  def value(self, i):
+    return self.values[(self.start + i) % self.capacity]
+
+  def direction(self, i):
+    return self.directions[(self.start + i) % self.capacity]
+
+  def newestTime(self):
+    if self.count == 0: return -1
+    return self.time(self.count - 1)
+
+  def oldestTime(self):
+    if self.count == 0: return -1
+    return self.time(0)
+
+  def set(self, i, seconds, sgv, direction):
+    p = (self.start + i) % self.capacity
+    self.times[p] = seconds
+    self.values[p] = sgv
+    self.directions[p] = direction
+
+  def move(self, src, dst):
+    s = (self.start + src) % self.capacity
+    d = (self.start + dst) % self.capacity
+    self.times[d] = self.times[s]
+    self.values[d] = self.values[s]
+    self.directions[d] = self.directions[s]
+
+  #returns False if reading was already stored or is older than whole full history
+  def add(self, seconds, sgv, direction=0):
+    n = self.count
+    if n == 0 or seconds > self.time(n - 1):
+      #append in O(1), full buffer drops the oldest reading
+      if n == self.capacity:
+        self.start = (self.start + 1) % self.capacity
+        n -= 1
+      else:
+        self.count += 1
+      self.set(n, seconds, sgv, direction)
+      self.changes += 1
+      return True
+
+    #out of order reading, find position starting from the newest one
+    i = n - 1
+    while i >= 0 and self.time(i) > seconds: i -= 1
+    if i >= 0 and self.time(i) == seconds:
+      changed = self.value(i) != sgv or self.direction(i) != direction
+      self.set(i, seconds, sgv, direction)
+      if changed: self.changes += 1
+      return changed
+    if n == self.capacity:
+      if i < 0: return False
+      #drop the oldest reading and shift older part down
+      for j in range(0, i):
+        self.move(j + 1, j)
+      self.set(i, seconds, sgv, direction)
+    else:
+      j = n
+      while j > i + 1:
+        self.move(j - 1, j)
+        j -= 1
+      self.count += 1
+      self.set(i + 1, seconds, sgv, direction)
+    self.changes += 1
+    return True
+
+  #iterates (seconds, sgv, direction) from the oldest to the newest reading with start <= seconds < end
+  def items(self, start=0, end=None):
+    n = self.count
+    i = 0
+    if start > 0:
+      #readings are sorted so first index is found with binary search
+      lo = 0
+      hi = n
+      while lo < hi:
+        mid = (lo + hi) // 2
+        if self.time(mid) < start: lo = mid + 1
+        else: hi = mid
+      i = lo
+    while i < n:
+      p = (self.start + i) % self.capacity
+      t = self.times[p]
+      if end != None and t >= end: break
+      yield t, self.values[p], self.directions[p]
+      i += 1
+
+#Append only binary log of fixed size records, the last byte of record is its checksum
+#Header: magic, version, record size followed by fields specific to log format
+#Log is rewritten to temporary file, which replaces it only when it is complete
+
+def getChecksum(record):
+  c = 0xA5
+  for i in range(len(record) - 1):
+    c = (c + record[i]) & 0xFF
+  return c
+
+class RecordLog:
+  def __init__(self, path, magic, version, recordSize, fields=b''):
+    self.path = path
+    self.header = magic + bytes((version, recordSize)) + fields
+    self.recordSize = recordSize
+    #record is packed here before it's appended
+    self.record = bytearray(recordSize)
+    self.records = 0
+    #False if torn or corrupted records were skipped by read()
+    self.valid = True
+
+  #calls onRecord(buffer, offset) for all valid records, returns False if log doesn't exist or has other header
+  def read(self, onRecord):
+    try:
+      logfile = open(self.path, 'rb')
+    except OSError:
+      try:
+        #power loss during compaction, complete log is in temporary file
+        os.rename(self.path + '.tmp', self.path)
+        logfile = open(self.path, 'rb')
+      except OSError:
+        return False
+    size = self.recordSize
+    self.valid = True
+    try:
+      if logfile.read(len(self.header)) != self.header: return False
+      chunk = bytearray(size * 32)
+      mv = memoryview(chunk)
+      while True:
+        n = logfile.readinto(chunk)
+        if not n: break
+        if n % size != 0:
+          #torn final record after power loss
+          self.valid = False
+          n -= n % size
+        for offset in range(0, n, size):
+          record = mv[offset:offset+size]
+          if getChecksum(record) != record[size-1]:
+            self.valid = False
+            continue
+          onRecord(chunk, offset)
+          self.records += 1
+    finally:
+      logfile.close()
+    return True
+
+  def seal(self):
+    self.record[self.recordSize-1] = getChecksum(self.record)
+
+  def append(self):
+    self.seal()
+    logfile = open(self.path, 'ab')
+    try:
+      logfile.write(self.record)
+    finally:
+      logfile.close()
+    self.records += 1
+
+  #rewrites log with records packed by pack(item) for every item
+  def rewrite(self, items, pack):
+    tmpPath = self.path + '.tmp'
+    logfile = open(tmpPath, 'wb')
+    count = 0
+    try:
+      logfile.write(self.header)
+      for item in items:
+        pack(item)
+        self.seal()
+        logfile.write(self.record)
+        count += 1
+    finally:
+      logfile.close()
+    try:
+      os.remove(self.path)
+    except OSError:
+      pass
+    os.rename(tmpPath, self.path)
+    self.records = count
+
+#Log of readings. Record: time uint32, sgv uint16, direction uint8, checksum uint8
+#Later records of the same time override earlier ones, so updates are appended as well
+
+LOG_MAGIC = b'SGVL'
+LOG_VERSION = 1
+RECORD_SIZE = 8
+RECORD_FORMAT = '<IHB'
+
+class HistoryLog:
+  def __init__(self, path, history, maxRecords=None):
+    self.path = path
+    self.history = history
+    self.log = RecordLog(path, LOG_MAGIC, LOG_VERSION, RECORD_SIZE)
+    #log is compacted to current history once it holds this many records
+    if maxRecords == None: maxRecords = 2 * history.capacity
+    self.maxRecords = maxRecords
+
+  #reads all valid records into history, returns False if log doesn't exist or has unsupported format
+  def load(self):
+    if not self.log.read(self.addRecord): return False
+    if not self.log.valid or self.log.records >= self.maxRecords:
+      self.compact()
+    return True
+
+  def addRecord(self, chunk, offset):
+    seconds, sgv, direction = struct.unpack_from(RECORD_FORMAT, chunk, offset)
+    if direction >= len(DIRECTIONS): direction = 0
+    self.history.add(seconds, sgv, direction)
+
+  def pack(self, reading):
+    struct.pack_into(RECORD_FORMAT, self.log.record, 0, reading[0], reading[1], reading[2])
+
+  def append(self, seconds, sgv, direction=0):
+    if self.log.records >= self.maxRecords:
+      #history already holds the new reading
+      self.compact()
+      return
+    struct.pack_into(RECORD_FORMAT, self.log.record, 0, seconds, sgv, direction)
+    self.log.append()
+
+  #rewrites log with current history content
+  def compact(self):
+    self.log.rewrite(self.history.items(), self.pack)
@@ -0,0 +1,99 @@
+import sys
+import utime
+from array import array
+
+#Leveled log of monitor events kept in ring of the last RECORDS records
+#Calls below current level return before anything is formatted or stored. Message is constant
+#string and up to two values are stored as references in preallocated ring, so logging itself
+#allocates nothing, records are formatted only when printed. Ring is saved to CRASH_FILE before
+#restart after unexpected error and can be printed from REPL with import logger; logger.dump()
+
+DEBUG = 0
+INFO = 1
+WARNING = 2
+ERROR = 3
+OFF = 4
+LEVELS = ("debug", "info", "warning", "error", "off")
+
+RECORDS = 32
+CRASH_FILE = 'crash.log'
+
+level = INFO
+console = True #records are printed as they come
+
+recordTime = array('I', [0] * RECORDS)
+recordLevel = bytearray(RECORDS)
+recordMsg = [None] * RECORDS
+recordA = [None] * RECORDS
+recordB = [None] * RECORDS
+recordPos = 0
+recordCount = 0
+
+#returns level of name used in config, INFO if name is unknown
+def getLevel(name):
+  try:
+    return LEVELS.index(name)
+  except ValueError:
+    return INFO
+
+def log(recordLvl, msg, a=None, b=None):
+  global recordPos, recordCount
+  if recordLvl < level: return
+  p = recordPos
+  recordTime[p] = utime.time()
+  recordLevel[p] = recordLvl
+  recordMsg[p] = msg
+  recordA[p] = a
+  recordB[p] = b
+  recordPos = (p + 1) % RECORDS
+  if recordCount < RECORDS: recordCount += 1
+  if console: write(msg, a, b)
+
+def debug(msg, a=None, b=None):
+  if level <= DEBUG: log(DEBUG, msg, a, b)
+
+def info(msg, a=None, b=None):
+  if level <= INFO: log(INFO, msg, a, b)
+
+def warning(msg, a=None, b=None):
+  if level <= WARNING: log(WARNING, msg, a, b)
+
+def error(msg, a=None, b=None):
+  if level <= ERROR: log(ERROR, msg, a, b)
+
+def exception(e, msg='Exception'):
+  if level <= ERROR: log(ERROR, msg, e)
+
+#prints message followed by values, exception value is printed with its traceback
+def write(msg, a=None, b=None, stream=None):
+  if isinstance(a, BaseException):
+    print(msg, file=stream)
+    if stream != None: sys.print_exception(a, stream)
+    else: sys.print_exception(a)
+  elif a == None: print(msg, file=stream)
+  elif b == None: print(msg, a, file=stream)
+  else: print(msg, a, b, file=stream)
+
+#iterates (time, level name, message, a, b) of stored records from the oldest one
+def records():
+  start = (recordPos - recordCount) % RECORDS
+  for i in range(recordCount):
+    p = (start + i) % RECORDS
+    yield recordTime[p], LEVELS[recordLevel[p]], recordMsg[p], recordA[p], recordB[p]
+
+def dump(stream=None):
+  for t, name, msg, a, b in records():
+    print(t, name, end=' ', file=stream)
+    write(msg, a, b, stream)
+
+#writes stored records to file, returns False if it can't be written
+def save(path=CRASH_FILE):
+  try:
+    logfile = open(path, 'w')
+  except OSError:
+    return False
+  try:
+    dump(logfile)
+  finally:
+    logfile.close()
+  return True
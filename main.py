@@ -1,8 +1,5 @@
 import network
-import urequests
-import time
 import ujson
-import sys
 import _thread
 import utime
 import machine 
@@ -13,12 +10,49 @@ import deviceCfg
 import wifiCfg
 import ubinascii
 from machine import Pin, PWM, RTC
-from collections import OrderedDict
 from imu import IMU
-import math
 import re
+import nightscout
+import metrics
+import logger
+import rules
+import frame
+import glyphs
+import fanout
+import backfill
+import power as pm
+from history import getDirectionCode, getDirection
+from battery import BatteryMonitor
+from orientation import OrientationTracker
+from chart import SgvChart
+from patients import Patient, PollScheduler
 
 EMERGENCY_PAUSE_INTERVAL = 1800  #sec = 30 mins
+FULL_FETCH_COUNT = 10 #entries requested after restart or network outage
+DELTA_FETCH_COUNT = 10 #upper bound of entries requested in delta mode
+DELTA_FETCH_MAX_AGE = 3000 #sec = 50 mins, older cache is refreshed with full fetch
+BACKEND_TIMEOUT = 20 #sec
+RENDER_POLL_INTERVAL = 0.05 #sec, render requests check period in async scheduler mode
+READING_INTERVAL = 300 #sec, cgm readings are uploaded every 5 mins
+POLL_GRACE = 10 #sec, poll this long after reading is expected to be uploaded
+LATE_READING_RETRY = 20 #sec
+LATE_READING_RETRIES = 3
+MAX_UPLOAD_LAG = 120 #sec
+RTC_MIN_YEAR = 2023 #rtc keeps time over soft reset, earlier year means it was reset with power loss
+WIFI_FAST_CONNECT_TIMEOUT = 5 #sec, cached access point connection attempt before falling back to scanning
+WIFI_RECONNECT_TIMEOUT = 10 #sec, reconnection after light sleep
+BOOT_STATE_FILE = 'bootstate.json'
+HUB_LISTEN_INTERVAL = 1 #sec
+POWER_IDLE_INTERVAL = 10 #sec, emergency check period without alarm in power save mode
+POWER_ORIENTATION_INTERVAL = 4 #sec, sample period of still device in power save mode
+#arrow circle center and triangles (xshift, yshift, rotateAngle) of each direction in full and flip layouts
+ARROW_CENTERS = {"full": (178, 48), "flip": (58, 52)}
+ARROW_SHAPES = {
+  "full": {'DoubleUp': ((0, -12, -90), (0, 4, -90)), 'DoubleDown': ((0, -4, 90), (0, 12, 90)), 'SingleUp': ((0, -4, -90),), 'SingleDown': ((0, 4, 90),),
+           'Flat': ((4, 0, 0),), 'FortyFiveUp': ((4, -4, -45),), 'FortyFiveDown': ((4, 4, 45),)},
+  "flip": {'DoubleUp': ((0, -4, 90), (0, 12, 90)), 'DoubleDown': ((0, -12, -90), (0, 4, -90)), 'SingleUp': ((0, 4, 90),), 'SingleDown': ((0, -4, -90),),
+           'Flat': ((-4, 0, 180),), 'FortyFiveUp': ((-4, 4, 135),), 'FortyFiveDown': ((-4, -4, -135),)}
+}
 MODES = ["full_elapsed", "full_date", "full_battery", "basic", "flip_full_elapsed", "flip_full_date", "flip_full_battery", "chart", "flip_chart"]
 
 def getNtpTime():
@@ -44,6 +78,11 @@ def getNtpTime():
     raise Exception("Unsupported epoch: {}".format(EPOCH_YEAR))
   return val - NTP_DELTA
 
+def getUnixEpochOffset():
+  #seconds between 1970-01-01 and device epoch
+  if utime.localtime(0)[0] == 2000: return 946684800
+  return 0
+
 def getDateTuple(date_str):
   [yyyy, mm, dd] = [int(i) for i in date_str.split('T')[0].split('-')]
   [HH, MM, SS] = [int(i) for i in date_str.split('T')[1].split(':')]
@@ -55,255 +94,231 @@ def isOlderThan(date_str, mins):
   seconds = utime.mktime(the_date) 
   now = utime.time() #UTC
   diff = (now - seconds + secondsDiff)
-  printTime(diff, prefix='Entry read', suffix='ago')
+  logger.debug('Entry read seconds ago:', diff)
   return diff > (60 * mins) 
 
-def getBatteryLevel():
-  volt = axp.getBatVoltage()
-  if volt < 3.20: return -1
-  if volt < 3.27: return 0
-  if volt < 3.61: return 5
-  if volt < 3.69: return 10
-  if volt < 3.71: return 15
-  if volt < 3.73: return 20
-  if volt < 3.75: return 25
-  if volt < 3.77: return 30
-  if volt < 3.79: return 35
-  if volt < 3.80: return 40
-  if volt < 3.82: return 45
-  if volt < 3.84: return 50
-  if volt < 3.85: return 55
-  if volt < 3.87: return 60
-  if volt < 3.91: return 65
-  if volt < 3.95: return 70
-  if volt < 3.98: return 75
-  if volt < 4.02: return 80
-  if volt < 4.08: return 85
-  if volt < 4.11: return 90
-  if volt < 4.15: return 95
-  if volt < 4.20: return 100
-  if volt >= 4.20: return 101
-
-def saveSgvFile(sgvdict):
-  sgvfile = open('sgvdict.txt', 'w')
-  for key in sgvdict:
-    sgvfile.write(str(key) + ':' + str(sgvdict[key]) + '\n')
-  sgvfile.close()  
-
-def readSgvFile():
-  d = OrderedDict()
-  try: 
+def getDateStr(seconds):
+  return '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}'.format(*utime.localtime(seconds)[:6])
+
+def getAgoStr(seconds):
+  mins = (int)(seconds/60)
+  if mins < 1: return "now"
+  elif mins < 60: return str(mins) + " min ago"
+  else: return str((int)(mins/60)) + " h ago"
+
+def getEntriesQuery(p):
+  global secondsDiff
+  if not p.fullFetch and len(p.history) > 0:
+    newestSeconds = p.history.newestTime()
+    if (utime.time() + secondsDiff - newestSeconds) < DELTA_FETCH_MAX_AGE:
+      #sgvHistory times are local time seconds since device epoch, nightscout expects utc milliseconds since 1970
+      dateMs = (newestSeconds - secondsDiff + getUnixEpochOffset()) * 1000
+      return "/entries.json?count=" + str(DELTA_FETCH_COUNT) + "&find[date][$gt]=" + str(dateMs)
+  return "/entries.json?count=" + str(FULL_FETCH_COUNT)
+
+def getUtcOffset():
+  #seconds added to local time seconds since device epoch to get utc seconds since 1970
+  global secondsDiff
+  return getUnixEpochOffset() - secondsDiff
+
+def getBackfillQuery(p, gap):
+  #readings at both ends of gap are already stored
+  offset = getUtcOffset()
+  return "/entries.json?count=" + str(p.backfill.page) + "&find[date][$gt]=" + str((gap[0] + offset) * 1000) + "&find[date][$lt]=" + str((gap[1] + offset) * 1000)
+
+def readSgvFile(history):
+  try:
     sgvfile = open('sgvdict.txt', 'r')
+  except OSError:
+    #nothing to migrate on fresh install
+    return history
+  try: 
     entries = sgvfile.read().split('\n')
     for entry in entries:
       if ":" in entry:
-        [s, v] = [int(i) for i in entry.split(':')]
-        d.update({s: v})
+        fields = [int(i) for i in entry.split(':')]
+        if len(fields) > 2: history.add(fields[0], fields[1], fields[2])
+        else: history.add(fields[0], fields[1])
   except Exception as e:
-    sys.print_exception(e)
-  return d  
+    logger.exception(e)
+  finally:
+    sgvfile.close()
+  return history
+
+def getCachedResponse(history, rtcValid):
+  #newest reading of loaded history shown until first poll completes
+  global secondsDiff
+  n = len(history)
+  if n == 0: return '{}'
+  seconds = history.newestTime()
+  newest = {'sgv': history.value(n-1), 'direction': getDirection(history.direction(n-1)),
+            'date': getDateStr(seconds)}
+  if rtcValid: newest['ago'] = getAgoStr(utime.time() + secondsDiff - seconds)
+  return [newest]
+
+def readBootState():
+  #access point of last successful wifi connection
+  try:
+    stateFile = open(BOOT_STATE_FILE, 'r')
+    state = ujson.loads(stateFile.read())
+    stateFile.close()
+    return state
+  except Exception:
+    return {}
+
+def saveBootState(state):
+  try:
+    stateFile = open(BOOT_STATE_FILE, 'w')
+    stateFile.write(ujson.dumps(state))
+    stateFile.close()
+  except Exception as e:
+    logger.exception(e)
+
+def connectWifi(ssid, password, bssid=None, channel=None, timeout=None):
+  #returns False if connection isn't established within timeout seconds
+  global nic
+  if channel != None:
+    try:
+      nic.config(channel=channel)
+    except Exception:
+      pass
+  if bssid != None: nic.connect(ssid, password, bssid=bssid)
+  else: nic.connect(ssid, password)
+  logger.info('Connecting wifi', ssid)
+  waited = 0
+  while not nic.isconnected():
+    if timeout != None and waited >= timeout: return False
+    utime.sleep(0.25)
+    waited += 0.25
+  logger.info('Wifi connected in seconds:', waited)
+  return True
+
+def reconnectWifi():
+  #explicit light sleep drops wifi association, access point of boot is joined again without scanning
+  global bootState, WIFI
+  if nic.isconnected(): return
+  ssid = bootState['ssid']
+  if not connectWifi(ssid, WIFI[ssid], ubinascii.unhexlify(bootState['bssid']), bootState.get('channel'), timeout=WIFI_RECONNECT_TIMEOUT):
+    #backend request fails and is retried
+    logger.warning('Wifi reconnection timed out', ssid)
+
+def printBootStatus(msg):
+  #boot progress is shown only if there is no cached reading on the screen
+  global patient
+  if patient.response == '{}': printCenteredText(msg, backgroundColor=lcd.DARKGREY)
 
 def resetMachine(seconds=5):
+  #recent log records are kept for inspection after restart
+  logger.save()
   if seconds<1: seconds=1
   for i in range(seconds, 0, -1):
      printCenteredText('Reset in ' + str(i) + ' sec', backgroundColor=lcd.RED, clear=True)
-     time.sleep(1)
+     utime.sleep(1)
   machine.reset()    
 
 def checkBeeper():
-  global USE_BEEPER, BEEPER_START_TIME, BEEPER_END_TIME, secondsDiff 
-  try:   
-    if USE_BEEPER == 1:
-      d = utime.localtime(0)
-      tm = utime.localtime(utime.time() + secondsDiff) 
-    
-      c = list(d)
-      c[3] = tm[3]
-      c[4] = tm[4]
-      c[5] = tm[5]
-
-      d1 = list(d)
-      [HH, MM, SS] = [int(i) for i in BEEPER_START_TIME.split(':')]
-      d1[3] = HH
-      d1[4] = MM
-      d1[5] = SS
-
-      d2 = list(d)
-      [HH, MM, SS] = [int(i) for i in BEEPER_END_TIME.split(':')]
-      d2[3] = HH
-      d2[4] = MM
-      d2[5] = SS
-
-      #print("Compare d1: " + str(d1) + ", d2: " + str(d2) + ", c: " + str(c))
-      
-      if tuple(d1) < tuple(d2):
-         return tuple(c) > tuple(d1) and tuple(c) < tuple(d2)
-      else:
-         return tuple(c) > tuple(d1) or tuple(c) < tuple(d2)
-    else:
-      return False 
-  except Exception as e:
-    sys.print_exception(e)
-    return True  
+  global USE_BEEPER, BEEPER_START, BEEPER_END, secondsDiff
+  return USE_BEEPER == 1 and rules.isInDailyWindow(utime.time() + secondsDiff, BEEPER_START, BEEPER_END)
+
+def isRegionDirty(region, content):
+  global drawnRegions
+  if drawnRegions.get(region) == content: return False
+  drawnRegions[region] = content
+  return True
 
-def printTime(seconds, prefix='', suffix=''):
-  m, s = divmod(seconds, 60)
-  h, m = divmod(m, 60)
-  print(prefix + ' {:02d}:{:02d}:{:02d} '.format(h, m, s) + suffix)  
+def resetRegions():
+  global drawnRegions
+  drawnRegions = {}
 
 def printCenteredText(msg, font=lcd.FONT_DejaVu24, backgroundColor=lcd.BLACK, textColor=lcd.WHITE, clear=False):
-  global mpu6050
+  global orientation
   rotateAngle = 0
-  if mpu6050.acceleration[0] > 0: rotateAngle = 180
+  if orientation.flipped: rotateAngle = 180
   
   lcd.font(font, rotate=rotateAngle)
+  resetRegions()
   if clear == True:
      lcd.clear(backgroundColor)
   lcd.setTextColor(textColor)
-  w = lcd.textWidth(msg)
-  f = lcd.fontSize()
+  w = textMetrics.width(font, msg)
+  f = textMetrics.size(font)
   lcd.fillRect(0, 80-f[1], 240, f[1], backgroundColor)
   if rotateAngle==180:
     lcd.print(msg, (int)(w+((240-w)/2)), 80)
   else:
     lcd.print(msg, (int)((240-w)/2), (int)(80-f[1]))
 
-def printDirection(x, y, xshift=0, yshift=0, rotateAngle=0, arrowColor=lcd.WHITE, fillColor=lcd.WHITE):
-  lcd.circle(x, y, 40, fillcolor=fillColor, color=fillColor)
-  r = drawTriangle(x+xshift, y+yshift, arrowColor, rotateAngle)
-  #lcd.circle(int(r[0]), int(r[1]), 4, fillcolor=arrowColor, color=arrowColor)
-
-def printDoubleDirection(x, y, ytop=0, ybottom=0, rotateAngle=0, arrowColor=lcd.WHITE, fillColor=lcd.WHITE):
-  lcd.circle(x, y, 40, fillcolor=fillColor, color=fillColor)
-  drawTriangle(x, y+ytop, arrowColor, rotateAngle)
-  r = drawTriangle(x, y+ybottom, arrowColor, rotateAngle) 
-  #lcd.circle(int(r[0]), int(r[1]), 4, fillcolor=arrowColor, color=arrowColor)
-
-def drawTriangle(centerX, centerY, arrowColor, rotateAngle=90, width=44, height=44):
-  angle = math.radians(rotateAngle) # Angle to rotate
-
-  # Vertex's coordinates before rotating
-  x1 = centerX + width / 2
-  y1 = centerY
-  x2 = centerX - width / 2
-  y2 = centerY + height / 2
-  x3 = centerX - width / 2
-  y3 = centerY - height / 2
-
-  # Rotating
-  x1r = ((x1 - centerX) * math.cos(angle) - (y1 - centerY) * math.sin(angle) + centerX)
-  y1r = ((x1 - centerX) * math.sin(angle) + (y1 - centerY) * math.cos(angle) + centerY)
-  x2r = ((x2 - centerX) * math.cos(angle) - (y2 - centerY) * math.sin(angle) + centerX)
-  y2r = ((x2 - centerX) * math.sin(angle) + (y2 - centerY) * math.cos(angle) + centerY)
-  x3r = ((x3 - centerX) * math.cos(angle) - (y3 - centerY) * math.sin(angle) + centerX)
-  y3r = ((x3 - centerX) * math.sin(angle) + (y3 - centerY) * math.cos(angle) + centerY)
-
-  lcd.fillTriangle(int(x1r), int(y1r), int(x2r), int(y2r), int(x3r), int(y3r), arrowColor)
-  #lcd.triangle(int(x1r), int(y1r), int(x2r), int(y2r), int(x3r), int(y3r), fillcolor=arrowColor, color=arrowColor)
-  return x1r, y1r, x2r, y2r, x3r, y3r 
-
-def printChart(zoom=1):
-  global sgvDict, MIN, MAX
-
-  #horizontal glucose level lines nand fills
-  if mode == 8:
-    maxy = 136-(int)(136-(MAX/2))
-    miny = 136-(int)(136-(MIN/2))
-    lcd.fillRect(0, 0, 240, miny, lcd.RED) #70
-    lcd.fillRect(0, miny, 240, maxy, lcd.LIGHTGREY)
-    lcd.fillRect(0, maxy, 240, 136, lcd.ORANGE) #172
-    lcd.line(0, maxy, 240, maxy, color=lcd.BLACK)
-    lcd.line(0, miny, 240, miny, color=lcd.BLACK)
-  else:   
-    maxy = (int)(136-(MAX/2))
-    miny = (int)(136-(MIN/2))
-    lcd.fillRect(0, 0, 240, maxy, lcd.ORANGE) #172
-    lcd.fillRect(0, maxy, 240, miny, lcd.LIGHTGREY)
-    lcd.fillRect(0, miny, 240, 136, lcd.RED) #70
-    lcd.line(0, maxy, 240, maxy, color=lcd.BLACK)
-    lcd.line(0, miny, 240, miny, color=lcd.BLACK)
-  
-  #hours vertical lines
-  tm = utime.localtime(utime.time())
-  if mode == 8:
-    x=(tm[4]*zoom)
-    while x<=240:
-      lcd.line(x, 0, x, 136, color=lcd.BLACK)
-      x+=(60*zoom)
-  else:  
-    x=240-(tm[4]*zoom)
-    while x>=0:
-      lcd.line(x, 0, x, 136, color=lcd.BLACK)
-      x-=(60*zoom)
-  
-  #sgv values
-  points = []
-  for key in sgvDict:
-    the_date = utime.localtime(key)
-    hourDiff = tm[3]+1-the_date[3]
-    minutes = the_date[4]
-    if mode == 8:
-      x = 240-(240-(hourDiff*zoom*60)-(tm[4]*zoom)+(minutes*zoom))
-      y = (int)(sgvDict[key]/2)
-    else:   
-      x = 240-(hourDiff*zoom*60)-(tm[4]*zoom)+(minutes*zoom)
-      y = (int)(136-sgvDict[key]/2)
-    fillcolor = lcd.BLACK
-    if sgvDict[key]<=MIN: fillcolor=lcd.LIGHTGREY
-    elif sgvDict[key]>=MAX: fillcolor=lcd.LIGHTGREY 
-    points.append((x,y,fillcolor))
-
-  n = len(points)-1
-  while(n >= 0):
-    p = points[n]
-    lcd.circle(p[0], p[1], zoom+2, fillcolor=p[2], color=lcd.BLACK) 
-    if n>0 and abs(p[0]-points[n-1][0])<=60:
-      lcd.line(p[0], p[1],points[n-1][0],points[n-1][1], color=lcd.BLACK) 
-    n -= 1
+def printArrow(layout, direction, arrowColor, backgroundColor, fillColor=lcd.WHITE):
+  #triangles are precomputed for every direction and layout
+  x, y = ARROW_CENTERS[layout]
+  triangles = arrows.get((layout, direction))
+  if triangles == None:
+    screen.circle(x, y, 40, fillcolor=backgroundColor, color=backgroundColor)
+    return
+  screen.circle(x, y, 40, fillcolor=fillColor, color=fillColor)
+  for t in triangles:
+    screen.fillTriangle(t[0], t[1], t[2], t[3], t[4], t[5], arrowColor)
+
+def classifyPatient(p):
+  #returns (background color, led, arrow color or None, alert level, predicted alert text or None) of the newest reading
+  global OLD_DATA, glucoseRules, EMERGENCY_MIN, EMERGENCY_MAX, PREDICTION_MINUTES, secondsDiff
+  newest = p.response[0]
+  try:
+    #reading cached before restart is shown as old until it is confirmed by backend
+    tooOld = p.cachedResponse or isOlderThan(newest['date'], OLD_DATA)
+  except Exception as e:
+    logger.exception(e)
+
+  if tooOld: return (lcd.DARKGREY, 1, None, rules.ALERT_NONE, None)
+  backgroundColor, led, arrowColor, alert = glucoseRules.classify(newest['sgv'], getDirectionCode(newest['direction']))
+
+  #early alert if emergency level is predicted to be reached soon
+  predictedStr = None
+  if alert != rules.ALERT_EMERGENCY and PREDICTION_MINUTES > 0:
+    #trend is updated by backend thread when readings are merged
+    crossing = p.trend.getCrossing(utime.time() + secondsDiff, EMERGENCY_MIN, EMERGENCY_MAX, PREDICTION_MINUTES * 60)
+    if crossing != None:
+      alert = rules.ALERT_EMERGENCY
+      if crossing[0] == EMERGENCY_MIN: predictedStr = "Low in "
+      else: predictedStr = "High in "
+      predictedStr += str((int)(crossing[1] / 60)) + " min"
+      logger.info('Predicted emergency glucose level:', predictedStr)
+  return (backgroundColor, led, arrowColor, alert, predictedStr)
 
 def printScreen(clear=False):
-  global response, mode, brightness, emergency, emergencyPause, MIN, MAX, EMERGENCY_MIN, EMERGENCY_MAX, currentBackgroudColor, screenDrawing, startTime, OLD_DATA
+  global patient, patients, mode, brightness, emergency, emergencyPause, startTime, sgvChart, MIN, MAX, secondsDiff, screen, frameCanvas
   
-  print('Printing screen in ' + MODES[mode] + ' mode')
-  waitTime = 0.0
-  while screenDrawing == True:
-    time.sleep(0.1)
-    waitTime += 0.1
-    print(".", end="")
-
-  if waitTime > 0: 
-    print('Finished in ' + str(waitTime) + ' seconds')
-  screenDrawing = True   
-
-  newest = response[0]
+  logger.debug('Printing screen in mode', MODES[mode])
+
+  if frameCanvas != None:
+    #frame is composed off-screen, so it is always drawn whole
+    screen = frameCanvas.begin()
+    clear = True
+  else:
+    screen = lcd
+
+  newest = patient.response[0]
   sgv = newest['sgv']
   sgvStr = str(sgv)
   if sgv < 100: sgvStr = " " + sgvStr
 
   directionStr = newest['direction']
-  
-  try:
-    tooOld = isOlderThan(newest['date'], OLD_DATA)
-  except Exception as e:
-    sys.print_exception(e)
 
-  if tooOld: backgroundColor=lcd.DARKGREY; M5Led.on(); emergency=False
-  elif sgv <= EMERGENCY_MIN: backgroundColor=lcd.RED; M5Led.on(); emergency=(utime.time() > emergencyPause and not tooOld)  
-  elif sgv >= (MIN-10) and sgv < MIN and directionStr.endswith("Up"): backgroundColor=lcd.DARKGREEN; emergency=False; M5Led.off()
-  elif sgv > EMERGENCY_MIN and sgv <= MIN: backgroundColor=lcd.RED; M5Led.on(); emergency=False
-  elif sgv > MIN and sgv <= MAX: backgroundColor=lcd.DARKGREEN; emergency=False; M5Led.off() 
-  elif sgv > MAX and sgv <= (MAX+10) and directionStr.endswith("Down"): backgroundColor=lcd.DARKGREEN; emergency=False; M5Led.off()
-  elif sgv > MAX and sgv <= EMERGENCY_MAX: backgroundColor=lcd.ORANGE; M5Led.on(); emergency=False
-  elif sgv > EMERGENCY_MAX: backgroundColor=lcd.ORANGE; M5Led.on(); emergency=(utime.time() > emergencyPause and not tooOld)  
+  backgroundColor, led, arrowColor, alert, predictedStr = classifyPatient(patient)
+  patient.alert = alert
+  if led: M5Led.on()
+  else: M5Led.off()
+  emergency = (alert == rules.ALERT_EMERGENCY and utime.time() > emergencyPause)
+  if arrowColor == None: arrowColor = backgroundColor
 
   #if emergency change to one of full modes 
   currentMode = mode
   if emergency==True and (mode == 3 or mode == 7): currentMode = 0
   
   #battery level emergency
-  batteryLevel = getBatteryLevel()
+  batteryLevel = batteryMonitor.level
   uptime = utime.time() - startTime  
-  if (batteryLevel < 20 and batteryLevel > 0 and uptime > 300) and (utime.time() > emergencyPause) and not axp.getChargeState(): 
+  if (batteryLevel < 20 and batteryLevel > 0 and uptime > 300) and (utime.time() > emergencyPause) and not batteryMonitor.charging: 
     emergency=True
     if currentMode < 4 or currentMode == 7: currentMode = 2
     else: currentMode = 6
@@ -312,229 +327,694 @@ def printScreen(clear=False):
   if "ago" in newest and (currentMode == 0 or currentMode == 4): 
     dateStr = newest['ago']
   elif currentMode == 2 or currentMode == 6:
-    batteryLevel = getBatteryLevel()
     if batteryLevel >= 0:
-       dateStr = "Battery: " + str(getBatteryLevel()) + "%"
+       dateStr = "Battery: " + str(batteryLevel) + "%"
     else: 
        dateStr = "Battery level unknown"
+  elif len(patients) > 1:
+    dateStr = newest['date'][11:16] #only time fits next to patient name
   else:   
     dateStr = newest['date'].replace("T", " ")[:-3] #remove seconds to fit screen
+  if predictedStr != None and currentMode != 2 and currentMode != 6: dateStr = predictedStr
+  if len(patients) > 1 and len(patient.name) > 0: dateStr = patient.name + " " + dateStr
+
+  if currentMode in range(0,3): layout = "full"
+  elif currentMode in range(4,7): layout = "flip"
+  elif currentMode in range(7,9): layout = "chart"
+  else: layout = "basic"
+
+  #regions are redrawn only if their content has changed since last drawing
+  if clear or layout == "chart" or isRegionDirty("background", (layout, backgroundColor)):
+     screen.clear(backgroundColor)
+     resetRegions()
+     isRegionDirty("background", (layout, backgroundColor))
+  else:
+     logger.debug("Skip background clearing")
 
-  lcd.setTextColor(lcd.WHITE)
+  footerColor = lcd.WHITE
+  if batteryLevel < 20 and (currentMode == 2 or currentMode == 6): footerColor = lcd.RED
 
-  #in skip background clearing if color doesn't change  
-  if clear or currentBackgroudColor != backgroundColor:
-     lcd.clear(backgroundColor)
-     currentBackgroudColor = backgroundColor
-  else:
-     print("Skip background clearing")
-  
-  if currentMode in range (0,3):  
+  if layout == "full" or layout == "flip":
+    arrowDirty = isRegionDirty("arrow", (directionStr, arrowColor))
+    sgvDirty = isRegionDirty("sgv", sgvStr)
+    footerDirty = isRegionDirty("footer", (dateStr, footerColor))
+
+  if layout == "full":  
     #full mode
     
     #direction
-    x=178
-    y=48
-    
-    if not tooOld and directionStr == 'DoubleUp' and sgv+20>=MAX: arrowColor = lcd.RED
-    elif not tooOld and directionStr == 'DoubleDown' and sgv-20<=MIN: arrowColor = lcd.RED
-    elif not tooOld and directionStr == 'SingleUp' and sgv+10>=MAX: arrowColor = lcd.ORANGE
-    elif not tooOld and directionStr == 'SingleDown' and sgv-10<=MIN: arrowColor = lcd.ORANGE
-    else: arrowColor = backgroundColor  
-
-    if directionStr == 'DoubleUp': printDoubleDirection(x, y, ytop=-12, ybottom=4, rotateAngle=-90, arrowColor=arrowColor)
-    elif directionStr == 'DoubleDown': printDoubleDirection(x, y, ytop=-4, ybottom=12, rotateAngle=90, arrowColor=arrowColor) 
-    elif directionStr == 'SingleUp': printDirection(x, y, xshift=0, yshift=-4, rotateAngle=-90, arrowColor=arrowColor)
-    elif directionStr == 'SingleDown': printDirection(x, y, xshift=0, yshift=4, rotateAngle=90, arrowColor=arrowColor)
-    elif directionStr == 'Flat': printDirection(x, y, xshift=4, rotateAngle=0, arrowColor=arrowColor)
-    elif directionStr == 'FortyFiveUp': printDirection(x, y, xshift=4, yshift=-4, rotateAngle=-45, arrowColor=arrowColor)
-    elif directionStr == 'FortyFiveDown': printDirection(x, y, xshift=4, yshift=4, rotateAngle=45, arrowColor=arrowColor)
+    if arrowDirty: printArrow(layout, directionStr, arrowColor, backgroundColor)
 
     #sgv
-    lcd.font(lcd.FONT_DejaVu56, rotate=0)
-    lcd.textClear(12, 24, "888", backgroundColor)
-    lcd.print(sgvStr, 12, 24)
+    if sgvDirty:
+      screen.setTextColor(lcd.WHITE)
+      screen.font(lcd.FONT_DejaVu56, rotate=0)
+      screen.textClear(12, 24, "888", backgroundColor)
+      screen.print(sgvStr, 12, 24)
     
     #ago, date or battery
-    if batteryLevel < 20 and (currentMode == 2 or currentMode == 6): lcd.setTextColor(lcd.RED)
-    lcd.font(lcd.FONT_DejaVu24, rotate=0)
-    f=lcd.fontSize()
-    lcd.fillRect(0, 100, 240, 100+f[1], backgroundColor)
-    lcd.print(dateStr, (int)((240-lcd.textWidth(dateStr))/2), 100)
-  elif currentMode in range(4,7):
+    if footerDirty:
+      screen.setTextColor(footerColor)
+      screen.font(lcd.FONT_DejaVu24, rotate=0)
+      f=textMetrics.size(lcd.FONT_DejaVu24)
+      screen.fillRect(0, 100, 240, 100+f[1], backgroundColor)
+      screen.print(dateStr, (int)((240-textMetrics.width(lcd.FONT_DejaVu24, dateStr))/2), 100)
+  elif layout == "flip":
     #flip full mode
 
     #direction
-    x=58
-    y=52
-        
-    if not tooOld and directionStr == 'DoubleUp' and sgv+20>=MAX: arrowColor = lcd.RED
-    elif not tooOld and directionStr == 'DoubleDown' and sgv-20<=MIN: arrowColor = lcd.RED
-    elif not tooOld and directionStr == 'SingleUp' and sgv+10>=MAX: arrowColor = lcd.ORANGE
-    elif not tooOld and directionStr == 'SingleDown' and sgv-10<=MIN: arrowColor = lcd.ORANGE
-    else: arrowColor = backgroundColor   
-    
-    if directionStr == 'DoubleUp': printDoubleDirection(x, y, ytop=-4, ybottom=12, rotateAngle=90, arrowColor=arrowColor)
-    elif directionStr == 'DoubleDown': printDoubleDirection(x, y, ytop=-12, ybottom=4, rotateAngle=-90, arrowColor=arrowColor) 
-    elif directionStr == 'SingleUp': printDirection(x, y, xshift=0, yshift=4, rotateAngle=90, arrowColor=arrowColor)
-    elif directionStr == 'SingleDown': printDirection(x, y, xshift=0, yshift=-4, rotateAngle=-90, arrowColor=arrowColor)
-    elif directionStr == 'Flat': printDirection(x, y, xshift=-4, rotateAngle=180, arrowColor=arrowColor)
-    elif directionStr == 'FortyFiveUp': printDirection(x, y, xshift=-4, yshift=4, rotateAngle=135, arrowColor=arrowColor)
-    elif directionStr == 'FortyFiveDown': printDirection(x, y, xshift=-4, yshift=-4, rotateAngle=-135, arrowColor=arrowColor)
+    if arrowDirty: printArrow(layout, directionStr, arrowColor, backgroundColor)
 
     #sgv
-    lcd.font(lcd.FONT_DejaVu56, rotate=180)
-    x = 206
-    y = 78
-    lcd.textClear(x-lcd.textWidth("888")+4, y-lcd.fontSize()[1]+4, "888", backgroundColor)
-    lcd.print(sgvStr, x, y)
+    if sgvDirty:
+      screen.setTextColor(lcd.WHITE)
+      screen.font(lcd.FONT_DejaVu56, rotate=180)
+      x = 206
+      y = 78
+      screen.textClear(x-textMetrics.width(lcd.FONT_DejaVu56, "888")+4, y-textMetrics.size(lcd.FONT_DejaVu56)[1]+4, "888", backgroundColor)
+      screen.print(sgvStr, x, y)
 
     #ago, date or battery
-    if batteryLevel < 20 and currentMode == 6: lcd.setTextColor(lcd.RED)
-    lcd.font(lcd.FONT_DejaVu18, rotate=180)
-    x = (int)(240-((240-lcd.textWidth(dateStr))/2))
-    if x>216: x=216
-    y = 118
-    lcd.fillRect(0, y-lcd.fontSize()[1], 240, y, backgroundColor)
-    lcd.print(dateStr, x, y)
-  elif currentMode in range(7,9):
+    if footerDirty:
+      screen.setTextColor(footerColor)
+      screen.font(lcd.FONT_DejaVu18, rotate=180)
+      x = (int)(240-((240-textMetrics.width(lcd.FONT_DejaVu18, dateStr))/2))
+      if x>216: x=216
+      y = 118
+      screen.fillRect(0, y-textMetrics.size(lcd.FONT_DejaVu18)[1], 240, y, backgroundColor)
+      screen.print(dateStr, x, y)
+  elif layout == "chart":
     #chart
-    printChart()
-    currentBackgroudColor = -1
-  print("----------------------------")  
-  screenDrawing = False  
+    sgvChart.draw(utime.time() + secondsDiff, MIN, MAX, flipped=(currentMode == 8), lcd=screen)
+    #chart is always redrawn from history so nothing is retained
+    resetRegions()
+
+  if frameCanvas != None:
+    try:
+      frameCanvas.flush()
+    except Exception as e:
+      #fall back to drawing directly to lcd
+      logger.exception(e)
+      logger.warning('Frame buffer disabled')
+      frameCanvas = None
+      screen = lcd
+      resetRegions()
+      requestRender(clear=True)
+  logger.debug("----------------------------")
+
+def requestRender(clear=False):
+  global renderRequest
+  #newest request replaces pending one, clearing is kept if any of merged requests asked for it
+  renderLock.acquire()
+  renderRequest = clear or renderRequest == True
+  if renderSignal.locked(): renderSignal.release()
+  renderLock.release()
+
+def renderPending():
+  global renderRequest, renderPatient, renderWindows, patient, sgvChart
+  renderLock.acquire()
+  clear = renderRequest
+  p = renderPatient
+  windows = renderWindows
+  renderRequest = None
+  renderPatient = None
+  renderWindows = 0
+  renderLock.release()
+  #shown patient and chart window are changed only here, never while a frame is drawn
+  if p != None and p != patient:
+    patient = p
+    sgvChart.setHistory(p.history, p.rollups)
+    logger.info('Showing patient', p.name)
+  for i in range(windows):
+    logger.info('Selected chart window hours:', sgvChart.nextWindow())
+  if clear == None or patient.response == '{}': return
+  try:
+    span = metrics.begin()
+    printScreen(clear=clear)
+    metrics.end(metrics.RENDER, span)
+  except Exception as e:
+    logger.exception(e)
+
+def renderWorker():
+  while True:
+    #wait until requestRender() releases the signal
+    renderSignal.acquire()
+    renderPending()
 
 def onBtnAPressed():
-  global mode, emergency, emergencyPause, currentBackgroudColor, mpu6050
+  global mode, emergency, emergencyPause, orientation, power
+  #press of dimmed or blank display only wakes it
+  if power != None and power.wake(): return
   if emergency == True:
     emergency = False
     emergencyPause = utime.time() + EMERGENCY_PAUSE_INTERVAL 
   else:   
-    if mode == 7 and mpu6050.acceleration[0] < 0: mode = 0
-    elif mode == 6 and mpu6050.acceleration[0] > 0: mode = 8
-    elif mode == 3 and mpu6050.acceleration[0] < 0: mode = 7
+    if mode == 7 and not orientation.flipped: mode = 0
+    elif mode == 6 and orientation.flipped: mode = 8
+    elif mode == 3 and not orientation.flipped: mode = 7
     elif mode == 8: mode = 3
     else: mode += 1 
-    currentBackgroudColor = -1
-    print('Selected mode ' + MODES[mode])
-    printScreen()
+    logger.info('Selected mode', MODES[mode])
+    requestRender()
 
 def onBtnBPressed():
-  global emergency, emergencyPause
+  global emergency, emergencyPause, mode, renderWindows, power
+  if power != None and power.wake(): return
   if emergency == True:
     emergency = False
     emergencyPause = utime.time() + EMERGENCY_PAUSE_INTERVAL
+  elif mode == 7 or mode == 8:
+    #chart modes switch chart window instead of brightness, it's switched by render worker
+    renderLock.acquire()
+    renderWindows += 1
+    renderLock.release()
+    requestRender()
   else:   
     global brightness
     brightness += 16
     if brightness > 96: brightness = 32
-    axp.setLcdBrightness(brightness)
-
-def backendMonitor():
-  global response, INTERVAL, API_ENDPOINT, API_TOKEN, LOCALE, TIMEZONE, startTime, sgvDict
+    if power != None: power.setBrightness(brightness)
+    else: axp.setLcdBrightness(brightness)
+
+def getBackendHeaders(token):
+  global LOCALE, TIMEZONE
+  return {'api-secret': token,'accept-language': LOCALE,'accept-charset': 'ascii', 'x-gms-tz': TIMEZONE}
+
+def selectPatient(p):
+  #patient shown on the screen is switched by render worker before the next frame
+  global patient, renderPatient
+  renderLock.acquire()
+  switch = p != patient or renderPatient != None
+  if switch: renderPatient = p
+  renderLock.release()
+  if switch: requestRender(clear=True)
+
+def startPoll(p):
+  global startTime, polledPatient, pollNewest, pollEntryUs
+  batteryMonitor.update()
+  logger.debug('Battery level %:', batteryMonitor.level)
+  logger.debug('Free memory bytes:', gc.mem_free())
+  logger.debug('Uptime seconds:', utime.time() - startTime)
+  polledPatient = p
+  pollNewest = None
+  pollEntryUs = 0
+  p.pollStartNewestTime = p.history.newestTime()
+  query = getEntriesQuery(p)
+  logger.debug('Calling backend', query)
+  return query
+
+def mergeReading(seconds, sgv, directionCode):
+  global polledPatient, pollEntryUs
+  span = metrics.begin()
+  added = polledPatient.history.add(seconds, sgv, directionCode)
+  pollEntryUs += metrics.end(metrics.MERGE, span)
+  if added:
+    span = metrics.begin()
+    polledPatient.log.append(seconds, sgv, directionCode)
+    for rollup in polledPatient.rollups: rollup.add(seconds, sgv)
+    pollEntryUs += metrics.end(metrics.PERSIST, span)
+
+def addEntry(sgv, direction, date, ago):
+  #entries are merged while response is streamed, newest entry comes first
+  global pollNewest
+  mergeReading(utime.mktime(getDateTuple(date)), sgv, getDirectionCode(direction))
+  if pollNewest == None:
+    if direction == None: direction = 'NONE'
+    pollNewest = {'sgv': sgv, 'direction': direction, 'date': date}
+    if ago != None: pollNewest['ago'] = ago
+
+def addBackfillEntry(sgv, direction, date, ago):
+  #missed readings are only stored, newest reading on the screen stays the same
+  global backfillCount
+  backfillCount += 1
+  mergeReading(utime.mktime(getDateTuple(date)), sgv, getDirectionCode(direction))
+
+def addHubReading(seconds, sgv, directionCode):
+  #readings broadcast by hub come from the newest one, only readings newer than history are shown as new
+  global polledPatient, pollNewest, secondsDiff
+  mergeReading(seconds, sgv, directionCode)
+  if pollNewest == None and seconds > polledPatient.pollStartNewestTime:
+    pollNewest = {'sgv': sgv, 'direction': getDirection(directionCode), 'date': getDateStr(seconds), 'ago': getAgoStr(utime.time() + secondsDiff - seconds)}
+
+def finishPoll(p):
+  global patient, TIMEZONE, secondsDiff, pollNewest, hubSender, emergencyPause
+  p.fullFetch = False
+  p.cachedResponse = False
+  p.trend.update()
+  newest = pollNewest
+  if newest == None:
+    #no new readings since last poll, only refresh elapsed time of cached newest entry
+    logger.debug('No new entries')
+    refreshAgo()
+  else:
+    p.response = [newest]
+    logger.info('Sgv:', newest['sgv'])
+    logger.info('Direction:', newest['direction'])
+    logger.info('Read:', newest['date'], TIMEZONE)
+
+    history = p.history
+    historyLen = len(history)
+    logger.debug('Cached sgv entries:', historyLen)
+
+    if historyLen > 1:
+      sgvDiff = history.value(historyLen-1) - history.value(historyLen-2)
+      logger.debug('Sgv diff from previous read:', sgvDiff)
+
+    rate = p.trend.getRate()
+    if rate != None and logger.level <= logger.INFO:
+      #trend message is formatted only if it is logged
+      logger.info('Sgv trend: {:.1f} mg/dL/min, in 30 min: {:d}'.format(rate, (int)(p.trend.predict(history.newestTime() + 1800))))
+
+    if hubSender != None:
+      #followers get new readings right away, not with next heartbeat
+      try:
+        hubSender.send(history, getUtcOffset())
+      except Exception as e:
+        logger.exception(e)
+
+  p.alert = classifyPatient(p)[3]
+  if p != patient and p.alert == rules.ALERT_EMERGENCY and patient.alert != rules.ALERT_EMERGENCY and utime.time() > emergencyPause:
+    #patient in alarm is shown right away
+    selectPatient(p)
+  requestRender()
+
+def refreshAgo():
+  global patients, secondsDiff
+  for p in patients:
+    if p.response != '{}':
+      newest = p.response[0]
+      newest['ago'] = getAgoStr(utime.time() + secondsDiff - utime.mktime(getDateTuple(newest['date'])))
+
+def getReadingPeriod(history):
+  #average interval between last readings, None if readings are not regular enough to predict next one
+  n = len(history)
+  total = 0
+  count = 0
+  i = n - 1
+  while i > 0 and i > n - 7:
+    diff = history.time(i) - history.time(i-1)
+    if diff >= READING_INTERVAL-60 and diff <= READING_INTERVAL+60:
+      total += diff
+      count += 1
+    i -= 1
+  if count < 2: return None
+  return (int)(total/count)
+
+def getPollDelay(p):
+  #seconds until next poll aligned to expected upload time of next cgm reading
+  global INTERVAL, ADAPTIVE_POLLING, secondsDiff
+  if ADAPTIVE_POLLING != 1: return INTERVAL
+  period = getReadingPeriod(p.history)
+  if period == None: return INTERVAL
+  newestTime = p.history.newestTime()
+  now = utime.time() + secondsDiff
+  if newestTime > p.pollStartNewestTime:
+    if p.lateRetries > 0:
+      #reading arrived after retry, learn how long upload took
+      p.uploadLag = min(now - newestTime, MAX_UPLOAD_LAG)
+    elif p.uploadLag > 0:
+      #reading was already there, try to poll a little earlier next time
+      p.uploadLag -= 2
+    p.lateRetries = 0
+  expected = newestTime + period + p.uploadLag
+  if now < expected:
+    return min(expected - now + POLL_GRACE, period)
+  elif now < expected + LATE_READING_RETRIES * LATE_READING_RETRY and p.lateRetries < LATE_READING_RETRIES:
+    p.lateRetries += 1
+    return LATE_READING_RETRY
+  return INTERVAL
+
+#yields sleep periods until next poll, elapsed time on the screen is refreshed at least every INTERVAL
+def pollWaitCycle(delay):
+  global INTERVAL
+  logger.debug('Next poll in seconds:', delay)
+  while delay > INTERVAL:
+    yield INTERVAL
+    delay -= INTERVAL
+    refreshAgo()
+    requestRender()
+  yield delay
+
+def failPoll(p, e, backendRetry):
+  logger.exception(e)
+  p.fullFetch = True
+  logger.debug('Battery level %:', batteryMonitor.level)
+  logger.warning('Network error. Retry in seconds:', backendRetry)
+  requestRender()
+
+def pollPatient(p):
+  #single poll with blocking client, returns number of seconds to wait before next poll of the patient
+  global INTERVAL, power
+  try:
+    #light sleep of power save mode drops wifi association
+    if power != None and power.lightSleep: reconnectWifi()
+    query = startPoll(p)
+    span = metrics.begin()
+    #connection is kept alive between polls, 304 means nothing has changed since last poll
+    status = p.client.get(query, addEntry)
+    us = metrics.end(metrics.FETCH, span)
+    if status != 200 and status != 304: raise Exception('Backend responded with status ' + str(status))
+    if status == 200:
+      #parser time includes merging and persisting of entries done in its callback
+      metrics.record(metrics.PARSE, p.client.parseUs - pollEntryUs)
+    logger.debug('Response received in ms:', us // 1000)
+    finishPoll(p)
+    return getPollDelay(p)
+  except Exception as e:
+    backendRetry = (int)(INTERVAL/4)
+    failPoll(p, e, backendRetry)
+    return backendRetry
+
+def startBackfill(p):
+  global polledPatient, pollEntryUs
+  polledPatient = p
+  pollEntryUs = 0
+  return utime.ticks_ms()
+
+def isBackfillBudgetLeft(size, started):
+  return size < backfill.BUDGET_BYTES and utime.ticks_diff(utime.ticks_ms(), started) < backfill.BUDGET_MS
+
+def finishBackfill(p, pages, size, readings):
+  global pollScheduler
+  #following poll of other patient keeps stagger after backfill requests
+  pollScheduler.lastPoll = utime.time()
+  if pages == 0: return
+  p.trend.update()
+  logger.info('Backfilled sgv entries:', readings)
+  logger.debug('Backfill requests and bytes:', pages, size)
+  if p == patient: requestRender()
+
+def backfillPatient(p):
+  #fetches pages of missed readings over kept-alive connection until cycle budget is spent
+  global backfillCount
+  started = startBackfill(p)
+  pages = 0
+  size = 0
+  readings = 0
+  try:
+    while isBackfillBudgetLeft(size, started):
+      gap = p.backfill.next()
+      if gap == None: break
+      backfillCount = 0
+      status = p.client.get(getBackfillQuery(p, gap), addBackfillEntry)
+      #304 repeats already merged response
+      if status != 200 and status != 304: raise Exception('Backend responded with status ' + str(status))
+      p.backfill.done(backfillCount, p.client.bodySize)
+      pages += 1
+      size += p.client.bodySize
+      readings += backfillCount
+  except Exception as e:
+    logger.exception(e)
+  finishBackfill(p, pages, size, readings)
+
+def backendPoll():
+  #polls patient scheduled next, returns number of seconds to wait before next poll of any patient
+  #missed readings of polled patient are backfilled if the next poll isn't due soon
+  global pollScheduler
+  p = pollScheduler.next(utime.time())[0]
+  pollScheduler.done(p, utime.time(), pollPatient(p))
+  wait = pollScheduler.next(utime.time())[1]
+  if p.fullFetch or wait < backfill.MIN_IDLE: return wait
+  backfillPatient(p)
+  return pollScheduler.next(utime.time())[1]
+
+def backendCycle():
+  while True:
+    for delay in pollWaitCycle(backendPoll()):
+      yield delay
+
+def receiveHub():
+  #merges readings of packets received from hub, returns number of packets
+  global polledPatient, pollNewest, pollEntryUs, patients, hubListener
+  p = patients[0]
+  polledPatient = p
+  pollNewest = None
+  pollEntryUs = 0
+  p.pollStartNewestTime = p.history.newestTime()
+  packets = hubListener.receive(addHubReading, getUtcOffset())
+  if pollNewest != None or (packets > 0 and p.cachedResponse): finishPoll(p)
+  return packets
+
+def followerCycle():
+  #readings are received from hub, backend is polled directly only while hub is silent
+  global INTERVAL, patients, hubListener
+  nextPoll = utime.time() + fanout.TIMEOUT
+  nextRefresh = utime.time() + INTERVAL
+  while True:
+    try:
+      packets = receiveHub()
+    except Exception as e:
+      logger.exception(e)
+      packets = 0
+    if packets > 0:
+      nextPoll = utime.time() + fanout.TIMEOUT
+    elif hubListener.isSilent() and utime.time() >= nextPoll:
+      logger.warning('Hub is silent, polling backend directly')
+      nextPoll = utime.time() + pollPatient(patients[0])
+      nextRefresh = utime.time() + INTERVAL
+    if utime.time() >= nextRefresh:
+      nextRefresh = utime.time() + INTERVAL
+      refreshAgo()
+      requestRender()
+    yield HUB_LISTEN_INTERVAL
+
+def hubCycle():
+  #heartbeat lets followers know hub is alive, it isn't sent while backend can't be reached
+  global patients, hubSender
+  while True:
+    yield fanout.HEARTBEAT
+    p = patients[0]
+    if not p.fullFetch and len(p.history) > 0:
+      try:
+        hubSender.send(p.history, getUtcOffset())
+      except Exception as e:
+        logger.exception(e)
+
+def patientCycle():
+  #patients are shown in turns, patient in alarm stays on the screen
+  global patient, patients, emergency, PATIENT_DISPLAY_TIME
+  while True:
+    yield PATIENT_DISPLAY_TIME
+    if emergency: continue
+    p = patients[(patients.index(patient) + 1) % len(patients)]
+    for q in patients:
+      if q.alert == rules.ALERT_EMERGENCY and q != patient:
+        p = q
+        break
+    if p.response != '{}': selectPatient(p)
+
+async def backendTask():
+  global INTERVAL, pollScheduler
   backendRetry = (int)(INTERVAL/4)
   while True:
+    p, wait = pollScheduler.next(utime.time())
+    if wait > 0:
+      for delay in pollWaitCycle(wait):
+        await asyncio.sleep(delay)
+      continue
     try:
-      print('Battery level: ' + str(getBatteryLevel()) + '%')
-      print('Free memory: ' + str(gc.mem_free()) + ' bytes')
-      printTime((utime.time() - startTime), prefix='Uptime is')
-      print('Calling backend ...')
-      s = utime.time()
-      response = urequests.get(API_ENDPOINT + "/entries.json?count=10",headers={'api-secret': API_TOKEN,'accept-language': LOCALE,'accept-charset': 'ascii', 'x-gms-tz': TIMEZONE}).json()
-      printTime((utime.time() - s), prefix='Response received in')
-      print('Sgv:', response[0]['sgv'])
-      print('Direction:', response[0]['direction'])
-      print('Read: ' + response[0]['date'] + ' (' + TIMEZONE + ')')
-      sgvDiff = response[0]['sgv'] - response[1]['sgv']
-      print('Sgv diff from previous read:', sgvDiff)
-
-      d = OrderedDict()
-      seconds = -1
-      for index, entry in enumerate(response):
-        the_date = getDateTuple(entry['date'])  
-        seconds = utime.mktime(the_date)
-        d.update({seconds: entry['sgv']})
-
-      dictLen = len(d)  
-      for key in sgvDict:
-        if key < seconds and dictLen < 50:
-          d.update({key: sgvDict[key]})
-        elif dictLen >= 50:
-          break  
-        dictLen = len(d)
-
-      sgvDict = d
-      saveSgvFile(d)
-      print('Cached ' + str(dictLen) + " sgv entries")
-      #print(sgvDict)  
-      
-      printScreen()
-      time.sleep(INTERVAL)
+      query = startPoll(p)
+      span = metrics.begin()
+      #connection is kept alive between polls, 304 means nothing has changed since last poll
+      status = await asyncio.wait_for(p.client.get(query, addEntry), BACKEND_TIMEOUT)
+      us = metrics.end(metrics.FETCH, span)
+      if status != 200 and status != 304: raise Exception('Backend responded with status ' + str(status))
+      if status == 200:
+        metrics.record(metrics.PARSE, p.client.parseUs - pollEntryUs)
+      logger.debug('Response received in ms:', us // 1000)
+      finishPoll(p)
+      delay = getPollDelay(p)
     except Exception as e:
-      sys.print_exception(e)
-      print('Battery level: ' + str(getBatteryLevel()) + '%')
-      print('Network error. Retry in ' + str(backendRetry) + ' sec...')
-      printScreen()
-      time.sleep(backendRetry)
-
-def emergencyMonitor():
-  global emergency, beeper, response
+      #request cancelled by timeout leaves the stream in unknown state
+      p.client.close()
+      failPoll(p, e, backendRetry)
+      delay = backendRetry
+    pollScheduler.done(p, utime.time(), delay)
+    if not p.fullFetch and pollScheduler.next(utime.time())[1] >= backfill.MIN_IDLE: await backfillTask(p)
+
+async def backfillTask(p):
+  global backfillCount
+  started = startBackfill(p)
+  pages = 0
+  size = 0
+  readings = 0
+  try:
+    while isBackfillBudgetLeft(size, started):
+      gap = p.backfill.next()
+      if gap == None: break
+      backfillCount = 0
+      status = await asyncio.wait_for(p.client.get(getBackfillQuery(p, gap), addBackfillEntry), BACKEND_TIMEOUT)
+      #304 repeats already merged response
+      if status != 200 and status != 304: raise Exception('Backend responded with status ' + str(status))
+      p.backfill.done(backfillCount, p.client.bodySize)
+      pages += 1
+      size += p.client.bodySize
+      readings += backfillCount
+  except Exception as e:
+    p.client.close()
+    logger.exception(e)
+  finishBackfill(p, pages, size, readings)
+
+#monitor cycles yield number of seconds to wait before next step,
+#so the same logic is driven by a thread or by an event loop task
+def emergencyCycle():
+  global emergency, beeper, patient, power
   while True:
-    #print('Emergency monitor checking status')
     useBeeper = checkBeeper()
+    #battery is sampled at most once per sampling interval
+    batteryMonitor.update()
     if emergency == True:
-      batteryLevel = getBatteryLevel()
+      batteryLevel = batteryMonitor.level
       if batteryLevel < 20:
-        print('Low battery level ' + str(batteryLevel) + "%!!!")
+        logger.warning('Low battery level %:', batteryLevel)
       else:
-        print('Emergency glucose level ' + str(response[0]['sgv']) + '!!!')
+        logger.warning('Emergency glucose level:', patient.response[0]['sgv'])
       if useBeeper == True:
         beeper.resume()
       M5Led.on()
-      time.sleep(0.5)
+      yield 0.5
       if useBeeper == True:
         beeper.pause()
       M5Led.off()
-      time.sleep(0.5)
+      yield 0.5
     else:
-      #print('No emergency')
       if useBeeper == True:
         beeper.pause()
-      time.sleep(2)
-
-def mpu6050Monitor():
-  global mpu6050, mode, response
+      if power != None: yield POWER_IDLE_INTERVAL
+      else: yield 2
+
+def onOrientationChanged(flipped):
+  global mode
+  if flipped and mode in range(0,3): mode += 4 #change to 'Flip mode' #4,5,6
+  elif not flipped and mode in range(4,7): mode -= 4 #change to 'Normal mode' #0,1,2
+  elif flipped and mode == 7: mode = 8
+  elif not flipped and mode == 8: mode = 7
+  else: return
+  logger.info('Orientation changed, selected mode', MODES[mode])
+  requestRender(clear=True)
+
+def mpu6050Cycle():
+  global orientation, power
+  moves = orientation.moves
+  while True:
+    delay = orientation.update()
+    if orientation.moves != moves:
+      #device picked up or moved wakes the display
+      moves = orientation.moves
+      if power != None: power.wake()
+    yield delay
+
+def metricsCycle():
+  while True:
+    metrics.pollUdp()
+    yield 1
+
+def isAlertActive():
+  #only glucose alerts keep device awake, low battery alarm would drain it faster
+  global patients
+  for p in patients:
+    if p.alert == rules.ALERT_EMERGENCY: return True
+  return False
+
+def powerCycle():
+  #all monitors are stepped from one thread, so cpu can light sleep until the earliest next step
+  global emergency, power, hubListener, hubSender, patients, METRICS_PORT
+  if hubListener != None: backend = followerCycle()
+  else: backend = backendCycle()
+  #emergency cycle is the first task, it's run right away when alarm starts
+  tasks = [[0, emergencyCycle()], [0, mpu6050Cycle()], [0, backend]]
+  if METRICS_PORT > 0: tasks.append([0, metricsCycle()])
+  if hubSender != None: tasks.append([0, hubCycle()])
+  if len(patients) > 1: tasks.append([0, patientCycle()])
+  for task in tasks: task[0] = utime.ticks_ms()
+  wasEmergency = emergency
   while True:
-    acceleration = mpu6050.acceleration
-    hasResponse = (response != '{}')
-    if hasResponse and acceleration[0] > 0.1 and mode in range(0,3): mode += 4; printScreen(clear=True) #change to 'Flip mode' #4,5,6
-    elif hasResponse and acceleration[0] < -0.1 and mode in range(4,7): mode -= 4; printScreen(clear=True) #change to 'Normal mode' #0,1,2
-    elif hasResponse and acceleration[0] > 0.1 and mode == 7: mode = 8; printScreen(clear=True)
-    elif hasResponse and acceleration[0] < -0.1 and mode == 8: mode = 7; printScreen(clear=True)
-    #print("Acc:", str(acceleration))
-    time.sleep(0.5)
+    for task in tasks:
+      if utime.ticks_diff(task[0], utime.ticks_ms()) > 0: continue
+      #radio leaves modem sleep for backend requests
+      if task[1] == backend: power.setRadioSleep(False)
+      delay = next(task[1])
+      task[0] = utime.ticks_add(utime.ticks_ms(), (int)(delay * 1000))
+    #render request waits while display is off
+    if power.update(isAlertActive()) != pm.BLANK and renderSignal.acquire(0): renderPending()
+    if emergency and not wasEmergency: tasks[0][0] = utime.ticks_ms()
+    wasEmergency = emergency
+    wait = tasks[0][0]
+    for task in tasks:
+      if utime.ticks_diff(task[0], wait) < 0: wait = task[0]
+    wait = utime.ticks_diff(wait, utime.ticks_ms())
+    if wait < 0: wait = 0
+    yield wait / 1000
+
+#thread driving monitor cycle, power save mode sleeps with power manager instead
+def runMonitor(cycle, sleep=utime.sleep):
+  for delay in cycle:
+    sleep(delay)
+
+async def runCycle(cycle):
+  for delay in cycle:
+    await asyncio.sleep(delay)
+
+async def renderTask():
+  while True:
+    if renderSignal.acquire(0): renderPending()
+    else: await asyncio.sleep(RENDER_POLL_INTERVAL)
+
+async def schedulerMain():
+  asyncio.create_task(renderTask())
+  asyncio.create_task(runCycle(emergencyCycle()))
+  asyncio.create_task(runCycle(mpu6050Cycle()))
+  if METRICS_PORT > 0: asyncio.create_task(runCycle(metricsCycle()))
+  if hubSender != None: asyncio.create_task(runCycle(hubCycle()))
+  if len(patients) > 1: asyncio.create_task(runCycle(patientCycle()))
+  if hubListener != None:
+    #direct polls of follower block the loop, but they are done only while hub is silent
+    await runCycle(followerCycle())
+  else:
+    await backendTask()
         
 ########################################    
 
-print('Starting...')
-print('APIKEY:', deviceCfg.get_apikey())
+logger.info('Starting...')
+logger.info('APIKEY:', deviceCfg.get_apikey())
 macaddr=wifiCfg.wlan_sta.config('mac')
 macaddr='{:02x}:{:02x}:{:02x}:{:02x}:{:02x}:{:02x}'.format(*macaddr)
-print('MAC address:', macaddr)
-print('Free memory: ' + str(gc.mem_free()) + ' bytes')
+logger.info('MAC address:', macaddr)
+logger.info('Free memory bytes:', gc.mem_free())
 machine_id = binascii.hexlify(machine.unique_id())
-print('Machine unique id:', machine_id.decode())
-print('CPU frequency:', machine.freq())
+logger.info('Machine unique id:', machine_id.decode())
+logger.info('CPU frequency:', machine.freq())
 
-response = '{}'
+patients = []
+patient = None
+polledPatient = None
+pollScheduler = None
 brightness = 32
 emergency = False
 emergencyPause = 0
-currentBackgroudColor = -1
-screenDrawing = False
+drawnRegions = {}
+renderRequest = None
+renderPatient = None
+renderWindows = 0
+renderLock = _thread.allocate_lock()
+renderSignal = _thread.allocate_lock()
+renderSignal.acquire()
+pollEntryUs = 0
+backfillCount = 0
+screen = lcd
+frameCanvas = None
+hubSender = None
+hubListener = None
+power = None
+arrows = glyphs.buildArrows(ARROW_CENTERS, ARROW_SHAPES)
+textMetrics = glyphs.TextMetrics(lcd)
 
 axp.setLcdBrightness(brightness)
 lcd.orient(lcd.LANDSCAPE)
+batteryMonitor = BatteryMonitor(axp)
+batteryMonitor.update(force=True)
+mpu6050 = IMU()
+orientation = OrientationTracker(mpu6050)
 
 try:
   confFile = open('config.json', 'r')
@@ -554,39 +1034,128 @@ try:
   BEEPER_START_TIME = config["beeperStartTime"]
   BEEPER_END_TIME = config["beeperEndTime"]
   OLD_DATA = config["oldData"]
+  HISTORY_SIZE = config.get("history", 288)
+  SCHEDULER = config.get("scheduler", "thread")
+  ADAPTIVE_POLLING = config.get("adaptivePolling", 1)
+  ORIENTATION_INTERVAL = config.get("orientationInterval", 0.5)
+  CHART_HOURS = config.get("chartHours", 4)
+  FRAME_BUFFER = config.get("frameBuffer", 0)
+  METRICS_PORT = config.get("metricsPort", 0)
+  TREND_WINDOW = config.get("trendWindow", 30)
+  NAME = config.get("name", "")
+  PATIENTS = config.get("patients", [])
+  PATIENT_DISPLAY_TIME = config.get("patientDisplayTime", 15)
+  HUB_MODE = config.get("hub", "off")
+  HUB_GROUP = config.get("hubGroup", fanout.GROUP)
+  HUB_PORT = config.get("hubPort", fanout.PORT)
+  PREDICTION_MINUTES = config.get("predictionMinutes", 0)
+  LONG_HISTORY = config.get("longHistory", 1)
+  POWER_SAVE = config.get("powerSave", 0)
+  SCREEN_TIMEOUT = config.get("screenTimeout", 30)
+  logger.level = logger.getLevel(config.get("logLevel", "info"))
 
   if INTERVAL<30: INTERVAL=30
   if MIN<30: MIN=30
   if MAX<100: MAX=100
   if EMERGENCY_MIN<30 or MIN<=EMERGENCY_MIN: EMERGENCY_MIN=MIN-10
   if EMERGENCY_MAX<100 or MAX>=EMERGENCY_MAX: EMERGENCY_MAX=MAX+10  
-  if len(API_ENDPOINT)==0: raise Exception("Empty api-endpoint parameter")
+  if not nightscout.isValidUrl(API_ENDPOINT): raise Exception("Invalid api-endpoint parameter, http:// or https:// url expected")
   if len(WIFI)==0: raise Exception("Empty wifi parameter")
   if USE_BEEPER != 1 and USE_BEEPER != 0: USE_BEEPER=1
   if re.search("^GMT[+-]((0?[0-9]|1[0-1]):([0-5][0-9])|12:00)$",TIMEZONE)==None: TIMEZONE="GMT+0:00"
   if OLD_DATA < 10: OLD_DATA=10
+  if HISTORY_SIZE < 50: HISTORY_SIZE=50
+  if SCHEDULER != "thread" and SCHEDULER != "async": SCHEDULER="thread"
+  if ADAPTIVE_POLLING != 1 and ADAPTIVE_POLLING != 0: ADAPTIVE_POLLING=1
+  if FRAME_BUFFER != 1 and FRAME_BUFFER != 0: FRAME_BUFFER=0
+  if ORIENTATION_INTERVAL < 0.1 or ORIENTATION_INTERVAL > 2: ORIENTATION_INTERVAL=0.5
+  if TREND_WINDOW < 15 or TREND_WINDOW > 60: TREND_WINDOW=30
+  if PREDICTION_MINUTES != 0 and (PREDICTION_MINUTES < 15 or PREDICTION_MINUTES > 30): PREDICTION_MINUTES=20
+  if LONG_HISTORY != 1 and LONG_HISTORY != 0: LONG_HISTORY=1
+  if POWER_SAVE != 1 and POWER_SAVE != 0: POWER_SAVE=0
+  if SCREEN_TIMEOUT < 10: SCREEN_TIMEOUT=30
+  #power save mode steps all monitors from its own single thread
+  if POWER_SAVE == 1: SCHEDULER="thread"
+  #user rules take precedence over rules derived from thresholds
+  glucoseRules = rules.RuleTable(config.get("rules", []) + rules.getDefaultRules(MIN, MAX, EMERGENCY_MIN, EMERGENCY_MAX), lambda name: getattr(lcd, name))
+  try:
+    BEEPER_START = rules.getSecondsOfDay(BEEPER_START_TIME)
+    BEEPER_END = rules.getSecondsOfDay(BEEPER_END_TIME)
+  except Exception as e:
+    #beeper is used all day if time range can't be parsed
+    logger.exception(e)
+    BEEPER_START = 0
+    BEEPER_END = rules.DAY
+  if METRICS_PORT < 0 or METRICS_PORT > 65535: METRICS_PORT=0
+  for entry in PATIENTS:
+    if not nightscout.isValidUrl(entry.get("api-endpoint", "")): raise Exception("Invalid api-endpoint parameter of patient, http:// or https:// url expected")
+    if entry.get("history", HISTORY_SIZE) < 50: entry["history"] = 50
+  if PATIENT_DISPLAY_TIME < 5: PATIENT_DISPLAY_TIME=15
+  if HUB_MODE != "hub" and HUB_MODE != "follower": HUB_MODE="off"
+  if HUB_MODE != "off" and len(PATIENTS) > 0:
+    logger.warning('Hub mode shares readings of single patient only, disabled')
+    HUB_MODE="off"
+  if HUB_PORT <= 0 or HUB_PORT > 65535: HUB_PORT=fanout.PORT
 
   timeStr = TIMEZONE[4:]
   [HH, MM] = [int(i) for i in timeStr.split(':')]
   secondsDiff = HH * 3600 + MM * 60
   if TIMEZONE[3] == "-": secondsDiff = secondsDiff * -1
-  print('Local time seconds difference:', secondsDiff) 
+  logger.info('Local time seconds difference:', secondsDiff)
   
   beeper = PWM(Pin(2), freq=1000, duty=50)
   beeper.pause()
 
-  mpu6050 = IMU()
+  orientation.interval = ORIENTATION_INTERVAL
+  if FRAME_BUFFER == 1:
+    frameCanvas, reason = frame.createCanvas(lcd)
+    if frameCanvas == None: logger.warning('Drawing directly to lcd,', reason)
+    else: logger.info('Frame buffer rows:', frameCanvas.rows)
+  orientation.addListener(onOrientationChanged)
   mode = 0
-  if mpu6050.acceleration[0] > 0: mode = 4 #flip
+  if orientation.flipped: mode = 4 #flip
 
   lcd.clear(lcd.DARKGREY)
 except Exception as e:
-  sys.print_exception(e)
+  logger.exception(e)
+  logger.save()
   while True:
     printCenteredText("Fix config.json!", backgroundColor=lcd.RED, clear=True)
-    time.sleep(2)
+    utime.sleep(2)
     printCenteredText("Restart required!", backgroundColor=lcd.RED, clear=True)
-    time.sleep(2)
+    utime.sleep(2)
+
+try:
+  startTime = utime.time()
+  rtcValid = utime.localtime()[0] >= RTC_MIN_YEAR
+
+  patients.append(Patient(NAME, API_ENDPOINT, API_TOKEN, HISTORY_SIZE, '', TREND_WINDOW * 60, LONG_HISTORY == 1))
+  for i in range(len(PATIENTS)):
+    entry = PATIENTS[i]
+    patients.append(Patient(entry.get("name", str(i + 2)), entry["api-endpoint"], entry.get("api-token", ""), entry.get("history", HISTORY_SIZE), str(i + 1), TREND_WINDOW * 60, LONG_HISTORY == 1))
+  for p in patients:
+    if not p.log.load():
+      #migrate history saved by previous versions in text file
+      if p == patients[0]: readSgvFile(p.history)
+      p.log.compact()
+    logger.info('Loaded sgv entries:', len(p.history), p.name)
+    for rollup in p.rollups:
+      #readings of bucket open at restart are rolled up again from history
+      if not rollup.load(): rollup.compact()
+      rollup.fill(p.history)
+    p.response = getCachedResponse(p.history, rtcValid)
+    p.cachedResponse = p.response != '{}'
+  patient = patients[0]
+  sgvChart = SgvChart(patient.history, lcd, hours=CHART_HOURS, rollups=patient.rollups)
+  pollScheduler = PollScheduler(patients)
+
+  #last reading is shown before network is up
+  if patient.response != '{}': printScreen(clear=True)
+except Exception as e:
+  logger.exception(e)
+  printCenteredText("Restart required!", backgroundColor=lcd.RED, clear=True)
+  utime.sleep(1)
+  resetMachine()
 
 #this doesn't work
 #machine.freq(20000000)    
@@ -594,51 +1163,95 @@ except Exception as e:
 nic = network.WLAN(network.STA_IF)
 nic.active(True)
 
-printCenteredText("Scanning wifi...", backgroundColor=lcd.DARKGREY)
-
 found = False
-while not found:
-  try: 
-    nets = nic.scan()
-    for result in nets:
-      ssid = result[0].decode() 
-      if ssid in WIFI: found = True; SSID=ssid; WIFI_PASSWORD=WIFI[ssid]; break
+bootState = readBootState()
+SSID = bootState.get('ssid')
+if SSID in WIFI and 'bssid' in bootState:
+  #connect to access point of last session without scanning
+  printBootStatus("Connecting wifi...")
+  try:
+    found = connectWifi(SSID, WIFI[SSID], ubinascii.unhexlify(bootState['bssid']), bootState.get('channel'), timeout=WIFI_FAST_CONNECT_TIMEOUT)
   except Exception as e:
-      sys.print_exception(e)
-      printCenteredText("Wifi not found!", backgroundColor=lcd.RED, clear=True)  
-  if not found: time.sleep(1)
-
-printCenteredText("Connecting wifi...", backgroundColor=lcd.DARKGREY) #lcd.OLIVE)
-nic.connect(SSID, WIFI_PASSWORD)
-print('Connecting wifi ' + SSID)
-while not nic.isconnected():
-  print(".", end="")
-  time.sleep(0.25)
-print("")  
+    logger.exception(e)
+  if not found:
+    logger.warning('Cached wifi not available', SSID)
+    nic.disconnect()
+
+if not found:
+  printBootStatus("Scanning wifi...")
+
+  while not found:
+    try: 
+      nets = nic.scan()
+      for result in nets:
+        ssid = result[0].decode() 
+        if ssid in WIFI: found = True; SSID=ssid; WIFI_PASSWORD=WIFI[ssid]; BSSID=result[1]; CHANNEL=result[2]; break
+    except Exception as e:
+        logger.exception(e)
+        printCenteredText("Wifi not found!", backgroundColor=lcd.RED, clear=True)  
+    if not found: utime.sleep(1)
 
-printCenteredText("Setting time...", backgroundColor=lcd.DARKGREY) #lcd.GREENYELLOW)
+  printBootStatus("Connecting wifi...") #lcd.OLIVE)
+  connectWifi(SSID, WIFI_PASSWORD)
+  bootState = {'ssid': SSID, 'bssid': ubinascii.hexlify(BSSID).decode(), 'channel': CHANNEL}
+  saveBootState(bootState)
 
 try: 
-  rtc = RTC()
-  tm = utime.localtime(getNtpTime())
-  rtc.datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
-  print("Current UTC datetime " +  str(rtc.datetime()))
-  startTime = utime.time()
-
-  printCenteredText("Loading data...", backgroundColor=lcd.DARKGREY) #lcd.DARKGREEN)
-
-  sgvDict = readSgvFile()
-  dictLen = len(sgvDict)
-  print('Loaded ' + str(dictLen) + " sgv entries")
-
-  _thread.start_new_thread(backendMonitor, ())
-  _thread.start_new_thread(emergencyMonitor, ())
-  _thread.start_new_thread(mpu6050Monitor, ())
+  if rtcValid:
+    logger.info("RTC datetime is valid, skipping NTP")
+  else:
+    printBootStatus("Setting time...") #lcd.GREENYELLOW)
+    rtc = RTC()
+    tm = utime.localtime(getNtpTime())
+    rtc.datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+    logger.info("Current UTC datetime", rtc.datetime())
+    startTime = utime.time()
 
   btnA.wasPressed(onBtnAPressed)
   btnB.wasPressed(onBtnBPressed)
+
+  if METRICS_PORT > 0:
+    #stage timings are returned to any udp datagram sent to this port
+    metrics.serveUdp(METRICS_PORT)
+    logger.info('Metrics served on udp port', METRICS_PORT)
+
+  if HUB_MODE != "off":
+    try:
+      if HUB_MODE == "hub": hubSender = fanout.HubSender(fanout.getChannel(API_ENDPOINT), API_TOKEN, HUB_GROUP, HUB_PORT)
+      else: hubListener = fanout.HubListener(fanout.getChannel(API_ENDPOINT), API_TOKEN, HUB_GROUP, HUB_PORT)
+      logger.info('Running as ' + HUB_MODE + ' on', HUB_GROUP, HUB_PORT)
+    except Exception as e:
+      #device polls backend on its own
+      logger.exception(e)
+
+  #follower of hub falls back to blocking client in its thread
+  clientClass = nightscout.NightscoutClient
+  if SCHEDULER == "async" and hubListener == None: clientClass = nightscout.AsyncNightscoutClient
+  for p in patients: p.client = clientClass(p.endpoint, getBackendHeaders(p.token), timeout=BACKEND_TIMEOUT)
+
+  if POWER_SAVE == 1:
+    #display is dimmed after screen timeout and switched off after four times as long
+    power = pm.PowerManager(axp, nic, brightness, SCREEN_TIMEOUT, SCREEN_TIMEOUT * 4)
+    orientation.idleInterval = POWER_ORIENTATION_INTERVAL
+    #light sleep drops wifi association, device stays connected if it has to send or receive
+    #packets between polls, radio uses modem sleep then
+    if hubListener != None or hubSender != None or METRICS_PORT > 0: power.lightSleep = False
+    _thread.start_new_thread(runMonitor, (powerCycle(), power.sleep))
+  elif SCHEDULER == "async":
+    #all monitors run as tasks of single event loop, no additional thread stacks
+    import uasyncio as asyncio
+    asyncio.run(schedulerMain())
+  else:
+    _thread.start_new_thread(renderWorker, ())
+    if hubListener != None: _thread.start_new_thread(runMonitor, (followerCycle(),))
+    else: _thread.start_new_thread(runMonitor, (backendCycle(),))
+    if hubSender != None: _thread.start_new_thread(runMonitor, (hubCycle(),))
+    if len(patients) > 1: _thread.start_new_thread(runMonitor, (patientCycle(),))
+    _thread.start_new_thread(runMonitor, (emergencyCycle(),))
+    _thread.start_new_thread(runMonitor, (mpu6050Cycle(),))
+    if METRICS_PORT > 0: _thread.start_new_thread(runMonitor, (metricsCycle(),))
 except Exception as e:
-  sys.print_exception(e)
+  logger.exception(e)
   printCenteredText("Restart required!", backgroundColor=lcd.RED, clear=True)
-  time.sleep(1)
+  utime.sleep(1)
   resetMachine()
\ No newline at end of file
@@ -0,0 +1,118 @@
+import gc
+import utime
+from array import array
+
+#Hot path instrumentation: duration, heap delta and gc runs of monitor stages
+#Every finished span is stored in fixed size ring of samples and in per stage totals
+
+STAGES = ("fetch", "parse", "merge", "persist", "render")
+FETCH = 0
+PARSE = 1
+MERGE = 2
+PERSIST = 3
+RENDER = 4
+
+SAMPLES = 64
+
+sampleStage = bytearray(SAMPLES)
+sampleGc = bytearray(SAMPLES)
+sampleUs = array('I', [0] * SAMPLES)
+sampleHeap = array('i', [0] * SAMPLES)
+sampleTime = array('I', [0] * SAMPLES)
+samplePos = 0
+sampleCount = 0
+
+count = array('I', [0] * len(STAGES))
+totalUs = array('I', [0] * len(STAGES))
+maxUs = array('I', [0] * len(STAGES))
+totalHeap = array('i', [0] * len(STAGES))
+gcRuns = array('I', [0] * len(STAGES))
+
+enabled = True
+
+#returns start ticks and free heap of new span, pass them to end()
+def begin():
+  return utime.ticks_us(), gc.mem_free()
+
+def end(stage, span):
+  if not enabled: return 0
+  us = utime.ticks_diff(utime.ticks_us(), span[0])
+  record(stage, us, span[1] - gc.mem_free())
+  return us
+
+#heap delta is allocated bytes, negative delta means garbage collection was run during the span
+def record(stage, us, heap=0):
+  global samplePos, sampleCount
+  if not enabled: return
+  if us < 0: us = 0
+  collected = heap < 0
+  p = samplePos
+  sampleStage[p] = stage
+  sampleUs[p] = us
+  sampleHeap[p] = heap
+  sampleGc[p] = collected
+  sampleTime[p] = utime.time()
+  samplePos = (p + 1) % SAMPLES
+  if sampleCount < SAMPLES: sampleCount += 1
+
+  count[stage] += 1
+  totalUs[stage] = (totalUs[stage] + us) & 0xFFFFFFFF
+  if us > maxUs[stage]: maxUs[stage] = us
+  totalHeap[stage] += heap
+  if collected: gcRuns[stage] += 1
+
+def reset():
+  global samplePos, sampleCount
+  samplePos = 0
+  sampleCount = 0
+  for i in range(len(STAGES)):
+    count[i] = 0
+    totalUs[i] = 0
+    maxUs[i] = 0
+    totalHeap[i] = 0
+    gcRuns[i] = 0
+
+#iterates (time, stage name, us, heap delta, gc) of stored samples from the oldest one
+def samples():
+  start = (samplePos - sampleCount) % SAMPLES
+  for i in range(sampleCount):
+    p = (start + i) % SAMPLES
+    yield sampleTime[p], STAGES[sampleStage[p]], sampleUs[p], sampleHeap[p], sampleGc[p]
+
+def summary():
+  lines = ["stage      count    avg_us    max_us  avg_heap  gc_runs"]
+  for i in range(len(STAGES)):
+    n = count[i]
+    if n == 0: avgUs = avgHeap = 0
+    else:
+      avgUs = totalUs[i] // n
+      avgHeap = totalHeap[i] // n
+    lines.append("{:8s} {:7d} {:9d} {:9d} {:9d} {:8d}".format(STAGES[i], n, avgUs, maxUs[i], avgHeap, gcRuns[i]))
+  lines.append("free heap: " + str(gc.mem_free()) + " bytes")
+  return "\n".join(lines)
+
+#call from REPL: import metrics; metrics.dump()
+def dump(withSamples=False):
+  print(summary())
+  if withSamples:
+    for sample in samples():
+      print("{} {:8s} {:7d}us {:6d}B gc={}".format(*sample))
+
+#Optional UDP endpoint, any datagram sent to the port is answered with summary
+udpSocket = None
+
+def serveUdp(port):
+  global udpSocket
+  import usocket as socket
+  udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  udpSocket.bind(socket.getaddrinfo("0.0.0.0", port)[0][-1])
+  udpSocket.setblocking(False)
+
+def pollUdp():
+  if udpSocket == None: return False
+  try:
+    request, addr = udpSocket.recvfrom(64)
+  except OSError:
+    return False
+  udpSocket.sendto(summary().encode(), addr)
+  return True
@@ -0,0 +1,395 @@
+import usocket as socket
+import utime
+
+#Streaming reader of Nightscout entries.json responses
+#Parses the body chunk by chunk and keeps only the fields used by the monitor,
+#so peak memory doesn't depend on number of entries returned by the api
+
+FIELDS = (b'sgv', b'direction', b'date', b'ago')
+SGV = 0
+DIRECTION = 1
+DATE = 2
+AGO = 3
+
+CHUNK_SIZE = 128
+TOKEN_SIZE = 48
+
+QUOTE = 0x22
+BACKSLASH = 0x5C
+COLON = 0x3A
+COMMA = 0x2C
+NEWLINE = 0x0A
+OBJECT_START = 0x7B
+OBJECT_END = 0x7D
+ARRAY_START = 0x5B
+ARRAY_END = 0x5D
+WHITESPACE = (0x20, 0x09, 0x0A, 0x0D)
+
+def toValue(token, n, isString):
+  if isString: return bytes(token[:n]).decode()
+  raw = bytes(token[:n])
+  if raw == b'null' or raw == b'true' or raw == b'false': return None
+  if b'.' in raw or b'e' in raw or b'E' in raw: return int(float(raw))
+  return int(raw)
+
+#Incremental parser, chunks of response body are passed to feed() as they arrive
+#and onEntry(sgv, direction, date, ago) is called for every complete entry,
+#entries without sgv or date (e.g. calibrations) are skipped
+#us is total time spent in feed() including onEntry callbacks, size is number of bytes fed
+class EntriesParser:
+  def __init__(self):
+    self.token = bytearray(TOKEN_SIZE)
+    self.record = [None, None, None, None]
+    self.n = 0
+    self.depth = 0
+    self.field = -1
+    self.isKey = False
+    self.inString = False
+    self.escape = False
+    self.inNumber = False
+    self.us = 0
+    self.size = 0
+
+  def feed(self, chunk, size, onEntry):
+    start = utime.ticks_us()
+    #parser state is kept in locals while chunk is scanned
+    token = self.token
+    record = self.record
+    n = self.n
+    depth = self.depth
+    field = self.field
+    isKey = self.isKey
+    inString = self.inString
+    escape = self.escape
+    inNumber = self.inNumber
+
+    for i in range(size):
+      c = chunk[i]
+      if inString:
+        if escape:
+          escape = False
+        elif c == BACKSLASH:
+          escape = True
+          continue
+        elif c == QUOTE:
+          inString = False
+          if depth == 2:
+            if isKey:
+              field = -1
+              key = token[:n]
+              for f in range(len(FIELDS)):
+                if key == FIELDS[f]: field = f; break
+            elif field >= 0:
+              record[field] = toValue(token, n, True)
+          continue
+        if depth == 2 and n < TOKEN_SIZE:
+          token[n] = c
+          n += 1
+        continue
+
+      if inNumber and (c == COMMA or c == OBJECT_END or c in WHITESPACE):
+        inNumber = False
+        if field >= 0: record[field] = toValue(token, n, False)
+
+      if c == QUOTE:
+        inString = True
+        n = 0
+      elif c == OBJECT_START or c == ARRAY_START:
+        depth += 1
+        if depth == 2:
+          record[0] = record[1] = record[2] = record[3] = None
+          isKey = True
+          field = -1
+      elif c == OBJECT_END or c == ARRAY_END:
+        depth -= 1
+        if depth == 1 and c == OBJECT_END and record[SGV] != None and record[DATE] != None:
+          onEntry(record[0], record[1], record[2], record[3])
+      elif depth == 2:
+        if c == COLON:
+          isKey = False
+        elif c == COMMA:
+          isKey = True
+          field = -1
+        elif not isKey and not c in WHITESPACE:
+          if not inNumber:
+            inNumber = True
+            n = 0
+          if n < TOKEN_SIZE:
+            token[n] = c
+            n += 1
+
+    self.n = n
+    self.depth = depth
+    self.field = field
+    self.isKey = isKey
+    self.inString = inString
+    self.escape = escape
+    self.inNumber = inNumber
+    self.size += size
+    self.us += utime.ticks_diff(utime.ticks_us(), start)
+
+#returns (useSsl, host, port, path) of http or https url
+def parseUrl(url):
+  proto, _, hostPort = url.split('/', 2)[:3]
+  path = ''
+  i = hostPort.find('/')
+  if i >= 0:
+    path = hostPort[i:]
+    hostPort = hostPort[:i]
+  useSsl = proto == 'https:'
+  if useSsl: port = 443
+  else: port = 80
+  if ':' in hostPort:
+    hostPort, port = hostPort.split(':', 1)
+    port = int(port)
+  return useSsl, hostPort, port, path
+
+#returns True if url is http or https url with host, which parseUrl accepts
+def isValidUrl(url):
+  if not url.startswith('http://') and not url.startswith('https://'): return False
+  try:
+    return len(parseUrl(url)[1]) > 0
+  except ValueError:
+    return False
+
+#Blocking Nightscout http client keeping connection alive between polls
+#Responses are validated with If-None-Match/If-Modified-Since, 304 status means nothing has changed
+class NightscoutClient:
+  def __init__(self, url, headers, timeout=20, chunkSize=CHUNK_SIZE):
+    self.useSsl, self.host, self.port, self.basePath = parseUrl(url)
+    self.headers = headers
+    self.timeout = timeout
+    self.buf = bytearray(chunkSize)
+    self.mv = memoryview(self.buf)
+    self.pos = 0
+    self.end = 0
+    self.sock = None
+    self.connects = 0
+    #time spent parsing body of last response and its size
+    self.parseUs = 0
+    self.bodySize = 0
+    #validators of last response, only valid for the same path
+    self.lastPath = None
+    self.etag = None
+    self.lastModified = None
+
+  def connect(self):
+    addr = socket.getaddrinfo(self.host, self.port)[0][-1]
+    sock = socket.socket()
+    try:
+      sock.settimeout(self.timeout)
+      sock.connect(addr)
+      if self.useSsl:
+        import ussl
+        sock = ussl.wrap_socket(sock, server_hostname=self.host)
+    except Exception:
+      sock.close()
+      raise
+    self.sock = sock
+    #plain sockets and ssl streams don't share the same method names on all ports
+    self.sockRead = getattr(sock, 'readinto', None) or sock.recv_into
+    self.sockWrite = getattr(sock, 'sendall', None) or sock.write
+    self.pos = 0
+    self.end = 0
+    self.connects += 1
+
+  def close(self):
+    if self.sock != None:
+      try:
+        self.sock.close()
+      except Exception:
+        pass
+      self.sock = None
+
+  def fill(self):
+    self.pos = 0
+    self.end = self.sockRead(self.buf)
+    if not self.end:
+      self.end = 0
+      raise OSError('Connection closed')
+
+  def readline(self):
+    #MicroPython bytearray has no find(), buffered bytes are scanned for newline
+    line = b''
+    buf = self.buf
+    while True:
+      if self.pos == self.end: self.fill()
+      i = self.pos
+      end = self.end
+      while i < end and buf[i] != NEWLINE: i += 1
+      if i < end:
+        line += buf[self.pos:i+1]
+        self.pos = i + 1
+        return line
+      line += buf[self.pos:self.end]
+      self.pos = self.end
+      if len(line) > 512: raise OSError('Header line too long')
+
+  def readBody(self, length, parser, onEntry):
+    #length -1 means body until connection is closed
+    while length != 0:
+      if self.pos == self.end:
+        if length < 0:
+          self.pos = 0
+          self.end = self.sockRead(self.buf) or 0
+          if self.end == 0: return
+        else:
+          self.fill()
+      n = self.end - self.pos
+      if length > 0 and n > length: n = length
+      if parser != None: parser.feed(self.mv[self.pos:self.pos+n], n, onEntry)
+      self.pos += n
+      if length > 0: length -= n
+
+  def getRequest(self, path):
+    req = b'GET ' + path.encode() + b' HTTP/1.1\r\nHost: ' + self.host.encode() + b'\r\nConnection: keep-alive\r\n'
+    for name in self.headers:
+      req += name.encode() + b': ' + self.headers[name].encode() + b'\r\n'
+    if path == self.lastPath:
+      if self.etag != None: req += b'If-None-Match: ' + self.etag.encode() + b'\r\n'
+      if self.lastModified != None: req += b'If-Modified-Since: ' + self.lastModified.encode() + b'\r\n'
+    return req + b'\r\n'
+
+  def startResponse(self, line):
+    self.length = -1
+    self.chunked = False
+    self.keepAlive = True
+    self.newEtag = None
+    self.newLastModified = None
+    return int(line.split(None, 2)[1])
+
+  #returns False at the blank line ending response headers
+  def readHeader(self, line):
+    if line == b'\r\n' or line == b'\n': return False
+    line = line.decode()
+    i = line.find(':')
+    if i < 0: return True
+    name = line[:i].strip().lower()
+    value = line[i+1:].strip()
+    if name == 'content-length': self.length = int(value)
+    elif name == 'transfer-encoding': self.chunked = value.lower() == 'chunked'
+    elif name == 'connection': self.keepAlive = value.lower() != 'close'
+    elif name == 'etag': self.newEtag = value
+    elif name == 'last-modified': self.newLastModified = value
+    return True
+
+  def startBody(self, status):
+    if status == 304 or status == 204: self.length = 0
+    if status == 200: return EntriesParser()
+    return None
+
+  def finishResponse(self, status, path, parser):
+    if not self.chunked and self.length < 0: self.keepAlive = False
+    if not self.keepAlive: self.close()
+    if status == 200:
+      self.parseUs = parser.us
+      self.bodySize = parser.size
+      self.lastPath = path
+      self.etag = self.newEtag
+      self.lastModified = self.newLastModified
+    return status
+
+  def request(self, path, onEntry):
+    self.parseUs = 0
+    self.bodySize = 0
+    if self.sock == None: self.connect()
+    self.sockWrite(self.getRequest(path))
+    status = self.startResponse(self.readline())
+    while self.readHeader(self.readline()): pass
+    parser = self.startBody(status)
+    if self.chunked:
+      while True:
+        size = int(self.readline().split(b';')[0].strip(), 16)
+        if size == 0:
+          #trailer
+          while self.readline() not in (b'\r\n', b'\n'): pass
+          break
+        self.readBody(size, parser, onEntry)
+        self.readline()
+    else:
+      self.readBody(self.length, parser, onEntry)
+    return self.finishResponse(status, path, parser)
+
+  #GET entries query relative to api url, entries of 200 response are passed to onEntry(sgv, direction, date, ago)
+  #stale kept-alive connection is reopened once, returns http status code
+  def get(self, query, onEntry):
+    path = self.basePath + query
+    reused = self.sock != None
+    try:
+      return self.request(path, onEntry)
+    except Exception:
+      self.close()
+      if not reused: raise
+    return self.request(path, onEntry)
+
+#Non blocking variant of the client for uasyncio scheduler, same keep-alive and conditional requests over uasyncio streams
+#sock holds the stream writer so connection state is checked the same way as for blocking client
+class AsyncNightscoutClient(NightscoutClient):
+  def __init__(self, url, headers, timeout=20, chunkSize=CHUNK_SIZE):
+    NightscoutClient.__init__(self, url, headers, timeout, chunkSize)
+    self.reader = None
+
+  async def connect(self):
+    #imported only when scheduler mode uses it
+    try:
+      import uasyncio as asyncio
+    except ImportError:
+      import asyncio
+    if self.useSsl: self.reader, self.sock = await asyncio.open_connection(self.host, self.port, ssl=True)
+    else: self.reader, self.sock = await asyncio.open_connection(self.host, self.port)
+    self.connects += 1
+
+  def close(self):
+    NightscoutClient.close(self)
+    self.reader = None
+
+  async def readline(self):
+    line = await self.reader.readline()
+    if not line: raise OSError('Connection closed')
+    if len(line) > 512: raise OSError('Header line too long')
+    return line
+
+  async def readBody(self, length, parser, onEntry):
+    #length -1 means body until connection is closed
+    while length != 0:
+      n = len(self.buf)
+      if length > 0 and n > length: n = length
+      chunk = await self.reader.read(n)
+      if not chunk:
+        if length < 0: return
+        raise OSError('Connection closed')
+      if parser != None: parser.feed(chunk, len(chunk), onEntry)
+      if length > 0: length -= len(chunk)
+
+  async def request(self, path, onEntry):
+    self.parseUs = 0
+    self.bodySize = 0
+    if self.sock == None: await self.connect()
+    self.sock.write(self.getRequest(path))
+    await self.sock.drain()
+    status = self.startResponse(await self.readline())
+    while self.readHeader(await self.readline()): pass
+    parser = self.startBody(status)
+    if self.chunked:
+      while True:
+        size = int((await self.readline()).split(b';')[0].strip(), 16)
+        if size == 0:
+          #trailer
+          while (await self.readline()) not in (b'\r\n', b'\n'): pass
+          break
+        await self.readBody(size, parser, onEntry)
+        await self.readline()
+    else:
+      await self.readBody(self.length, parser, onEntry)
+    return self.finishResponse(status, path, parser)
+
+  #same as blocking get(), caller closes the client when request is cancelled by timeout
+  async def get(self, query, onEntry):
+    path = self.basePath + query
+    reused = self.sock != None
+    try:
+      return await self.request(path, onEntry)
+    except Exception:
+      self.close()
+      if not reused: raise
+    return await self.request(path, onEntry)
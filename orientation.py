@@ -0,0 +1,58 @@
+import utime
+
+#Screen orientation tracked from IMU x axis with dead band and debounce,
+#so device lying flat or being handled doesn't flip the screen back and forth
+
+THRESHOLD = 0.3 #g, x acceleration has to exceed it to change orientation
+DEBOUNCE = 1000 #ms, new orientation has to be stable this long
+INTERVAL = 0.5 #sec
+IDLE_INTERVAL = 2 #sec, sample period after device has been still for IDLE_AFTER
+IDLE_AFTER = 60 #sec
+STILLNESS = 0.05 #g, smaller change of any axis between samples means device is still
+
+class OrientationTracker:
+  def __init__(self, imu, interval=INTERVAL, idleInterval=IDLE_INTERVAL):
+    self.imu = imu
+    self.interval = interval
+    self.idleInterval = idleInterval
+    self.listeners = []
+    self.changes = 0
+    self.moves = 0 #samples changed by more than STILLNESS
+    self.reads = 1
+    self.last = imu.acceleration
+    #initial orientation doesn't need to wait for debounce
+    self.flipped = self.last[0] > 0
+    self.pendingSince = None
+    self.stillSince = utime.time()
+
+  #onChange(flipped) is called from update() after orientation has changed
+  def addListener(self, onChange):
+    self.listeners.append(onChange)
+
+  #samples imu, returns number of seconds to wait before next update
+  def update(self):
+    acceleration = self.imu.acceleration
+    self.reads += 1
+    last = self.last
+    self.last = acceleration
+    if abs(acceleration[0]-last[0]) > STILLNESS or abs(acceleration[1]-last[1]) > STILLNESS or abs(acceleration[2]-last[2]) > STILLNESS:
+      self.stillSince = utime.time()
+      self.moves += 1
+
+    x = acceleration[0]
+    if (x > THRESHOLD and not self.flipped) or (x < -THRESHOLD and self.flipped):
+      now = utime.ticks_ms()
+      if self.pendingSince == None:
+        self.pendingSince = now
+      elif utime.ticks_diff(now, self.pendingSince) >= DEBOUNCE:
+        self.pendingSince = None
+        self.flipped = not self.flipped
+        self.changes += 1
+        for onChange in self.listeners:
+          onChange(self.flipped)
+    else:
+      #back in dead band or in current orientation
+      self.pendingSince = None
+
+    if self.pendingSince == None and utime.time() - self.stillSince >= IDLE_AFTER: return self.idleInterval
+    return self.interval
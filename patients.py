@@ -0,0 +1,72 @@
+from history import SgvHistory, HistoryLog
+from trend import TrendAnalyzer
+from rollup import SgvRollup, TIERS
+from backfill import Backfill
+
+#Per patient monitoring state and scheduler of backend polls shared by all patients
+#Polls are run one by one, at least STAGGER seconds apart, so requests never overlap
+#and only CONNECTIONS kept alive backend connections are open at the same time.
+#Patient with higher alert level is polled before patients due up to PRIORITY seconds per level earlier
+
+STAGGER = 5 #sec
+CONNECTIONS = 1
+PRIORITY = 30 #sec
+
+class Patient:
+  #files of patient are named sgvlog<suffix>.bin, sgv<bucket minutes>m<suffix>.bin
+  def __init__(self, name, endpoint, token, historySize, fileSuffix, trendWindow, longHistory=True):
+    self.name = name
+    self.endpoint = endpoint
+    self.token = token
+    self.history = SgvHistory(historySize)
+    self.log = HistoryLog('sgvlog' + fileSuffix + '.bin', self.history)
+    self.trend = TrendAnalyzer(self.history, trendWindow)
+    self.backfill = Backfill(self.history)
+    #rolled up buckets from the finest ones
+    self.rollups = []
+    if longHistory:
+      for period, capacity in TIERS:
+        self.rollups.append(SgvRollup(period, capacity, 'sgv' + str(period // 60) + 'm' + fileSuffix + '.bin'))
+    self.client = None
+    #newest reading shown on the screen
+    self.response = '{}'
+    self.cachedResponse = False
+    #polling state
+    self.fullFetch = True
+    self.lateRetries = 0
+    self.uploadLag = 0
+    self.pollStartNewestTime = -1
+    self.nextPoll = 0
+    self.lastPoll = 0
+    #alert level of the newest reading
+    self.alert = 0
+
+class PollScheduler:
+  def __init__(self, patients, stagger=STAGGER, connections=CONNECTIONS):
+    self.patients = patients
+    self.stagger = stagger
+    self.connections = connections
+    self.lastPoll = None
+
+  #returns (patient, seconds to wait before polling it)
+  def next(self, now):
+    best = self.patients[0]
+    for p in self.patients:
+      if p.nextPoll - p.alert * PRIORITY < best.nextPoll - best.alert * PRIORITY: best = p
+    wait = best.nextPoll - now
+    if self.lastPoll != None and self.lastPoll + self.stagger - now > wait: wait = self.lastPoll + self.stagger - now
+    if wait < 0: wait = 0
+    return best, wait
+
+  #records finished poll, connections above budget are closed starting from the least recently polled patient
+  def done(self, patient, now, delay):
+    patient.nextPoll = now + delay
+    patient.lastPoll = now
+    self.lastPoll = now
+    connected = [p for p in self.patients if p.client != None and p.client.sock != None]
+    while len(connected) > self.connections:
+      oldest = connected[0]
+      for p in connected:
+        if p.lastPoll < oldest.lastPoll: oldest = p
+      oldest.client.close()
+      connected.remove(oldest)
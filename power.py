@@ -0,0 +1,102 @@
+import utime
+import machine
+
+#Power management of idle device, backlight is dimmed and then switched off when nobody has
+#touched or moved the device for a while, cpu light sleeps until the next monitor step, which
+#drops wifi association, or stays awake with wifi radio in modem sleep between polls if device
+#has to stay connected. Device stays fully awake while alert is active
+
+DIM_AFTER = 30 #sec without activity
+BLANK_AFTER = 120 #sec without activity
+DIM_BRIGHTNESS = 10
+LIGHT_SLEEP_MIN = 0.1 #sec, shorter waits aren't worth entering light sleep
+
+AWAKE = 0
+DIMMED = 1
+BLANK = 2
+STATES = ("awake", "dimmed", "blank")
+
+class PowerManager:
+  def __init__(self, axp, nic, brightness, dimAfter=DIM_AFTER, blankAfter=BLANK_AFTER):
+    self.axp = axp
+    self.nic = nic
+    self.brightness = brightness
+    self.dimAfter = dimAfter
+    self.blankAfter = blankAfter
+    self.state = AWAKE
+    self.alert = False
+    #cpu light sleep is disabled if device has to listen to network all the time
+    self.lightSleep = True
+    self.lastActivity = utime.time()
+    self.lightSleeps = 0
+    self.wakes = 0
+    self.wakeReason = None
+    #wifi power save modes are available on newer firmware only
+    self.radioSleep = None
+    self.pmSleep = getattr(nic, 'PM_POWERSAVE', None)
+    self.pmAwake = getattr(nic, 'PM_NONE', None)
+    #buttons A and B are active low on gpio 37 and 39
+    self.pinWake = False
+    try:
+      import esp32
+      esp32.wake_on_ext0(pin=machine.Pin(37, machine.Pin.IN), level=esp32.WAKEUP_ALL_LOW)
+      esp32.wake_on_ext1(pins=(machine.Pin(39, machine.Pin.IN),), level=esp32.WAKEUP_ALL_LOW)
+      self.pinWake = True
+    except Exception:
+      pass
+
+  def setBrightness(self, brightness):
+    self.brightness = brightness
+    if self.state == AWAKE: self.axp.setLcdBrightness(brightness)
+
+  def setState(self, state):
+    if state == self.state: return
+    if state == BLANK:
+      self.setBacklight(False)
+    else:
+      if self.state == BLANK: self.setBacklight(True)
+      if state == AWAKE: self.axp.setLcdBrightness(self.brightness)
+      else: self.axp.setLcdBrightness(DIM_BRIGHTNESS)
+    self.state = state
+
+  def setBacklight(self, on):
+    #backlight is powered by AXP192 LDO2, minimal brightness is used if it can't be switched off
+    setLdo2 = getattr(self.axp, 'setLDO2State', None)
+    if setLdo2 != None: setLdo2(on)
+    elif not on: self.axp.setLcdBrightness(0)
+
+  #user activity, returns True if display was dimmed or blank
+  def wake(self):
+    self.lastActivity = utime.time()
+    if self.state == AWAKE: return False
+    self.wakes += 1
+    self.setState(AWAKE)
+    return True
+
+  #alert keeps display on and radio and cpu awake, returns display state
+  def update(self, alert):
+    self.alert = alert
+    now = utime.time()
+    if alert: self.lastActivity = now
+    idle = now - self.lastActivity
+    if idle >= self.blankAfter: self.setState(BLANK)
+    elif idle >= self.dimAfter: self.setState(DIMMED)
+    else: self.setState(AWAKE)
+    self.setRadioSleep(not alert)
+    return self.state
+
+  def setRadioSleep(self, sleep):
+    if self.pmSleep == None or sleep == self.radioSleep: return
+    if sleep: self.nic.config(pm=self.pmSleep)
+    else: self.nic.config(pm=self.pmAwake)
+    self.radioSleep = sleep
+
+  #waits until the next monitor step, button press wakes cpu from light sleep and its handler
+  #wakes display, so the first press isn't acted on. Wifi association is lost in light sleep
+  def sleep(self, seconds):
+    if self.alert or not self.lightSleep or seconds < LIGHT_SLEEP_MIN:
+      utime.sleep(seconds)
+      return
+    machine.lightsleep((int)(seconds * 1000))
+    self.lightSleeps += 1
+    if self.pinWake: self.wakeReason = machine.wake_reason()
@@ -0,0 +1,120 @@
+from array import array
+import ustruct as struct
+from history import RecordLog
+
+#Long range history of readings rolled up into fixed time buckets keeping min, mean and max
+#Buckets are kept in ring indexed by absolute bucket number like chart columns, so every reading
+#is added in O(1) and memory doesn't depend on number of readings. Bucket is persisted to log
+#when it's closed by newer reading, or again if older reading falls into closed bucket
+
+TIERS = ((900, 288), (3600, 336)) #(bucket seconds, buckets) 15 minutes for 3 days, hour for 14 days
+MAX_COUNT = 163 #sum of readings in bucket fits 16 bits
+
+#Log header fields: bucket seconds uint32. Record: bucket number uint32,
+#min uint16, max uint16, sum uint16, count uint8, checksum uint8
+LOG_MAGIC = b'SGVR'
+LOG_VERSION = 2
+RECORD_SIZE = 12
+RECORD_FORMAT = '<IHHHB'
+
+class SgvRollup:
+  def __init__(self, period, capacity, path=None):
+    self.period = period
+    self.capacity = capacity
+    self.path = path
+    #absolute bucket number + 1 stored in ring slot, 0 is empty slot
+    self.buckets = array('I', [0] * capacity)
+    self.low = array('H', [0] * capacity)
+    self.high = array('H', [0] * capacity)
+    self.sums = array('H', [0] * capacity)
+    self.counts = bytearray(capacity)
+    self.newest = 0 #newest bucket number + 1
+    self.changes = 0
+    self.log = None
+    if path != None: self.log = RecordLog(path, LOG_MAGIC, LOG_VERSION, RECORD_SIZE, struct.pack('<I', period))
+    #log is compacted to current buckets once it holds this many records
+    self.maxRecords = 2 * capacity
+
+  def span(self):
+    return self.period * self.capacity
+
+  def store(self, bucket, low, high, total, count):
+    i = bucket % self.capacity
+    self.buckets[i] = bucket + 1
+    self.low[i] = low
+    self.high[i] = high
+    self.sums[i] = total
+    self.counts[i] = count
+    if bucket >= self.newest: self.newest = bucket + 1
+
+  #returns False if reading is older than all kept buckets or its bucket is full
+  def add(self, seconds, sgv):
+    bucket = seconds // self.period
+    if bucket < self.newest - self.capacity: return False
+    closed = self.newest - 1
+    #newer bucket closes previous newest one, it can be overwritten only if it's out of range already
+    opened = bucket > closed and closed >= 0 and self.buckets[closed % self.capacity] == closed + 1
+    i = bucket % self.capacity
+    if self.buckets[i] != bucket + 1:
+      self.store(bucket, sgv, sgv, sgv, 1)
+    elif self.counts[i] >= MAX_COUNT:
+      return False
+    else:
+      if sgv < self.low[i]: self.low[i] = sgv
+      if sgv > self.high[i]: self.high[i] = sgv
+      self.sums[i] += sgv
+      self.counts[i] += 1
+    self.changes += 1
+    if opened and closed >= self.newest - self.capacity: self.append(closed)
+    elif bucket < self.newest - 1: self.append(bucket)
+    return True
+
+  #iterates (bucket start seconds, min, mean, max) from the oldest bucket with start <= seconds < end
+  def items(self, start=0, end=None):
+    first = start // self.period
+    if first < self.newest - self.capacity: first = self.newest - self.capacity
+    last = self.newest
+    if end != None and (end + self.period - 1) // self.period < last: last = (end + self.period - 1) // self.period
+    for bucket in range(first, last):
+      i = bucket % self.capacity
+      if self.buckets[i] != bucket + 1: continue
+      yield bucket * self.period, self.low[i], self.sums[i] // self.counts[i], self.high[i]
+
+  #reads all valid records, returns False if log doesn't exist or has unsupported format
+  def load(self):
+    if self.log == None or not self.log.read(self.addRecord): return False
+    self.changes += 1
+    if not self.log.valid or self.log.records >= self.maxRecords:
+      self.compact()
+    return True
+
+  def addRecord(self, chunk, offset):
+    bucket, low, high, total, count = struct.unpack_from(RECORD_FORMAT, chunk, offset)
+    if count > 0: self.store(bucket, low, high, total, count)
+
+  #adds readings of history newer than the last persisted bucket, they are lost on restart otherwise
+  def fill(self, history):
+    for seconds, sgv, direction in history.items(start=self.newest * self.period):
+      self.add(seconds, sgv)
+
+  def pack(self, bucket):
+    i = bucket % self.capacity
+    struct.pack_into(RECORD_FORMAT, self.log.record, 0, bucket, self.low[i], self.high[i], self.sums[i], self.counts[i])
+
+  def append(self, bucket):
+    if self.log == None: return
+    if self.log.records >= self.maxRecords:
+      self.compact()
+      return
+    self.pack(bucket)
+    self.log.append()
+
+  #closed buckets in range, the newest one is still open
+  def closed(self):
+    for bucket in range(self.newest - self.capacity, self.newest - 1):
+      if bucket >= 0 and self.buckets[bucket % self.capacity] == bucket + 1: yield bucket
+
+  #rewrites log with closed buckets
+  def compact(self):
+    if self.log == None: return
+    self.log.rewrite(self.closed(), self.pack)
@@ -0,0 +1,93 @@
+from history import DIRECTIONS
+
+#Glucose level classification compiled from rules into lookup table indexed by (sgv bucket, direction code)
+#Rule is dict with optional sgv range "min" and "max" (inclusive), "direction" name or list of names
+#and outcome fields "color", "led", "alert" and "arrow". First matching rule defining "color"
+#sets background color, led and alert level, first matching rule defining "arrow" sets arrow color
+
+ALERT_NONE = 0
+ALERT_WARNING = 1
+ALERT_EMERGENCY = 2
+
+MAX_SGV = 400 #cgm readings are capped at this value
+DAY = 86400
+
+def getDefaultRules(low, high, emergencyLow, emergencyHigh):
+  up = ["DoubleUp", "SingleUp", "FortyFiveUp"]
+  down = ["DoubleDown", "SingleDown", "FortyFiveDown"]
+  return [
+    {"max": emergencyLow, "color": "RED", "led": 1, "alert": ALERT_EMERGENCY},
+    #rising back to range
+    {"min": low-10, "max": low-1, "direction": up, "color": "DARKGREEN"},
+    {"min": emergencyLow+1, "max": low, "color": "RED", "led": 1, "alert": ALERT_WARNING},
+    {"min": low+1, "max": high, "color": "DARKGREEN"},
+    #falling back to range
+    {"min": high+1, "max": high+10, "direction": down, "color": "DARKGREEN"},
+    {"min": high+1, "max": emergencyHigh, "color": "ORANGE", "led": 1, "alert": ALERT_WARNING},
+    {"min": emergencyHigh+1, "color": "ORANGE", "led": 1, "alert": ALERT_EMERGENCY},
+    #fast changes heading out of range
+    {"min": high-20, "direction": "DoubleUp", "arrow": "RED"},
+    {"max": low+20, "direction": "DoubleDown", "arrow": "RED"},
+    {"min": high-10, "direction": "SingleUp", "arrow": "ORANGE"},
+    {"max": low+10, "direction": "SingleDown", "arrow": "ORANGE"}
+  ]
+
+#returns (color, led, arrow color or None, alert level) of the first matching rules
+def evaluate(rules, sgv, direction, getColor):
+  color = None
+  led = 1
+  alert = ALERT_NONE
+  arrow = None
+  for rule in rules:
+    if ("min" in rule and sgv < rule["min"]) or ("max" in rule and sgv > rule["max"]): continue
+    if "direction" in rule:
+      directions = rule["direction"]
+      if directions != direction and not (isinstance(directions, list) and direction in directions): continue
+    if color == None and "color" in rule:
+      color = getColor(rule["color"])
+      led = rule.get("led", 0)
+      alert = rule.get("alert", ALERT_NONE)
+    if arrow == None and "arrow" in rule:
+      arrow = getColor(rule["arrow"])
+  if color == None: color = getColor("DARKGREY")
+  return (color, led, arrow, alert)
+
+class RuleTable:
+  def __init__(self, rules, getColor):
+    #bounds of sgv ranges where outcome of any rule may change
+    bounds = [0]
+    for rule in rules:
+      if "min" in rule: bounds.append(rule["min"])
+      if "max" in rule: bounds.append(rule["max"] + 1)
+    bounds = sorted(set([b for b in bounds if b >= 0 and b <= MAX_SGV]))
+    if len(bounds) > 255: raise Exception("Too many glucose level rules")
+
+    self.buckets = bytearray(MAX_SGV + 1)
+    b = 0
+    for sgv in range(MAX_SGV + 1):
+      while b + 1 < len(bounds) and sgv >= bounds[b + 1]: b += 1
+      self.buckets[sgv] = b
+
+    self.outcomes = []
+    self.table = bytearray(len(bounds) * len(DIRECTIONS))
+    for b in range(len(bounds)):
+      for d in range(len(DIRECTIONS)):
+        outcome = evaluate(rules, bounds[b], DIRECTIONS[d], getColor)
+        if not outcome in self.outcomes: self.outcomes.append(outcome)
+        self.table[b * len(DIRECTIONS) + d] = self.outcomes.index(outcome)
+
+  def classify(self, sgv, directionCode):
+    if sgv < 0: sgv = 0
+    elif sgv > MAX_SGV: sgv = MAX_SGV
+    return self.outcomes[self.table[self.buckets[sgv] * len(DIRECTIONS) + directionCode]]
+
+#seconds of day of HH:MM:SS time
+def getSecondsOfDay(timeStr):
+  [HH, MM, SS] = [int(i) for i in timeStr.split(':')]
+  return HH * 3600 + MM * 60 + SS
+
+#window may span midnight when start is later than end
+def isInDailyWindow(seconds, start, end):
+  seconds = seconds % DAY
+  if start < end: return seconds > start and seconds < end
+  return seconds > start or seconds < end
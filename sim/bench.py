@@ -0,0 +1,462 @@
+#Benchmark of main.py running on the host simulator
+#Usage: python -m sim.bench [--hours N]
+
+import argparse
+import gc
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from sim.fakes import Clock
+from sim.harness import Simulator, memFree, runCycles
+from sim.server import NightscoutServer, defaultCurve
+
+#lcd calls which don't transfer pixels to the panel
+MEASURE_CALLS = ('font', 'fontSize', 'textWidth', 'setTextColor')
+
+failures = []
+
+def check(section, name, ok):
+  #failed checks are listed at the end and benchmark exits with status 1
+  if not ok: failures.append(section + ': ' + name)
+
+def benchPolls(hours):
+  #per poll latency, transferred bytes and heap allocations in steady state,
+  #returned together with stage summary collected by device metrics
+  with Simulator() as sim:
+    sim.boot()
+    server = sim.server
+    sim.poll()
+    server.resetStats()
+    axp = sim.device.axp
+    axp.reads = 0
+    latencies = []
+    peaks = []
+    polls = 0
+    end = sim.clock.time() + hours * 3600
+    tracemalloc.start()
+    try:
+      while sim.clock.time() < end:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        delay = sim.call(sim['backendPoll'])
+        latencies.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        sim.render()
+        polls += 1
+        cycle = sim['pollWaitCycle'](delay)
+        while True:
+          wait = sim.call(next, cycle, None)
+          if wait == None: break
+          sim.clock.sleep(wait)
+          sim.render()
+    finally:
+      tracemalloc.stop()
+    latencies.sort()
+    stages = sim['metrics'].summary()
+    return stages, {
+      'polls': polls,
+      'polls/hour': polls / float(hours),
+      'requests': server.requests,
+      'not modified': server.notModified,
+      'connections': server.connections,
+      'bytes/poll': (server.bytesSent + server.bytesReceived) / float(max(1, polls)),
+      'latency ms p50': latencies[len(latencies) // 2] * 1000,
+      'latency ms max': latencies[-1] * 1000,
+      'alloc peak bytes max': max(peaks),
+      'alloc peak bytes avg': sum(peaks) / float(len(peaks)),
+      'battery reads/hour': axp.reads / float(hours),
+    }
+
+def benchParser(counts=(10, 100, 1000)):
+  #peak allocation of streamed parsing of entries.json bodies of growing size read from in memory stream
+  results = {}
+  with Simulator() as sim:
+    sim.boot()
+    nightscout = sim['nightscout']
+    for count in counts:
+      body = json.dumps(sim.server.entries(count)).encode()
+      stream = io.BytesIO(body)
+      entries = [0]
+      def onEntry(sgv, direction, date, ago):
+        entries[0] += 1
+      tracemalloc.start()
+      try:
+        chunk = bytearray(nightscout.CHUNK_SIZE)
+        parser = nightscout.EntriesParser()
+        while True:
+          size = stream.readinto(chunk)
+          if not size: break
+          parser.feed(chunk, size, onEntry)
+        peak = tracemalloc.get_traced_memory()[1]
+      finally:
+        tracemalloc.stop()
+      results[count] = (len(body), entries[0], peak)
+  return results
+
+def benchModes():
+  #draw calls and touched pixels of full and incremental redraw in every display mode
+  results = {}
+  with Simulator() as sim:
+    sim.boot()
+    sim.poll()
+    lcd = sim.device.lcd
+    for index, name in enumerate(sim['MODES']):
+      sim['mode'] = index
+      lcd.reset()
+      sim.call(sim['requestRender'], True)
+      sim.render()
+      full = (lcd.drawCalls(), lcd.pixels)
+      lcd.reset()
+      sim.call(sim['requestRender'])
+      sim.render()
+      results[name] = full + (lcd.drawCalls(), lcd.pixels)
+  return results
+
+def benchBoot():
+  #wifi scans and cached screen of cold and warm boot
+  results = {}
+  workdir = tempfile.mkdtemp(prefix='m5sim-')
+  try:
+    for name in ('cold', 'warm'):
+      with Simulator(workdir=workdir) as sim:
+        sim.boot()
+        results[name] = (sim.device.wlan.scans, sim['patient'].cachedResponse)
+        sim.run(900)
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+  return results
+
+def renderFrames(config, start, heapFree=None):
+  #full redraw of every mode, returns {mode: (panel transfers, frame)}
+  results = {}
+  if heapFree != None: gc.mem_free = lambda: heapFree
+  try:
+    with Simulator(config=config, start=start) as sim:
+      sim.boot()
+      gc.mem_free = memFree
+      sim.poll()
+      lcd = sim.device.lcd
+      for index, name in enumerate(sim['MODES']):
+        sim['mode'] = index
+        lcd.reset()
+        lcd.clearPanel()
+        sim.call(sim['requestRender'], True)
+        sim.render()
+        transfers = sum(n for call, n in lcd.calls.items() if not call in MEASURE_CALLS)
+        results[name] = (transfers, sim.frame())
+  finally:
+    gc.mem_free = memFree
+  return results
+
+def benchFrames():
+  #panel transfers of direct drawing and off-screen composition, banded frames have to match full ones
+  #frames are compared at the same simulated time, chart and elapsed time depend on it
+  start = Clock().time()
+  direct = renderFrames({}, start)
+  full = renderFrames({"frameBuffer": 1}, start)
+  banded = renderFrames({"frameBuffer": 1}, start, heapFree=40000)
+  return dict((name, (direct[name][0], full[name][0], banded[name][0], full[name][1] == banded[name][1])) for name in direct)
+
+def benchHub(hours, followers=3, port=5599):
+  #backend requests of hub and followers sharing one clock and backend, then of followers after hub goes silent
+  clock = Clock()
+  config = {"hubGroup": "239.255.77.77", "hubPort": port}
+  hub = Simulator(config=dict(config, hub="hub"), clock=clock)
+  config["api-endpoint"] = hub.server.url
+  #the last follower is in other timezone, readings are shared in utc
+  screens = [Simulator(config=dict(config, hub="follower", timezone="GMT-5:00" if i == followers - 1 else "GMT+1:00"), clock=clock) for i in range(followers)]
+  devices = [hub] + screens
+  def getUtcNewest(sim):
+    return sim['patient'].history.newestTime() - sim['secondsDiff']
+  def getPolls(sims):
+    return sum(sim['metrics'].count[sim['metrics'].FETCH] for sim in sims)
+  try:
+    for sim in devices: sim.boot()
+    hub.server.resetStats()
+    tasks = [(hub, hub['backendCycle']()), (hub, hub['hubCycle']())] + [(sim, sim['followerCycle']()) for sim in screens]
+    runCycles(clock, tasks, hours * 3600)
+    alive = {
+      'backend requests': hub.server.requests,
+      'hub polls': getPolls([hub]),
+      'follower polls': getPolls(screens),
+      'packets received': sum(sim['hubListener'].packets for sim in screens),
+      'followers in sync': all(getUtcNewest(sim) == getUtcNewest(hub) for sim in screens)
+    }
+    #hub is switched off, followers have to fall back to polling backend
+    hub.server.resetStats()
+    for sim in devices: sim['metrics'].reset()
+    packets = alive['packets received']
+    runCycles(clock, tasks[2:], 3600)
+    silent = {
+      'backend requests': hub.server.requests,
+      'hub polls': 0,
+      'follower polls': getPolls(screens),
+      'packets received': sum(sim['hubListener'].packets for sim in screens) - packets,
+      'followers in sync': all(getUtcNewest(sim) >= clock.time() - 600 for sim in screens)
+    }
+    return dict((name, (alive[name], silent[name])) for name in alive)
+  finally:
+    for sim in devices:
+      for name in ('hubSender', 'hubListener'):
+        if sim.ns != None and sim[name] != None: sim[name].close()
+      sim.close()
+
+def benchPatients(hours, patients=3):
+  #polls of patients with readings uploaded at the same time, the last one is in alarm
+  clock = Clock()
+  servers = [NightscoutServer(clock).start() for i in range(patients - 2)]
+  servers.append(NightscoutServer(clock, curve=lambda seconds: 45).start())
+  config = {"name": "P1", "patients": [{"name": "P" + str(i + 2), "api-endpoint": server.url, "api-token": "token"} for i, server in enumerate(servers)]}
+  sim = Simulator(config=config, clock=clock)
+  servers.insert(0, sim.server)
+  connected = [0]
+  def countConnections(seconds):
+    n = len([p for p in sim['patients'] if p.client != None and p.client.sock != None])
+    if n > connected[0]: connected[0] = n
+  try:
+    sim.boot()
+    for server in servers: server.resetStats()
+    clock.onSleep = countConnections
+    runCycles(clock, [(sim, sim['backendCycle']()), (sim, sim['patientCycle']())], hours * 3600)
+    clock.onSleep = None
+    times = sorted(t for server in servers for t in server.times)
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    #requests of one round are done within a minute, patient in alarm should be the first one
+    others = [t for server in servers[:-1] for t in server.times]
+    alarmFirst = len([t for t in servers[-1].times if not [u for u in others if t - 60 <= u < t]])
+    return {
+      'polls per patient': ' '.join(str(server.requests) for server in servers),
+      'min request gap s': min(gaps),
+      'open connections': connected[0],
+      'alarm polled first': '%d/%d' % (alarmFirst, len(servers[-1].times)),
+      'shown patient': sim['patient'].name
+    }
+  finally:
+    for server in servers[1:]: server.stop()
+    sim.close()
+
+def benchBackfill(outage=2):
+  #readings missed during backend outage of given hours, sensor gap before it can't be filled
+  with Simulator() as sim:
+    sim.boot()
+    server = sim.server
+    clock = sim.clock
+    start = clock.time()
+    server.gaps = [(start + 600, start + 1500)]
+    cycle = sim['backendCycle']()
+    runCycles(clock, [(sim, cycle)], 1800)
+    server.online = False
+    runCycles(clock, [(sim, cycle)], outage * 3600)
+    server.online = True
+    recovered = clock.time()
+    server.resetStats()
+    runCycles(clock, [(sim, cycle)], 3600)
+    p = sim['patient']
+    diff = sim['secondsDiff']
+    stored = set(t - diff for t, sgv, direction in p.history.items())
+    expected = server.readingTimes(clock.time() - server.uploadLag, 1000, after=start)
+    requests = [path for path in server.paths if '$lt' in path or '%24lt' in path]
+    return {
+      'outage readings': len([t for t in expected if t < recovered]) - len([t for t in expected if t < start + 1800]),
+      'missing after 1 h': len([t for t in expected if not t in stored]),
+      'backfill requests': len(requests),
+      'backfill bytes': p.backfill.bytes,
+      'regular polls': server.requests - len(requests),
+    }
+
+def runPowerSave(sim, seconds, pressAt=None):
+  #steps single power save cycle like its thread would, button A is pressed once at pressAt seconds
+  cycle = sim['powerCycle']()
+  start = sim.clock.time()
+  while sim.clock.time() < start + seconds:
+    if pressAt != None and sim.clock.time() >= start + pressAt:
+      sim.call(sim.device.btnA.press)
+      pressAt = None
+    delay = sim.call(next, cycle)
+    sim.call(sim['power'].sleep, min(delay, start + seconds - sim.clock.time()))
+
+def benchPower(hours):
+  #modelled current of always awake device, power save mode and power save mode during alarm,
+  #device is moved after the first hour and its button is pressed half an hour later,
+  #wifi is reconnected after light sleep
+  results = {}
+  imuScript = [(0, (-1.0, 0.0, 0.0)), (3600, (-0.8, 0.2, 0.3)), (3610, (-1.0, 0.0, 0.0))]
+  for name, config, options in (('always on', {}, {}), ('power save', {"powerSave": 1}, {}), ('alarm', {"powerSave": 1}, {'curve': lambda seconds: 45})):
+    with Simulator(config=config, imuScript=imuScript, **options) as sim:
+      sim.boot()
+      model = sim.device.power
+      model.charge = model.seconds = model.backlightSeconds = model.lightSleepSeconds = 0
+      sim.device.wlan.connects = 0
+      sim.server.resetStats()
+      if sim['power'] == None:
+        runCycles(sim.clock, [(sim, sim['backendCycle']()), (sim, sim['emergencyCycle']()), (sim, sim['mpu6050Cycle']())], hours * 3600)
+        wakes = '-'
+      else:
+        runPowerSave(sim, hours * 3600, pressAt=5400)
+        wakes = sim['power'].wakes
+      results[name] = (model.averageCurrent(), model.batteryHours(), 100 * model.lightSleepSeconds / model.seconds,
+        100 * model.backlightSeconds / model.seconds, sim.server.requests, sim.device.wlan.connects, wakes)
+  return results
+
+def benchAsync(hours):
+  #backend requests, connections, not modified responses, rendered frames and age of the newest reading
+  #with monitors in threads and as tasks of single event loop
+  results = {}
+  for scheduler in ('thread', 'async'):
+    with Simulator(config={"scheduler": scheduler}) as sim:
+      sim.boot()
+      sim.server.resetStats()
+      if scheduler == 'async': sim.runAsync(hours * 3600)
+      else: runCycles(sim.clock, [(sim, sim['backendCycle']()), (sim, sim['emergencyCycle']()), (sim, sim['mpu6050Cycle']())], hours * 3600)
+      metrics = sim['metrics']
+      newest = sim['patient'].history.newestTime() - sim['secondsDiff']
+      results[scheduler] = (sim.server.requests, sim.server.connections, sim.server.notModified, metrics.count[metrics.RENDER], sim.clock.time() - newest)
+  return results
+
+def benchLongHistory(days=14):
+  #readings of days merged in order, buckets checked against readings and again after restart,
+  #long chart windows are drawn from buckets only
+  workdir = tempfile.mkdtemp(prefix='m5sim-')
+  results = {}
+  try:
+    with Simulator(workdir=workdir) as sim:
+      sim.boot()
+      p = sim['patient']
+      sim['polledPatient'] = p
+      now = sim.clock.time() + sim['secondsDiff']
+      readings = [(t, defaultCurve(t)) for t in range(now - days * 86400, now, 300)]
+      for seconds, sgv in readings:
+        sim.call(sim['mergeReading'], seconds, sgv, 4)
+      buckets = [list(rollup.items()) for rollup in p.rollups]
+      for rollup, items in zip(p.rollups, buckets):
+        expected = []
+        for start in sorted(set(t - t % rollup.period for t, sgv in readings if t >= now - rollup.span())):
+          values = [sgv for t, sgv in readings if start <= t < start + rollup.period]
+          expected.append((start, min(values), sum(values) // len(values), max(values)))
+        results['%dm buckets' % (rollup.period // 60)] = len(items)
+        results['%dm match' % (rollup.period // 60)] = items[-len(expected):] == expected[-len(items):]
+        results['%dm file bytes' % (rollup.period // 60)] = os.path.getsize(os.path.join(workdir, rollup.path))
+      results['rollup memory bytes'] = sum(len(r.buckets) * 4 + len(r.low) * 6 + len(r.counts) for r in p.rollups)
+      p.response = sim.call(sim['getCachedResponse'], p.history, True)
+      lcd = sim.device.lcd
+      sim['mode'] = 7
+      for hours in (24, 72, 168, 336):
+        sim['sgvChart'].setWindow(hours)
+        lcd.reset()
+        sim.call(sim['requestRender'], True)
+        sim.render()
+        results['chart %dh calls' % hours] = lcd.drawCalls()
+    with Simulator(workdir=workdir, start=sim.clock.time()) as sim:
+      sim.boot()
+      results['kept after restart'] = [list(rollup.items()) for rollup in sim['patient'].rollups] == buckets
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark main.py on simulated M5StickC Plus')
+  parser.add_argument('--hours', type=float, default=6, help='simulated hours of polling')
+  args = parser.parse_args()
+
+  print('Polling (%g simulated hours)' % args.hours)
+  stages, results = benchPolls(args.hours)
+  for name, value in results.items():
+    print('  %-22s %10.1f' % (name, value))
+  check('Polling', 'polls', results['polls'] > 0)
+  print('Device metrics')
+  for line in stages.split('\n'):
+    print('  ' + line)
+
+  print('Parser')
+  print('  %-20s %10s %10s %10s' % ('entries', 'bytes', 'parsed', 'peak'))
+  parser = benchParser()
+  for count, (size, parsed, peak) in parser.items():
+    print('  %-20d %10d %10d %10d' % (count, size, parsed, peak))
+    check('Parser', '%d entries parsed' % count, parsed == count)
+  #peak allocation mustn't grow with number of entries
+  check('Parser', 'flat peak', parser[max(parser)][2] <= parser[min(parser)][2] + 256)
+
+  print('Boot')
+  print('  %-20s %8s %14s' % ('', 'scans', 'cached screen'))
+  boot = benchBoot()
+  for name, (scans, cached) in boot.items():
+    print('  %-20s %8d %14s' % (name, scans, cached))
+  check('Boot', 'warm scans', boot['warm'][0] == 0)
+  check('Boot', 'warm cached screen', boot['warm'][1])
+
+  print('Rendering')
+  print('  %-20s %8s %10s %8s %10s' % ('mode', 'calls', 'pixels', 'calls', 'pixels'))
+  print('  %-20s %19s %19s' % ('', 'full redraw', 'incremental'))
+  for name, (calls, pixels, incCalls, incPixels) in benchModes().items():
+    print('  %-20s %8d %10d %8d %10d' % (name, calls, pixels, incCalls, incPixels))
+
+  print('Frame buffer')
+  print('  %-20s %8s %8s %8s %8s' % ('mode', 'direct', 'full', 'banded', 'equal'))
+  for name, (direct, full, banded, equal) in benchFrames().items():
+    print('  %-20s %8d %8d %8d %8s' % (name, direct, full, banded, equal))
+    check('Frame buffer', name + ' equal', equal)
+
+  print('Hub and 3 followers (%g simulated hours, then 1 hour without hub)' % args.hours)
+  print('  %-20s %10s %10s' % ('', 'with hub', 'hub silent'))
+  hub = benchHub(args.hours)
+  for name, (alive, silent) in hub.items():
+    print('  %-20s %10s %10s' % (name, alive, silent))
+  check('Hub', 'followers in sync', hub['followers in sync'] == (True, True))
+  check('Hub', 'follower polls', hub['follower polls'][0] == 0 and hub['follower polls'][1] > 0)
+
+  print('Patients (%g simulated hours, 3 patients, the last one in alarm)' % args.hours)
+  patients = benchPatients(args.hours)
+  for name, value in patients.items():
+    print('  %-20s %10s' % (name, value))
+  check('Patients', 'min request gap s', patients['min request gap s'] >= 5)
+  check('Patients', 'open connections', patients['open connections'] <= 1)
+  check('Patients', 'shown patient', patients['shown patient'] == 'P3')
+
+  print('Backfill (2 hour outage, then 1 hour)')
+  backfill = benchBackfill()
+  for name, value in backfill.items():
+    print('  %-20s %10s' % (name, value))
+  check('Backfill', 'missing after 1 h', backfill['missing after 1 h'] == 0)
+
+  print('Power (%g simulated hours, moved after 1 hour, button pressed after 1.5 hours)' % args.hours)
+  power = benchPower(args.hours)
+  print('  %-20s %10s %10s %10s' % ('', 'always on', 'power save', 'alarm'))
+  for i, name in enumerate(('avg current mA', 'battery life h', 'light sleep %', 'backlight on %', 'backend requests', 'wifi connects', 'display wakes')):
+    print('  %-20s %10s %10s %10s' % ((name,) + tuple(('%.1f' % power[mode][i]) if isinstance(power[mode][i], float) else power[mode][i] for mode in ('always on', 'power save', 'alarm'))))
+  check('Power', 'power save avg current', power['power save'][0] < power['always on'][0])
+  check('Power', 'power save backend requests', power['power save'][4] >= power['always on'][4] - 1)
+  check('Power', 'alarm backlight on', power['alarm'][3] == 100)
+
+  print('Scheduler (%g simulated hours)' % args.hours)
+  schedulers = benchAsync(args.hours)
+  print('  %-20s %10s %10s' % ('', 'thread', 'async'))
+  for i, name in enumerate(('backend requests', 'connections', 'not modified', 'frames rendered', 'newest age s')):
+    print('  %-20s %10s %10s' % (name, schedulers['thread'][i], schedulers['async'][i]))
+  for scheduler in ('thread', 'async'):
+    check('Scheduler', scheduler + ' newest age s', schedulers[scheduler][4] <= 600)
+    check('Scheduler', scheduler + ' backend requests', abs(schedulers[scheduler][0] - schedulers['thread'][0]) <= 1)
+    #both modes keep the connection alive between polls
+    check('Scheduler', scheduler + ' connections', schedulers[scheduler][1] < schedulers[scheduler][0])
+
+  print('Long history (14 simulated days)')
+  history = benchLongHistory()
+  for name, value in history.items():
+    print('  %-20s %10s' % (name, value))
+  for name in ('15m match', '60m match', 'kept after restart'):
+    check('Long history', name, history[name])
+
+  if failures:
+    print('Failed checks')
+    for failure in failures:
+      print('  ' + failure)
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,484 @@
+#Fakes of MicroPython and M5Stack modules used by main.py, driven by a virtual clock
+
+import asyncio
+import binascii
+import hashlib
+import calendar
+import heapq
+import json
+import math
+import os
+import socket
+import struct
+import sys
+import time
+import traceback
+import types
+
+EPOCH_OFFSET = 946684800 #device epoch is 2000-01-01
+
+class Clock:
+  def __init__(self, start=None):
+    if start == None: start = int(time.time()) - EPOCH_OFFSET
+    self.now = float(start)
+    self.slept = 0.0
+    self.onSleep = None
+    #power models of devices sharing the clock
+    self.listeners = []
+
+  def time(self):
+    return int(self.now)
+
+  def sleep(self, seconds):
+    for listener in self.listeners: listener(seconds)
+    self.now += seconds
+    self.slept += seconds
+    if self.onSleep != None: self.onSleep(seconds)
+
+  def ticksUs(self):
+    #real time spent in code plus virtual time spent sleeping
+    return int(time.perf_counter() * 1000000 + self.slept * 1000000)
+
+def localtime(seconds):
+  t = time.gmtime(seconds + EPOCH_OFFSET)
+  return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday - 1)
+
+def mktime(t):
+  return calendar.timegm(tuple(t[:6]) + (0, 0, 0)) - EPOCH_OFFSET
+
+def makeUtime(clock):
+  m = types.ModuleType('utime')
+  m.time = clock.time
+  m.sleep = clock.sleep
+  m.sleep_ms = lambda ms: clock.sleep(ms / 1000)
+  m.localtime = lambda seconds=None: localtime(clock.time() if seconds == None else seconds)
+  m.mktime = mktime
+  m.ticks_us = clock.ticksUs
+  m.ticks_ms = lambda: clock.ticksUs() // 1000
+  m.ticks_diff = lambda a, b: a - b
+  m.ticks_add = lambda a, b: a + b
+  return m
+
+FONT_HEIGHTS = {'FONT_DejaVu18': 18, 'FONT_DejaVu24': 24, 'FONT_DejaVu56': 56, 'FONT_Default': 12}
+COLORS = {'BLACK': 0x000000, 'WHITE': 0xFFFFFF, 'RED': 0xFF0000, 'ORANGE': 0xFFA500, 'DARKGREEN': 0x006400, 'DARKGREY': 0x808080,
+          'LIGHTGREY': 0xC0C0C0, 'GREENYELLOW': 0xADFF2F, 'OLIVE': 0x808000, 'BLUE': 0x0000FF, 'YELLOW': 0xFFFF00}
+
+#MicroPython framebuf subset used for off-screen composition, RGB565 pixels are stored little endian
+class FrameBuffer:
+  def __init__(self, buf, width, height, format):
+    self.buf = buf
+    self.width = width
+    self.height = height
+
+  def pixel(self, x, y, c=None):
+    if 0 <= x < self.width and 0 <= y < self.height:
+      i = (y * self.width + x) * 2
+      if c == None: return self.buf[i] | (self.buf[i+1] << 8)
+      self.buf[i] = c & 0xFF
+      self.buf[i+1] = c >> 8
+
+  def fill_rect(self, x, y, w, h, c):
+    x0 = max(0, x)
+    x1 = min(self.width, x + w)
+    if x1 <= x0: return
+    row = bytes((c & 0xFF, c >> 8)) * (x1 - x0)
+    for py in range(max(0, y), min(self.height, y + h)):
+      i = (py * self.width + x0) * 2
+      self.buf[i:i+len(row)] = row
+
+  def fill(self, c): self.fill_rect(0, 0, self.width, self.height, c)
+  def hline(self, x, y, w, c): self.fill_rect(x, y, w, 1, c)
+  def vline(self, x, y, h, c): self.fill_rect(x, y, 1, h, c)
+
+  def line(self, x0, y0, x1, y1, c):
+    #bresenham
+    dx = abs(x1 - x0)
+    dy = -abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx + dy
+    while True:
+      self.pixel(x0, y0, c)
+      if x0 == x1 and y0 == y1: break
+      e2 = 2 * err
+      if e2 >= dy: err += dy; x0 += sx
+      if e2 <= dx: err += dx; y0 += sy
+
+def makeFramebuf():
+  m = types.ModuleType('framebuf')
+  m.FrameBuffer = FrameBuffer
+  m.RGB565 = 1
+  return m
+
+PANEL_X = 40 #landscape window of M5StickC Plus ST7789 memory
+PANEL_Y = 52
+
+#lcd counting draw calls and approximate number of touched pixels
+class Lcd:
+  LANDSCAPE = 1
+  PORTRAIT = 0
+  WIDTH = 240
+  HEIGHT = 135
+
+  def __init__(self):
+    for name, color in COLORS.items():
+      setattr(self, name, color)
+    for name in FONT_HEIGHTS:
+      setattr(self, name, name)
+    self.fontName = 'FONT_Default'
+    self.reset()
+    self.clearPanel()
+
+  def reset(self):
+    self.calls = {}
+    self.pixels = 0
+
+  def clearPanel(self):
+    #pixels written with raw panel access, big endian RGB565
+    self.panel = bytearray(self.WIDTH * self.HEIGHT * 2)
+    self.window = (0, 0, 0, 0)
+
+  def count(self, name, pixels=0):
+    self.calls[name] = self.calls.get(name, 0) + 1
+    self.pixels += int(pixels)
+
+  def drawCalls(self):
+    return sum(self.calls.values())
+
+  def orient(self, orientation): self.count('orient')
+  def font(self, font, rotate=0): self.fontName = font; self.count('font')
+  def fontSize(self): self.count('fontSize'); return (FONT_HEIGHTS[self.fontName] // 2, FONT_HEIGHTS[self.fontName])
+  def textWidth(self, text): self.count('textWidth'); return int(len(text) * FONT_HEIGHTS[self.fontName] * 0.6)
+  def setTextColor(self, color, bgcolor=None): self.count('setTextColor')
+  def clear(self, color=None): self.count('clear', self.WIDTH * self.HEIGHT)
+  def fillRect(self, x, y, w, h, color=None): self.count('fillRect', max(0, w) * max(0, h))
+  def rect(self, x, y, w, h, color=None, fillcolor=None): self.count('rect', 2 * (w + h))
+  def line(self, x, y, x1, y1, color=None): self.count('line', math.hypot(x1 - x, y1 - y))
+  def pixel(self, x, y, color=None): self.count('pixel', 1)
+  def circle(self, x, y, r, color=None, fillcolor=None): self.count('circle', math.pi * r * r)
+  def fillTriangle(self, x, y, x1, y1, x2, y2, color=None): self.count('fillTriangle', abs((x1 - x) * (y2 - y) - (x2 - x) * (y1 - y)) / 2)
+  def triangle(self, x, y, x1, y1, x2, y2, color=None, fillcolor=None): self.count('triangle', abs((x1 - x) * (y2 - y) - (x2 - x) * (y1 - y)) / 2)
+  def print(self, text, x=0, y=0, color=None): self.count('print', len(text) * FONT_HEIGHTS[self.fontName] ** 2 * 0.6)
+  def textClear(self, x, y, text, color=None): self.count('textClear', len(text) * FONT_HEIGHTS[self.fontName] ** 2 * 0.6)
+  def image(self, x, y, file, scale=0, type=None): self.count('image', self.WIDTH * self.HEIGHT)
+
+  def tft_writecmddata(self, cmd, data):
+    self.count('tft_writecmddata', len(data) // 2 if cmd == 0x2C else 0)
+    if cmd == 0x2A or cmd == 0x2B:
+      start, end = struct.unpack('>HH', bytes(data))
+      if cmd == 0x2A: self.window = (start - PANEL_X, end - PANEL_X) + self.window[2:]
+      else: self.window = self.window[:2] + (start - PANEL_Y, end - PANEL_Y)
+    elif cmd == 0x2C:
+      x0, x1, y0, y1 = self.window
+      width = x1 - x0 + 1
+      data = bytes(data)
+      for row in range((len(data) // 2) // width):
+        i = ((y0 + row) * self.WIDTH + x0) * 2
+        self.panel[i:i + width * 2] = data[row * width * 2:(row + 1) * width * 2]
+
+#AXP192 with linear battery discharge model
+class Axp:
+  def __init__(self, clock, voltage=4.1, dischargePerHour=0.05, charging=False):
+    self.clock = clock
+    self.start = clock.time()
+    self.voltage = voltage
+    self.dischargePerHour = dischargePerHour
+    self.charging = charging
+    self.brightness = None
+    self.ldo2 = True #backlight supply
+    self.reads = 0
+
+  def getBatVoltage(self):
+    self.reads += 1
+    hours = (self.clock.time() - self.start) / 3600.0
+    if self.charging: return min(4.2, self.voltage + hours * self.dischargePerHour)
+    return max(3.0, self.voltage - hours * self.dischargePerHour)
+
+  def getChargeState(self):
+    self.reads += 1
+    return self.charging
+
+  def setLcdBrightness(self, brightness):
+    self.brightness = brightness
+
+  def setLDO2State(self, state):
+    self.ldo2 = state
+
+#IMU replaying scripted (seconds since start, (x, y, z)) keyframes
+class Imu:
+  def __init__(self, clock, script=None):
+    self.clock = clock
+    self.start = clock.time()
+    self.script = script or [(0, (-1.0, 0.0, 0.0))]
+    self.reads = 0
+
+  @property
+  def acceleration(self):
+    self.reads += 1
+    elapsed = self.clock.time() - self.start
+    current = self.script[0][1]
+    for at, value in self.script:
+      if at <= elapsed: current = value
+    return current
+
+class Led:
+  def __init__(self):
+    self.state = False
+    self.toggles = 0
+  def on(self): self.state = True; self.toggles += 1
+  def off(self): self.state = False; self.toggles += 1
+
+class Button:
+  def __init__(self):
+    self.callback = None
+  def wasPressed(self, callback=None):
+    self.callback = callback
+  def press(self):
+    if self.callback != None: self.callback()
+
+class Pwm:
+  def __init__(self, pin=None, freq=0, duty=0):
+    self.active = False
+  def pause(self): self.active = False
+  def resume(self): self.active = True
+  def duty(self, duty=None): pass
+  def freq(self, freq=None): pass
+
+class UdpSocket:
+  #host udp socket, ntp requests are answered with virtual clock time instead of being sent
+  def __init__(self, clock):
+    self.clock = clock
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.ntpRequested = False
+  def __getattr__(self, name):
+    return getattr(self.sock, name)
+  def sendto(self, data, addr):
+    if addr == ('ntp', 123):
+      self.ntpRequested = True
+      return len(data)
+    return self.sock.sendto(data, addr)
+  def recv(self, size):
+    if self.ntpRequested:
+      self.ntpRequested = False
+      return b'\0' * 40 + struct.pack('!I', self.clock.time() + 3155673600) + b'\0' * 4
+    return self.sock.recv(size)
+  def close(self):
+    self.sock.close()
+
+def makeUsocket(clock):
+  m = types.ModuleType('usocket')
+  m.__dict__.update(dict((k, v) for k, v in socket.__dict__.items() if not k.startswith('__')))
+  def getaddrinfo(host, port, *args):
+    if port == 123: return [(socket.AF_INET, socket.SOCK_DGRAM, 0, '', ('ntp', 123))]
+    return socket.getaddrinfo(host, port, *args)
+  def makeSocket(family=socket.AF_INET, type=socket.SOCK_STREAM, *args):
+    if type == socket.SOCK_DGRAM: return UdpSocket(clock)
+    return socket.socket(family, type, *args)
+  m.getaddrinfo = getaddrinfo
+  m.socket = makeSocket
+  return m
+
+CONNECT_SECONDS = 2.5 #association and dhcp renewal with known access point and channel
+
+class Wlan:
+  PM_NONE = 0
+  PM_POWERSAVE = 1
+
+  def __init__(self, ssids, clock):
+    self.ssids = ssids
+    self.clock = clock
+    self.pm = Wlan.PM_NONE
+    self.connected = False
+    #association completes after CONNECT_SECONDS
+    self.connectedAt = 0
+    self.scans = 0
+    self.connects = 0
+    self.isActive = False
+  def active(self, state=None):
+    if state != None: self.isActive = state
+    return self.isActive
+  def scan(self):
+    self.scans += 1
+    return [(ssid.encode(), b'\x01\x02\x03\x04\x05\x06', 6, -60, 3, False) for ssid in self.ssids]
+  def connect(self, ssid, password=None, bssid=None):
+    self.connects += 1
+    self.connected = ssid in self.ssids
+    self.connectedAt = self.clock.now + CONNECT_SECONDS
+  def disconnect(self): self.connected = False
+  def isconnected(self): return self.connected and self.clock.now >= self.connectedAt
+  def isConnecting(self): return self.connected and self.clock.now < self.connectedAt
+  def status(self, param=None):
+    if param == 'rssi': return -60
+    return 1010
+  def config(self, *args, **kwargs):
+    if 'pm' in kwargs: self.pm = kwargs['pm']
+    if args and args[0] == 'mac': return b'\x24\x0a\xc4\x00\x00\x01'
+    if args and args[0] == 'channel': return 6
+    return None
+
+#Modelled supply current in mA, rough figures of ESP32 and AXP192 datasheets meant to compare
+#configurations rather than to predict exact battery life. Time spent running code isn't counted
+BASE_MA = 6 #AXP192, lcd controller and imu
+CPU_AWAKE_MA = 30 #240 MHz waiting in idle task
+CPU_LIGHT_SLEEP_MA = 0.8
+RADIO_ON_MA = 80 #receiver always on
+RADIO_CONNECT_MA = 120 #association with transmit bursts
+RADIO_MODEM_SLEEP_MA = 15 #receiver woken for beacons
+BACKLIGHT_MA = 0.35 #per brightness step
+LED_MA = 4
+BEEPER_MA = 15
+BATTERY_MAH = 120
+
+class PowerModel:
+  def __init__(self, device):
+    self.device = device
+    self.charge = 0.0 #mAs
+    self.seconds = 0.0
+    self.backlightSeconds = 0.0
+    self.lightSleeping = False
+    self.lightSleepSeconds = 0.0
+
+  def current(self):
+    device = self.device
+    #radio is off in light sleep, association is dropped
+    radio = 0
+    if self.lightSleeping:
+      cpu = CPU_LIGHT_SLEEP_MA
+    else:
+      cpu = CPU_AWAKE_MA
+      if device.wlan.isConnecting(): radio = RADIO_CONNECT_MA
+      elif device.wlan.connected: radio = RADIO_MODEM_SLEEP_MA if device.wlan.pm == Wlan.PM_POWERSAVE else RADIO_ON_MA
+    backlight = 0
+    if device.axp.ldo2: backlight = BACKLIGHT_MA * (device.axp.brightness or 0)
+    beeper = BEEPER_MA if [pwm for pwm in device.pwms if pwm.active] else 0
+    return BASE_MA + cpu + radio + backlight + (LED_MA if device.led.state else 0) + beeper
+
+  def accrue(self, seconds):
+    self.charge += self.current() * seconds
+    self.seconds += seconds
+    if self.lightSleeping: self.lightSleepSeconds += seconds
+    if self.device.axp.ldo2 and self.device.axp.brightness: self.backlightSeconds += seconds
+
+  def lightsleep(self, ms):
+    #access point drops station which doesn't answer while sleeping
+    self.device.wlan.disconnect()
+    self.lightSleeping = True
+    try:
+      self.device.clock.sleep(ms / 1000.0)
+    finally:
+      self.lightSleeping = False
+
+  def averageCurrent(self):
+    return self.charge / max(self.seconds, 1e-9)
+
+  def batteryHours(self):
+    return BATTERY_MAH / self.averageCurrent()
+
+class FakeAsyncio(types.ModuleType):
+  #uasyncio on virtual clock, main coroutine passed to run() is recorded and simulator drives it.
+  #Sleeping tasks wake in order of virtual wake time, clock is advanced only when all tasks sleep
+  def __init__(self, clock):
+    types.ModuleType.__init__(self, 'uasyncio')
+    self.clock = clock
+    self.main = None
+    self.sleepers = []
+    self.order = 0
+    self.tasks = 0
+    self.open_connection = asyncio.open_connection
+    self.wait_for = asyncio.wait_for
+
+  def run(self, coro):
+    self.main = coro
+
+  def create_task(self, coro):
+    task = asyncio.ensure_future(coro)
+    self.tasks += 1
+    task.add_done_callback(self.finished)
+    return task
+
+  def finished(self, task):
+    self.tasks -= 1
+
+  async def sleep(self, seconds):
+    future = asyncio.get_running_loop().create_future()
+    self.order += 1
+    heapq.heappush(self.sleepers, (self.clock.now + seconds, self.order, future))
+    await future
+
+  async def drive(self, seconds):
+    #runs main coroutine with its tasks for given number of virtual seconds
+    end = self.clock.now + seconds
+    main = self.create_task(self.main)
+    while not main.done():
+      if len(self.sleepers) < self.tasks:
+        #some task runs or waits for network
+        await asyncio.sleep(0)
+        continue
+      wake, order, future = heapq.heappop(self.sleepers)
+      if wake >= end: break
+      if wake > self.clock.now: self.clock.sleep(wake - self.clock.now)
+      future.set_result(None)
+    if self.clock.now < end: self.clock.sleep(end - self.clock.now)
+    self.sleepers = []
+    if main.done(): main.result()
+
+class Device:
+  #hardware state shared by fake modules of one simulated device
+  def __init__(self, clock, ssids=('sim-wifi',), imuScript=None, voltage=4.1):
+    self.clock = clock
+    self.lcd = Lcd()
+    self.axp = Axp(clock, voltage=voltage)
+    self.imu = Imu(clock, imuScript)
+    self.led = Led()
+    self.btnA = Button()
+    self.btnB = Button()
+    self.wlan = Wlan(ssids, clock)
+    self.pwms = []
+    self.asyncio = FakeAsyncio(clock)
+    self.power = PowerModel(self)
+    clock.listeners.append(self.power.accrue)
+    self.resets = 0
+
+  def modules(self):
+    clock = self.clock
+    modules = {}
+    def add(name, **attrs):
+      m = types.ModuleType(name)
+      m.__dict__.update(attrs)
+      modules[name] = m
+    modules['utime'] = makeUtime(clock)
+    modules['usocket'] = makeUsocket(clock)
+    modules['ustruct'] = struct
+    modules['ubinascii'] = binascii
+    modules['uhashlib'] = hashlib
+    modules['framebuf'] = makeFramebuf()
+    modules['uos'] = os
+    modules['uasyncio'] = self.asyncio
+    add('ujson', loads=json.loads, dumps=json.dumps)
+    add('machine', Pin=lambda *a, **k: None, PWM=self.makePwm, RTC=lambda: types.SimpleNamespace(datetime=lambda *a: None),
+        reset=self.reset, unique_id=lambda: b'\x24\x0a\xc4\x00\x00\x01', freq=lambda *a: 240000000,
+        lightsleep=self.power.lightsleep, wake_reason=lambda: 4, EXT0_WAKE=2, EXT1_WAKE=3, TIMER_WAKE=4)
+    add('network', WLAN=lambda interface=0: self.wlan, STA_IF=0, AP_IF=1)
+    add('deviceCfg', get_apikey=lambda: 'SIMULATOR')
+    add('wifiCfg', wlan_sta=self.wlan)
+    add('imu', IMU=lambda: self.imu)
+    add('m5stack', lcd=self.lcd, axp=self.axp, M5Led=self.led, btnA=self.btnA, btnB=self.btnB, binascii=binascii)
+    return modules
+
+  def globals(self):
+    #names provided to main.py by 'from m5stack import *' in boot.py
+    return {'lcd': self.lcd, 'axp': self.axp, 'M5Led': self.led, 'btnA': self.btnA, 'btnB': self.btnB, 'binascii': binascii}
+
+  def makePwm(self, *args, **kwargs):
+    pwm = Pwm(*args, **kwargs)
+    self.pwms.append(pwm)
+    return pwm
+
+  def reset(self):
+    self.resets += 1
+    raise SystemExit('machine.reset()')
+
+def installMicroPythonBuiltins():
+  #functions MicroPython adds to CPython modules
+  #prints to stdout like on the device
+  sys.print_exception = lambda e, file=None: traceback.print_exception(type(e), e, e.__traceback__, file=file or sys.stdout)
@@ -0,0 +1,180 @@
+#Runs main.py on CPython with fake M5Stack hardware, a virtual clock and a local Nightscout server
+
+import asyncio
+import gc
+import heapq
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import tracemalloc
+import types
+
+from sim.fakes import Clock, Device, installMicroPythonBuiltins
+from sim.server import NightscoutServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAP_SIZE = 110 * 1024 #heap available to MicroPython on M5StickC Plus without psram
+DEVICE_MODULES = ('nightscout', 'history', 'metrics', 'rules', 'battery', 'orientation', 'chart', 'frame', 'glyphs', 'trend', 'fanout', 'patients', 'rollup', 'backfill', 'logger', 'power')
+
+DEFAULT_CONFIG = {
+  "wifi": {"sim-wifi": "password"},
+  "api-token": "token",
+  "interval": 60,
+  "beeper": 1,
+  "beeperStartTime": "00:00:00",
+  "beeperEndTime": "23:59:59",
+  "min": 75,
+  "max": 180,
+  "emergencyMin": 50,
+  "emergencyMax": 250,
+  "locale": "en-US",
+  "timezone": "GMT+1:00",
+  "oldData": 15
+}
+
+def memFree():
+  if tracemalloc.is_tracing(): return HEAP_SIZE - tracemalloc.get_traced_memory()[0]
+  return HEAP_SIZE
+
+#MicroPython gc functions used by main.py
+gc.mem_free = memFree
+gc.mem_alloc = lambda: HEAP_SIZE - memFree()
+
+class FakeThread(types.ModuleType):
+  #threads are recorded instead of started, simulator drives their work step by step
+  def __init__(self):
+    types.ModuleType.__init__(self, '_thread')
+    self.started = []
+    self.allocate_lock = threading.Lock
+    self.get_ident = threading.get_ident
+
+  def start_new_thread(self, function, args):
+    self.started.append(function)
+
+class Simulator:
+  def __init__(self, config=None, imuScript=None, voltage=4.1, uploadLag=30, workdir=None, quiet=True, start=None, clock=None, **serverOptions):
+    #start is simulated utc time in device epoch seconds, current time by default,
+    #devices talking to each other share one clock
+    if clock == None: clock = Clock(start)
+    self.clock = clock
+    self.device = Device(self.clock, imuScript=imuScript, voltage=voltage)
+    self.server = NightscoutServer(self.clock, uploadLag=uploadLag, **serverOptions).start()
+    self.config = dict(DEFAULT_CONFIG)
+    self.config["api-endpoint"] = self.server.url
+    if config: self.config.update(config)
+    self.ownWorkdir = workdir == None
+    self.workdir = workdir or tempfile.mkdtemp(prefix='m5sim-')
+    self.quiet = quiet
+    self.ns = None
+    self.thread = FakeThread()
+    self.output = open(os.devnull, 'w') if quiet else None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    self.server.stop()
+    if self.output != None: self.output.close()
+    if self.ownWorkdir: shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def call(self, function, *args, **kwargs):
+    #runs device code with its working directory and optionally silenced console
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    os.chdir(self.workdir)
+    if self.output != None: sys.stdout = self.output
+    try:
+      return function(*args, **kwargs)
+    finally:
+      sys.stdout = stdout
+      os.chdir(cwd)
+
+  def boot(self):
+    with open(os.path.join(self.workdir, 'config.json'), 'w') as f:
+      json.dump(self.config, f)
+    installMicroPythonBuiltins()
+    modules = self.device.modules()
+    modules['_thread'] = self.thread
+    saved = dict((name, sys.modules.get(name)) for name in list(modules) + list(DEVICE_MODULES))
+    sys.modules.update(modules)
+    for name in DEVICE_MODULES: sys.modules.pop(name, None)
+    sys.path.insert(0, ROOT)
+    self.ns = self.device.globals()
+    self.ns['__name__'] = '__main__'
+    path = os.path.join(ROOT, 'main.py')
+    try:
+      with open(path) as f:
+        code = compile(f.read(), path, 'exec')
+      self.call(exec, code, self.ns)
+    finally:
+      sys.path.remove(ROOT)
+      for name, module in saved.items():
+        if module == None: sys.modules.pop(name, None)
+        else: sys.modules[name] = module
+    return self
+
+  def __getitem__(self, name):
+    return self.ns[name]
+
+  def __setitem__(self, name, value):
+    self.ns[name] = value
+
+  def render(self):
+    #runs pending render request like the render worker would
+    signal = self.ns['renderSignal']
+    if signal.acquire(False):
+      self.call(self.ns['renderPending'])
+      return True
+    return False
+
+  def frame(self):
+    #panel memory written by off-screen composition
+    return bytes(self.device.lcd.panel)
+
+  def poll(self):
+    #single backend poll followed by rendering, returns delay until next poll
+    delay = self.call(self.ns['backendPoll'])
+    self.render()
+    return delay
+
+  def run(self, seconds):
+    #runs backend polling for given number of virtual seconds, returns number of polls
+    end = self.clock.time() + seconds
+    polls = 0
+    while self.clock.time() < end:
+      delay = self.poll()
+      polls += 1
+      cycle = self.ns['pollWaitCycle'](delay)
+      while True:
+        wait = self.call(next, cycle, None)
+        if wait == None: break
+        self.clock.sleep(wait)
+        self.render()
+    return polls
+
+  def runAsync(self, seconds):
+    #runs tasks of async scheduler mode for given number of virtual seconds, they are left
+    #cancelled afterwards, so device has to be booted again to run them once more
+    self.call(asyncio.run, self.device.asyncio.drive(seconds))
+
+def runCycles(clock, tasks, seconds):
+  #runs monitor cycles of devices sharing the clock for given number of virtual seconds,
+  #tasks are (simulator, cycle) pairs and every step is followed by rendering of its device
+  end = clock.time() + seconds
+  queue = [(clock.now, i) for i in range(len(tasks))]
+  heapq.heapify(queue)
+  while queue:
+    at, i = heapq.heappop(queue)
+    if at >= end: break
+    if at > clock.now: clock.sleep(at - clock.now)
+    sim, cycle = tasks[i]
+    delay = sim.call(next, cycle, None)
+    sim.render()
+    if delay != None: heapq.heappush(queue, (clock.now + delay, i))
+  if clock.now < end: clock.sleep(end - clock.now)
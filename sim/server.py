@@ -0,0 +1,144 @@
+#Local stand-in of Nightscout entries api serving readings generated on the simulated clock
+
+import json
+import math
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from sim.fakes import EPOCH_OFFSET, localtime
+
+DIRECTIONS = ((-3.0, 'DoubleDown'), (-2.0, 'SingleDown'), (-1.0, 'FortyFiveDown'), (1.0, 'Flat'), (2.0, 'FortyFiveUp'), (3.0, 'SingleUp'))
+
+#glucose curve oscillating between ~70 and ~210 mg/dL
+def defaultCurve(seconds):
+  return int(140 + 70 * math.sin(seconds / 7200.0))
+
+class NightscoutServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, clock, period=300, uploadLag=30, curve=defaultCurve, extraFields=True):
+    HTTPServer.__init__(self, ('127.0.0.1', 0), NightscoutHandler)
+    self.clock = clock
+    self.period = period
+    self.uploadLag = uploadLag
+    self.curve = curve
+    self.extraFields = extraFields
+    #readings are aligned to this phase, simulated time in device epoch seconds
+    self.phase = clock.time() % period
+    self.gaps = []
+    self.online = True
+    self.lock = threading.Lock()
+    self.resetStats()
+
+  def resetStats(self):
+    self.requests = 0
+    self.notModified = 0
+    self.connections = 0
+    self.bytesSent = 0
+    self.bytesReceived = 0
+    self.paths = []
+    self.times = [] #simulated time of requests
+
+  @property
+  def url(self):
+    return 'http://127.0.0.1:' + str(self.server_port) + '/api/v1'
+
+  def start(self):
+    thread = threading.Thread(target=self.serve_forever, daemon=True)
+    thread.start()
+    return self
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+  def readingTimes(self, newest, count, after=None, before=None):
+    #utc device epoch seconds of readings uploaded until newest, newest first
+    t = newest - ((newest - self.phase) % self.period)
+    times = []
+    while len(times) < count and (after == None or t > after):
+      if before == None or t < before:
+        if not any(start <= t < end for start, end in self.gaps): times.append(t)
+      t -= self.period
+    return times
+
+  def entries(self, count, after=None, before=None, tzSeconds=0):
+    now = self.clock.time()
+    result = []
+    times = self.readingTimes(now - self.uploadLag, count, after, before)
+    for i, t in enumerate(times):
+      sgv = self.curve(t)
+      delta = sgv - self.curve(t - self.period)
+      direction = 'DoubleUp'
+      for limit, name in DIRECTIONS:
+        if delta / 5.0 < limit: direction = name; break
+      local = localtime(t + tzSeconds)
+      entry = {'sgv': sgv, 'direction': direction, 'date': '%04d-%02d-%02dT%02d:%02d:%02d' % local[:6],
+               'ago': str((now - t) // 60) + ' min ago'}
+      if self.extraFields:
+        entry.update({'_id': '%024x' % t, 'device': 'xDrip-DexcomG6', 'dateString': entry['date'] + '.000Z',
+                      'type': 'sgv', 'noise': 1, 'filtered': sgv * 1000, 'unfiltered': sgv * 1000, 'rssi': 100,
+                      'delta': delta, 'sysTime': entry['date'], 'utcOffset': tzSeconds // 60, 'mills': (t + EPOCH_OFFSET) * 1000})
+      result.append(entry)
+    return result
+
+def getTzSeconds(tz):
+  m = re.match(r'GMT([+-])(\d+):(\d+)', tz or '')
+  if m == None: return 0
+  seconds = int(m.group(2)) * 3600 + int(m.group(3)) * 60
+  if m.group(1) == '-': seconds = -seconds
+  return seconds
+
+class NightscoutHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    with self.server.lock: self.server.connections += 1
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    server = self.server
+    path, _, query = self.path.partition('?')
+    with server.lock:
+      server.requests += 1
+      server.bytesReceived += len(self.requestline) + sum(len(k) + len(v) + 4 for k, v in self.headers.items()) + 4
+      server.paths.append(self.path)
+      server.times.append(server.clock.time())
+    if not server.online:
+      self.sendBody(503, b'{"status":503}')
+      return
+    if not path.endswith('/entries.json'):
+      self.sendBody(404, b'{"status":404}')
+      return
+    params = dict(p.split('=', 1) for p in query.split('&') if '=' in p)
+    count = int(params.get('count', 10))
+    after = params.get('find[date][$gt]') or params.get('find%5Bdate%5D%5B%24gt%5D')
+    before = params.get('find[date][$lt]') or params.get('find%5Bdate%5D%5B%24lt%5D')
+    if after != None: after = int(after) // 1000 - EPOCH_OFFSET
+    if before != None: before = int(before) // 1000 - EPOCH_OFFSET
+    body = json.dumps(server.entries(count, after, before, getTzSeconds(self.headers.get('x-gms-tz')))).encode()
+    etag = '"' + str(hash(body) & 0xffffffff) + '"'
+    if self.headers.get('If-None-Match') == etag:
+      with server.lock: server.notModified += 1
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      with server.lock: server.bytesSent += 80
+      return
+    self.sendBody(200, body, etag)
+
+  def sendBody(self, status, body, etag=None):
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    if etag != None: self.send_header('ETag', etag)
+    self.end_headers()
+    self.wfile.write(body)
+    with self.server.lock: self.server.bytesSent += len(body) + 150
@@ -0,0 +1,118 @@
+#Glucose level trend fitted with least squares line over readings of the last window seconds
+#Fit is kept as running sums of the readings in window, new readings are added and readings
+#leaving the window are subtracted, so update is O(1) per reading instead of full history pass.
+#Times are relative to the newest reading, which keeps the sums small integers
+#Sums are changed only by update() in the thread merging readings, which publishes the fitted
+#line as one tuple, so other threads read consistent fit without locking
+
+WINDOW = 1800 #sec
+MIN_READINGS = 3
+MIN_SPAN = 600 #sec, readings in window have to cover at least this time to fit a trend
+
+class TrendAnalyzer:
+  def __init__(self, history, window=WINDOW):
+    self.history = history
+    self.window = window
+    self.updates = 0
+    #(slope, fitted value, time origin) of the last update or None
+    self.line = None
+    self.reset()
+
+  def reset(self):
+    self.n = 0
+    self.sx = 0
+    self.sy = 0
+    self.sxx = 0
+    self.sxy = 0
+    self.origin = 0 #time of the newest reading in window
+    self.first = 0 #time of the oldest reading in window
+    self.changes = -1
+
+  def include(self, seconds, sgv, sign):
+    x = seconds - self.origin
+    self.n += sign
+    self.sx += sign * x
+    self.sy += sign * sgv
+    self.sxx += sign * x * x
+    self.sxy += sign * x * sgv
+
+  #moves time origin to newer reading
+  def shift(self, seconds):
+    d = seconds - self.origin
+    self.sxx += -2 * d * self.sx + self.n * d * d
+    self.sxy -= d * self.sy
+    self.sx -= self.n * d
+    self.origin = seconds
+
+  def update(self):
+    self.updateSums()
+    self.line = self.solve()
+
+  #adds readings appended to history since last update, all readings in window are summed again
+  #only if history was changed in other way than by appending newer readings
+  def updateSums(self):
+    history = self.history
+    appended = 0
+    if self.changes >= 0:
+      for reading in history.items(start=self.origin + 1): appended += 1
+    if self.changes < 0 or history.changes - self.changes != appended or (self.n > 0 and history.oldestTime() > self.first):
+      self.reset()
+      start = history.newestTime() - self.window
+    else:
+      start = self.origin + 1
+    self.changes = history.changes
+    if len(history) == 0: return
+    for seconds, sgv, direction in history.items(start=start):
+      if self.n == 0: self.first = seconds
+      self.shift(seconds)
+      self.include(seconds, sgv, 1)
+      self.updates += 1
+    cutoff = self.origin - self.window
+    if self.first >= cutoff: return
+    for seconds, sgv, direction in history.items(start=self.first, end=cutoff):
+      self.include(seconds, sgv, -1)
+      self.updates += 1
+    for seconds, sgv, direction in history.items(start=cutoff):
+      self.first = seconds
+      break
+
+  def isValid(self):
+    return self.n >= MIN_READINGS and self.origin - self.first >= MIN_SPAN
+
+  def solve(self):
+    if not self.isValid(): return None
+    d = self.n * self.sxx - self.sx * self.sx
+    if d == 0: return None
+    slope = (self.n * self.sxy - self.sx * self.sy) / d
+    return slope, (self.sy - slope * self.sx) / self.n, self.origin
+
+  #returns (slope in mg/dL per second, fitted value at the newest reading time) of the last update or None
+  def fit(self):
+    line = self.line
+    if line == None: return None
+    return line[0], line[1]
+
+  #rate of change in mg/dL per minute or None
+  def getRate(self):
+    f = self.fit()
+    if f == None: return None
+    return f[0] * 60
+
+  #predicted glucose level at local seconds since device epoch or None
+  def predict(self, seconds):
+    line = self.line
+    if line == None: return None
+    return line[1] + line[0] * (seconds - line[2])
+
+  #returns (threshold, seconds from now) of low or high threshold the trend is heading to
+  #if it is predicted to be reached within horizon seconds, otherwise None
+  def getCrossing(self, now, low, high, horizon):
+    line = self.line
+    if line == None or line[0] == 0: return None
+    slope, value, origin = line
+    threshold = high
+    if slope < 0: threshold = low
+    seconds = (threshold - value - slope * (now - origin)) / slope
+    if seconds > horizon: return None
+    if seconds < 0: seconds = 0
+    return threshold, (int)(seconds)